@@ -8,6 +8,7 @@ from src.model_fn import BertMultiTask
 from src.params import Params
 from src.estimator import Estimator
 from src.ckpt_restore_hook import RestoreCheckpointHook
+from src.input_stats_hook import InputStatsHook
 from src import metrics
 from src.utils import TRAIN, EVAL, PREDICT
 
@@ -69,13 +70,18 @@ def main(_):
         config=run_config)
 
     if FLAGS.schedule == 'train':
-        train_hook = RestoreCheckpointHook(params)
+        train_hooks = [RestoreCheckpointHook(params)]
+        if params.input_stats:
+            train_hooks.append(InputStatsHook(
+                params, num_replicas=int(FLAGS.gpu)))
 
-        def train_input_fn(): return train_eval_input_fn(params)
+        def train_input_fn(input_context=None): return train_eval_input_fn(
+            params, input_context=input_context)
         estimator.train(
-            train_input_fn, max_steps=params.train_steps, hooks=[train_hook])
+            train_input_fn, max_steps=params.train_steps, hooks=train_hooks)
 
-        def input_fn(): return train_eval_input_fn(params, mode='eval')
+        def input_fn(input_context=None): return train_eval_input_fn(
+            params, mode='eval', input_context=input_context)
         estimator.evaluate(input_fn=input_fn)
 
     elif FLAGS.schedule == 'eval':
@@ -134,7 +134,10 @@ class BertModel(object):
                input_mask=None,
                token_type_ids=None,
                use_one_hot_embeddings=True,
-               scope=None):
+               scope=None,
+               position_ids=None,
+               attention_mask=None,
+               pooled_positions=None):
     """Constructor for BertModel.
 
     Args:
@@ -149,6 +152,14 @@ class BertModel(object):
         it is must faster if this is True, on the CPU or GPU, it is faster if
         this is False.
       scope: (optional) variable scope. Defaults to "bert".
+      position_ids: (optional) int32 Tensor of shape [batch_size, seq_length].
+        Position of each token, defaults to [0, 1, ..., seq_length-1].
+      attention_mask: (optional) float32 Tensor of shape [batch_size,
+        seq_length, seq_length]. Overrides the mask created from `input_mask`.
+      pooled_positions: (optional) int32 Tensor of shape [batch_size,
+        num_pooled]. Positions to pool from, the pooled output will be of
+        shape [batch_size * num_pooled, hidden_size]. Defaults to the first
+        token of each sequence.
 
     Raises:
       ValueError: The config is invalid or one of the input tensor shapes
@@ -192,14 +203,16 @@ class BertModel(object):
             position_embedding_name="position_embeddings",
             initializer_range=config.initializer_range,
             max_position_embeddings=config.max_position_embeddings,
-            dropout_prob=config.hidden_dropout_prob)
+            dropout_prob=config.hidden_dropout_prob,
+            position_ids=position_ids)
 
       with tf.variable_scope("encoder"):
         # This converts a 2D mask of shape [batch_size, seq_length] to a 3D
         # mask of shape [batch_size, seq_length, seq_length] which is used
         # for the attention scores.
-        attention_mask = create_attention_mask_from_input_mask(
-            input_ids, input_mask)
+        if attention_mask is None:
+          attention_mask = create_attention_mask_from_input_mask(
+              input_ids, input_mask)
 
         # Run the stacked transformer.
         # `sequence_output` shape = [batch_size, seq_length, hidden_size].
@@ -225,7 +238,18 @@ class BertModel(object):
       with tf.variable_scope("pooler"):
         # We "pool" the model by simply taking the hidden state corresponding
         # to the first token. We assume that this has been pre-trained
-        first_token_tensor = tf.squeeze(self.sequence_output[:, 0:1, :], axis=1)
+        if pooled_positions is None:
+          first_token_tensor = tf.squeeze(
+              self.sequence_output[:, 0:1, :], axis=1)
+        else:
+          # e.g. the first token of every sequence packed in one row
+          flat_offsets = tf.reshape(
+              tf.range(0, batch_size, dtype=tf.int32) * seq_length, [-1, 1])
+          flat_positions = tf.reshape(pooled_positions + flat_offsets, [-1])
+          first_token_tensor = tf.gather(
+              tf.reshape(self.sequence_output,
+                         [batch_size * seq_length, config.hidden_size]),
+              flat_positions)
         self.pooled_output = tf.layers.dense(
             first_token_tensor,
             config.hidden_size,
@@ -436,7 +460,8 @@ def embedding_postprocessor(input_tensor,
                             position_embedding_name="position_embeddings",
                             initializer_range=0.02,
                             max_position_embeddings=512,
-                            dropout_prob=0.1):
+                            dropout_prob=0.1,
+                            position_ids=None):
   """Performs various post-processing on a word embedding tensor.
 
   Args:
@@ -457,6 +482,9 @@ def embedding_postprocessor(input_tensor,
       used with this model. This can be longer than the sequence length of
       input_tensor, but cannot be shorter.
     dropout_prob: float. Dropout probability applied to the final output tensor.
+    position_ids: (optional) int32 Tensor of shape [batch_size, seq_length].
+      If specified, position embeddings are looked up by these ids instead of
+      [0, 1, ..., seq_length-1].
 
   Returns:
     float tensor with same shape as `input_tensor`.
@@ -495,6 +523,11 @@ def embedding_postprocessor(input_tensor,
           name=position_embedding_name,
           shape=[max_position_embeddings, width],
           initializer=create_initializer(initializer_range))
+      if position_ids is not None:
+        # Positions are given explicitly, e.g. they restart at every
+        # sequence packed in one row.
+        output += tf.gather(full_position_embeddings, position_ids)
+        return layer_norm_and_dropout(output, dropout_prob)
       # Since the position embedding table is a learned variable, we create it
       # using a (long) sequence length `max_position_embeddings`. The actual
       # sequence length might be shorter than this, for faster training of
@@ -1,28 +1,36 @@
+import atexit
 import random
-from copy import copy
+import itertools
+import collections
+import multiprocessing
 import numpy as np
 
 import tensorflow as tf
 
 from .utils import (punc_augument, tokenize_text_with_seqs,
-                    create_mask_and_padding, create_masked_lm_predictions,
+                    create_mask_and_padding, MaskedLmMasker,
                     truncate_seq_pair, add_special_tokens_with_seqs,
                     BOS_TOKEN, EOS_TOKEN,
                     create_instances_from_document)
-from .tokenization import printable_text
+from .tokenization import printable_text, get_tokenizer
+from .feature_cache import (use_feature_cache, write_feature_cache,
+                            read_feature_cache)
+from .input_state import InputState, load_input_state
 
 
-def create_single_problem_generator(problem,
-                                    inputs_list,
-                                    target_list,
-                                    label_encoder,
-                                    params,
-                                    tokenizer,
-                                    mode):
-    """Function to create iterator for single problem
+def featurize_single_example(problem,
+                             raw_inputs,
+                             raw_target,
+                             label_encoder,
+                             params,
+                             tokenizer,
+                             mode,
+                             ex_index=0):
+    """Function to featurize one example of single problem without padding
 
     This function will:
-        1. Do some text cleaning using original bert tokenizer, if
+        1. Do some text cleaning using original bert tokenizer, or
+            FullTokenizer.convert_chars_to_ids for char list inputs. If
             problem type is sequential tagging, corresponding labels
             will be removed.
 
@@ -30,84 +38,114 @@ def create_single_problem_generator(problem,
                 Before: inputs: ['a', '&', 'c'] target: [0, 0, 1]
                 After: inputs: ['a', 'c'] target: [0, 1]
         2. Add [CLS], [SEP] tokens
-        3. Padding
-        4. yield result dict
+        3. Convert tokens and labels to ids
 
     Arguments:
         problem {str} -- problem name
-        inputs_list {list } -- inputs list
-        target_list {list} -- target list, should have the same length as inputs list
+        raw_inputs {list or dict} -- inputs of one example
+        raw_target {list or str} -- target of one example
         label_encoder {LabelEncoder} -- label encoder
         params {Params} -- params
         tokenizer {tokenizer} -- Bert Tokenizer
-        epoch {int} -- Deprecate
+        mode {mode} -- mode
+
+    Keyword Arguments:
+        ex_index {int} -- index of example, for logging (default: {0})
+
+    Returns:
+        dict -- unpadded features, keys: input_ids, segment_ids, {problem}_label_ids.
+            None if the example is broken.
     """
+    return featurize_chained_example(
+        [problem], raw_inputs, [raw_target], [label_encoder],
+        params, tokenizer, mode, ex_index)
+
 
-    problem_type = params.problem_type[problem]
+def featurize_chained_example(problems,
+                              raw_inputs,
+                              raw_targets,
+                              label_encoders,
+                              params,
+                              tokenizer,
+                              mode,
+                              ex_index=0):
+    """Function to featurize one example of chained problems that share
+    inputs, e.g. weibo_ner&weibo_cws. Inputs are featurized once and
+    every problem adds its label ids. See featurize_single_example.
 
-    # whether this problem is sequential labeling
+    Arguments:
+        problems {list} -- problem names
+        raw_inputs {list or dict} -- inputs of one example
+        raw_targets {list} -- target of one example of every problem
+        label_encoders {list} -- label encoder of every problem
+        params {Params} -- params
+        tokenizer {tokenizer} -- Bert Tokenizer
+        mode {mode} -- mode
+
+    Keyword Arguments:
+        ex_index {int} -- index of example, for logging (default: {0})
+
+    Returns:
+        dict -- unpadded features, keys: input_ids, segment_ids and
+            {problem}_label_ids of every problem. None if the example is broken.
+    """
+    # whether every problem is sequential labeling
     # for sequential labeling, targets needs to align with any
     # change of inputs
-    is_seq = problem_type in ['seq_tag']
+    is_seq_list = [params.problem_type[problem] in ['seq_tag']
+                   for problem in problems]
 
-    for ex_index, example in enumerate(zip(inputs_list, target_list)):
-        raw_inputs, raw_target = example
+    # punctuation augumentation
+    if params.punc_replace_prob > 0 and mode == 'train':
+        raw_inputs = punc_augument(raw_inputs, params)
 
-        # punctuation augumentation
-        if params.punc_replace_prob > 0 and mode == 'train':
-            raw_inputs = punc_augument(raw_inputs, params)
+    # char list inputs are mapped to ids directly, the length is
+    # fixed unless chars are dropped
+    char_level = isinstance(raw_inputs, list)
+    if char_level:
+        tokens_a, dropped = tokenizer.convert_chars_to_ids(raw_inputs)
+        tokens_b = None
+        if dropped:
+            tf.logging.warning('Data %d broken, dropped chars at %s' % (
+                ex_index, dropped))
+            return None
+    # tokenize inputs, now the length is fixed
+    elif isinstance(raw_inputs, dict):
+        tokens_a, _ = tokenize_text_with_seqs(
+            tokenizer, raw_inputs['a'], None)
+        tokens_b, _ = tokenize_text_with_seqs(
+            tokenizer, raw_inputs['b'], None)
+    else:
+        tokens_a, _ = tokenize_text_with_seqs(
+            tokenizer, raw_inputs, None)
+        tokens_b = None
 
-        # tokenize inputs, now the length is fixed, target == raw_target
-        if isinstance(raw_inputs, dict):
-            tokens_a, target = tokenize_text_with_seqs(
-                tokenizer, raw_inputs['a'], raw_target, is_seq)
-            tokens_b, _ = tokenize_text_with_seqs(
-                tokenizer, raw_inputs['b'], raw_target)
-        else:
-            tokens_a, target = tokenize_text_with_seqs(
-                tokenizer, raw_inputs, raw_target, is_seq)
-            tokens_b = None
+    if tokens_b is not None and any(is_seq_list):
+        raise NotImplementedError(
+            'Sequence Labeling with tokens b is not implemented')
 
-        if tokens_b is not None and is_seq:
-            raise NotImplementedError(
-                'Sequence Labeling with tokens b is not implemented')
+    if not tokens_a:
+        return None
+    # check whether tokenization changed the length
+    if len(raw_inputs) != len(tokens_a):
+        tf.logging.warning('Data %d broken' % ex_index)
+        return None
 
-        if not tokens_a:
-            continue
-        # check whether tokenization changed the length
-        if len(raw_inputs) != len(tokens_a):
-            tf.logging.warning('Data %d broken' % ex_index)
-            continue
+    label_ids = {}
+    for problem, target, label_encoder, is_seq in zip(
+            problems, raw_targets, label_encoders, is_seq_list):
+        problem_type = params.problem_type[problem]
 
-        # truncate tokens and target to max_seq_len
-        tokens_a, tokens_b, target = truncate_seq_pair(
+        # truncate tokens and target to max_seq_len, tokens are the
+        # same for every problem
+        truncated_a, truncated_b, target = truncate_seq_pair(
             tokens_a, tokens_b, target, params.max_seq_len, is_seq=is_seq)
 
         # add [SEP], [CLS] tokens
         tokens, segment_ids, target = add_special_tokens_with_seqs(
-            tokens_a, tokens_b, target, is_seq)
-
-        # train mask lm as augument task while training
-        if params.augument_mask_lm and mode == 'train':
-            rng = random.Random()
-            (mask_lm_tokens, masked_lm_positions,
-                masked_lm_labels) = create_masked_lm_predictions(
-                    tokens,
-                    params.masked_lm_prob,
-                    params.max_predictions_per_seq,
-                    list(tokenizer.vocab.keys()), rng)
-            _, mask_lm_tokens, _, _ = create_mask_and_padding(
-                mask_lm_tokens, copy(segment_ids), copy(target), params.max_seq_len, is_seq)
-            masked_lm_weights, masked_lm_labels, masked_lm_positions, _ = create_mask_and_padding(
-                masked_lm_labels, masked_lm_positions, None, params.max_predictions_per_seq)
-            mask_lm_input_ids = tokenizer.convert_tokens_to_ids(
-                mask_lm_tokens)
-            masked_lm_ids = tokenizer.convert_tokens_to_ids(masked_lm_labels)
-
-        input_mask, tokens, segment_ids, target = create_mask_and_padding(
-            tokens, segment_ids, target, params.max_seq_len, is_seq)
-
-        # create mask and padding for labels of seq2seq problem
+            truncated_a, truncated_b, target, is_seq)
+
+        # truncate labels of seq2seq problem
         if problem_type in ['seq2seq_tag', 'seq2seq_text']:
 
             target, _, _ = truncate_seq_pair(
@@ -115,48 +153,409 @@ def create_single_problem_generator(problem,
             # since we initialize the id to 0 in prediction, we need
             # to make sure that BOS_TOKEN is [PAD]
             target = [BOS_TOKEN] + target + [EOS_TOKEN]
-            label_mask, target, _, _ = create_mask_and_padding(
-                target, [0] * len(target), None, params.decode_max_seq_len)
-
-        input_ids = tokenizer.convert_tokens_to_ids(tokens)
 
         if isinstance(target, list):
-            label_id = label_encoder.transform(target).tolist()
-            label_id = [np.int32(i) for i in label_id]
+            label_id = [int(i) for i in label_encoder.transform(target)]
         else:
-            label_id = label_encoder.transform([target]).tolist()[0]
-            label_id = np.int32(label_id)
+            label_id = int(label_encoder.transform([target])[0])
+        label_ids['%s_label_ids' % problem] = label_id
+
+    if char_level:
+        # only the special tokens are not ids yet
+        input_ids = [t if isinstance(t, int) else tokenizer.vocab[t]
+                     for t in tokens]
+    else:
+        input_ids = tokenizer.convert_tokens_to_ids(tokens)
+
+    features = {
+        'input_ids': input_ids,
+        'segment_ids': segment_ids
+    }
+    features.update(label_ids)
+    return features
+
+
+def _iter_raw_examples(inputs_list, target_list):
+    # inputs_list is an iterable of (inputs, target) if target_list is None
+    if target_list is None:
+        return iter(inputs_list)
+    return zip(inputs_list, target_list)
+
+
+def shard_raw_examples(params, inputs_list, target_list, start=0):
+    """Raw examples of this input pipeline, see params.num_input_pipelines
+
+    Keyword Arguments:
+        start {int} -- number of examples of this input pipeline
+            to skip (default: {0})
+
+    Returns:
+        tuple -- (inputs_list, target_list, number of examples), inputs_list
+            is (inputs, target) examples and target_list is None if sharded
+            or skipped
+    """
+    num_examples = len(inputs_list)
+    if params.num_input_pipelines <= 1 and not start:
+        return inputs_list, target_list, num_examples
+    indices = range(
+        params.input_pipeline_id, num_examples,
+        params.num_input_pipelines)[start:]
+    if not indices:
+        return [], None, 0
+    examples = itertools.islice(
+        _iter_raw_examples(inputs_list, target_list),
+        indices.start, None, indices.step)
+    return examples, None, len(indices)
+
+
+def featurize_single_problem(problem,
+                             inputs_list,
+                             target_list,
+                             label_encoder,
+                             params,
+                             tokenizer,
+                             mode,
+                             raw_positions=None):
+    """Generator of unpadded features of single problem, broken examples
+    are skipped. See featurize_single_example.
+    """
+    return featurize_chained_problems(
+        [problem], _iter_single_target_examples(inputs_list, target_list),
+        [label_encoder], params, tokenizer, mode, raw_positions)
+
+
+def featurize_chained_problems(problems,
+                               examples,
+                               label_encoders,
+                               params,
+                               tokenizer,
+                               mode,
+                               raw_positions=None):
+    """Generator of unpadded features of chained problems, broken examples
+    are skipped. See featurize_chained_example.
+
+    Arguments:
+        problems {list} -- problem names
+        examples {iterable} -- (inputs, target of every problem) examples
+        label_encoders {list} -- label encoder of every problem
+
+    Keyword Arguments:
+        raw_positions {deque} -- if given, index of the raw example of
+            every yielded features is appended, see ProblemGenerator
+            (default: {None})
+    """
+    for ex_index, (raw_inputs, raw_targets) in enumerate(examples):
+        features = featurize_chained_example(
+            problems, raw_inputs, raw_targets, label_encoders,
+            params, tokenizer, mode, ex_index)
+        if features is not None:
+            if raw_positions is not None:
+                raw_positions.append(ex_index)
+            yield features
+
+
+def _iter_single_target_examples(inputs_list, target_list):
+    for raw_inputs, raw_target in _iter_raw_examples(inputs_list, target_list):
+        yield raw_inputs, [raw_target]
+
+
+# featurize pool of this process, see get_featurize_pool
+_FEATURIZE_POOL = {}
+
+
+def _terminate_featurize_pool():
+    if 'pool' in _FEATURIZE_POOL:
+        _FEATURIZE_POOL.pop('pool').terminate()
+
+
+def _featurize_chunk(chunk_args):
+    (chunk_ind, start_ind, chunk, problems, label_encoders, mode,
+     params, tokenizer_args) = chunk_args
+    # memorized in the worker process, the vocab is loaded once
+    tokenizer = get_tokenizer(*tokenizer_args)
+
+    # seed by chunk so that the result does not depend on
+    # which worker gets the chunk
+    if params.featurize_seed is not None:
+        random.seed('%d-%d' % (params.featurize_seed, chunk_ind))
+
+    # (index of raw example, features) of every featurized example
+    result = []
+    for offset, (raw_inputs, raw_targets) in enumerate(chunk):
+        features = featurize_chained_example(
+            problems, raw_inputs, raw_targets, label_encoders, params,
+            tokenizer, mode, start_ind + offset)
+        if features is not None:
+            result.append((start_ind + offset, features))
+    return result
+
+
+def get_featurize_pool(num_workers):
+    """Process pool of num_workers workers. The pool is created on first
+    use and reused by all problems and restarts of generators, a new one
+    replaces it only if the number of workers changes. Workers keep no
+    state, params and the vocab of the tokenizer are sent with every
+    chunk, see featurize_chained_problems_parallel.
+
+    Arguments:
+        num_workers {int} -- number of worker processes
+
+    Returns:
+        multiprocessing.Pool -- pool
+    """
+    if _FEATURIZE_POOL.get('num_workers') != num_workers:
+        if not _FEATURIZE_POOL:
+            atexit.register(_terminate_featurize_pool)
+        _terminate_featurize_pool()
+        # spawn instead of fork since tf runs generators in its own thread
+        _FEATURIZE_POOL.update({
+            'num_workers': num_workers,
+            'pool': multiprocessing.get_context('spawn').Pool(num_workers)
+        })
+    return _FEATURIZE_POOL['pool']
+
 
-        assert len(input_ids) == params.max_seq_len
-        assert len(input_mask) == params.max_seq_len
-        assert len(segment_ids) == params.max_seq_len, segment_ids
-        if is_seq:
-            assert len(label_id) == params.max_seq_len
+def featurize_single_problem_parallel(problem,
+                                      inputs_list,
+                                      target_list,
+                                      label_encoder,
+                                      params,
+                                      tokenizer,
+                                      mode,
+                                      raw_positions=None):
+    """Same as featurize_single_problem, but examples are featurized by
+    params.num_featurize_workers processes, see
+    featurize_chained_problems_parallel.
+    """
+    return featurize_chained_problems_parallel(
+        [problem], _iter_single_target_examples(inputs_list, target_list),
+        [label_encoder], params, tokenizer, mode, raw_positions)
+
+
+def featurize_chained_problems_parallel(problems,
+                                        examples,
+                                        label_encoders,
+                                        params,
+                                        tokenizer,
+                                        mode,
+                                        raw_positions=None):
+    """Same as featurize_chained_problems, but examples are featurized by
+    params.num_featurize_workers processes, see get_featurize_pool.
+
+    Examples are sent to workers in chunks of params.featurize_chunk_size,
+    along with params and vocab file of the tokenizer. At most
+    2 * num_featurize_workers chunks are in flight, results are yielded
+    in the original order.
+    """
+    num_workers = params.num_featurize_workers
+    example_iter = iter(examples)
+    pool = get_featurize_pool(num_workers)
+    # workers load the tokenizer of the same vocab
+    tokenizer_args = (tokenizer.vocab_file, tokenizer.do_lower_case,
+                      params.cache_dir)
+
+    # chunks still in flight when the generator is closed are
+    # featurized and discarded
+    pending = collections.deque()
+    chunk_ind = 0
+    start_ind = 0
+    while True:
+        while len(pending) < 2 * num_workers:
+            chunk = list(itertools.islice(
+                example_iter, params.featurize_chunk_size))
+            if not chunk:
+                break
+            pending.append(pool.apply_async(
+                _featurize_chunk,
+                ((chunk_ind, start_ind, chunk, problems, label_encoders,
+                  mode, params, tokenizer_args),)))
+            chunk_ind += 1
+            start_ind += len(chunk)
+
+        if not pending:
+            break
+
+        for ex_index, features in pending.popleft().get():
+            if raw_positions is not None:
+                raw_positions.append(ex_index)
+            yield features
+
+
+def get_padded_seq_len(params, input_ids):
+    """Length to pad the inputs to. If dynamic padding is enabled,
+    inputs are not padded here but padded to the longest one in batch.
+    """
+    if params.dynamic_padding:
+        return len(input_ids)
+    return params.max_seq_len
+
+
+# number of examples masked at a time by MaskedLmMasker
+MASK_BATCH_SIZE = 256
+
+
+def iter_masked_lm_features(masker, feature_gen, augument_rate=1.0):
+    """Mask input ids of features in batches. Only augument_rate of the
+    examples are masked.
+
+    Arguments:
+        masker {MaskedLmMasker} -- masker
+        feature_gen {generator} -- generator of unpadded features
+
+    Keyword Arguments:
+        augument_rate {float} -- rate of examples to mask (default: {1.0})
+
+    Yields:
+        tuple -- (features, (masked input ids, masked lm positions,
+            masked lm ids)), the latter is None if not masked
+    """
+    def _mask_batch(batch):
+        masked_lms = iter(masker.mask(
+            [features['input_ids'] for features, to_mask in batch if to_mask]))
+        for features, to_mask in batch:
+            yield features, next(masked_lms) if to_mask else None
+
+    batch = []
+    for features in feature_gen:
+        batch.append((features, random.uniform(0, 1) <= augument_rate))
+        if len(batch) == MASK_BATCH_SIZE:
+            yield from _mask_batch(batch)
+            batch = []
+    yield from _mask_batch(batch)
+
+
+def finalize_single_problem_features(problem,
+                                     feature_gen,
+                                     label_encoder,
+                                     params,
+                                     tokenizer,
+                                     mode):
+    """Function to turn unpadded features into training examples
+
+    This function will:
+        1. Create mask lm augument features if needed
+        2. Padding
+        3. yield result dict
+
+    Arguments:
+        problem {str} -- problem name
+        feature_gen {generator} -- generator of unpadded features
+        label_encoder {LabelEncoder} -- label encoder
+        params {Params} -- params
+        tokenizer {tokenizer} -- Bert Tokenizer
+        mode {mode} -- mode
+    """
+    return finalize_chained_problem_features(
+        [problem], feature_gen, [label_encoder], params, tokenizer, mode)
+
+
+def finalize_chained_problem_features(problems,
+                                      feature_gen,
+                                      label_encoders,
+                                      params,
+                                      tokenizer,
+                                      mode):
+    """Same as finalize_single_problem_features, for features of chained
+    problems that share inputs, see featurize_chained_example.
+
+    Arguments:
+        problems {list} -- problem names
+        feature_gen {generator} -- generator of unpadded features
+        label_encoders {list} -- label encoder of every problem
+        params {Params} -- params
+        tokenizer {tokenizer} -- Bert Tokenizer
+        mode {mode} -- mode
+    """
+    # (problem, label encoder, is_seq, is_seq2seq, label pad id)
+    # of every problem
+    label_specs = []
+    for problem, label_encoder in zip(problems, label_encoders):
+        problem_type = params.problem_type[problem]
+        # labels are padded with [PAD], which is not always 0
+        label_specs.append((
+            problem, label_encoder, problem_type in ['seq_tag'],
+            problem_type in ['seq2seq_tag', 'seq2seq_text'],
+            int(label_encoder.transform([BOS_TOKEN])[0])))
+
+    # train mask lm as augument task while training,
+    # with dynamic masking, tokens are masked in input_fn
+    if params.augument_mask_lm and mode == 'train' and not params.dynamic_masking:
+        masker = MaskedLmMasker(
+            tokenizer.vocab, params.masked_lm_prob,
+            params.max_predictions_per_seq)
+        feature_gen = iter_masked_lm_features(
+            masker, feature_gen, params.augument_rate)
+    else:
+        feature_gen = ((features, None) for features in feature_gen)
+
+    for ex_index, (features, masked_lm) in enumerate(feature_gen):
+        input_ids = features['input_ids']
+        segment_ids = features['segment_ids']
+
+        # id of [PAD] in bert vocab is 0
+        pad_len = get_padded_seq_len(params, input_ids) - len(input_ids)
+        input_mask = [1] * len(input_ids) + [0] * pad_len
+        input_ids = input_ids + [0] * pad_len
+        segment_ids = segment_ids + [0] * pad_len
+
+        if masked_lm is not None:
+            mask_lm_input_ids, masked_lm_positions, masked_lm_ids = masked_lm
+            mask_lm_input_ids = mask_lm_input_ids + [0] * pad_len
+            prediction_pad_len = params.max_predictions_per_seq - \
+                len(masked_lm_positions)
+            masked_lm_weights = [1] * len(masked_lm_positions) + \
+                [0] * prediction_pad_len
+            masked_lm_positions = masked_lm_positions + \
+                [0] * prediction_pad_len
+            masked_lm_ids = masked_lm_ids + [0] * prediction_pad_len
+
+        assert len(input_ids) <= params.max_seq_len
+        assert len(input_mask) == len(input_ids)
+        assert len(segment_ids) == len(input_ids), segment_ids
+
+        label_features = {}
+        for problem, label_encoder, is_seq, is_seq2seq, label_pad_id in label_specs:
+            label_id = features['%s_label_ids' % problem]
+
+            if is_seq:
+                label_id = label_id + [label_pad_id] * pad_len
+                assert len(label_id) == len(input_ids)
+
+            # create mask and padding for labels of seq2seq problem
+            if is_seq2seq:
+                label_pad_len = params.decode_max_seq_len - len(label_id)
+                label_features['%s_mask' % problem] = [1] * len(label_id) + \
+                    [0] * label_pad_len
+                label_id = label_id + [label_pad_id] * label_pad_len
+
+            label_features['%s_label_ids' % problem] = label_id
 
         # logging in debug mode
         if ex_index < 5:
             tf.logging.debug("*** Example ***")
             tf.logging.debug("tokens: %s" % " ".join(
-                [printable_text(x) for x in tokens]))
+                [printable_text(x) for x in tokenizer.convert_ids_to_tokens(input_ids)]))
             tf.logging.debug("input_ids: %s" %
                              " ".join([str(x) for x in input_ids]))
             tf.logging.debug("input_mask: %s" %
                              " ".join([str(x) for x in input_mask]))
             tf.logging.debug("segment_ids: %s" %
                              " ".join([str(x) for x in segment_ids]))
-            if is_seq or problem_type in ['seq2seq_tag', 'seq2seq_text']:
-                tf.logging.debug("%s_label_ids: %s" %
-                                 (problem, " ".join([str(x) for x in label_id])))
-                tf.logging.debug("%s_label: %s" %
-                                 (problem, " ".join([str(x) for x in target])))
-            else:
-                tf.logging.debug("%s_label_ids: %s" %
-                                 (problem, str(label_id)))
-                tf.logging.debug("%s_label: %s" %
-                                 (problem, str(target)))
-            if params.augument_mask_lm and mode == 'train':
+            for problem, label_encoder, is_seq, is_seq2seq, _ in label_specs:
+                label_id = label_features['%s_label_ids' % problem]
+                if is_seq or is_seq2seq:
+                    tf.logging.debug("%s_label_ids: %s" %
+                                     (problem, " ".join([str(x) for x in label_id])))
+                    tf.logging.debug("%s_label: %s" %
+                                     (problem, " ".join([str(x) for x in label_encoder.inverse_transform(label_id)])))
+                else:
+                    tf.logging.debug("%s_label_ids: %s" %
+                                     (problem, str(label_id)))
+                    tf.logging.debug("%s_label: %s" %
+                                     (problem, str(label_encoder.inverse_transform([label_id])[0])))
+            if masked_lm is not None:
                 tf.logging.debug("mask lm tokens: %s" % " ".join(
-                    [printable_text(x) for x in mask_lm_tokens]))
+                    [printable_text(x) for x in tokenizer.convert_ids_to_tokens(mask_lm_input_ids)]))
                 tf.logging.debug("mask lm input_ids: %s" %
                                  " ".join([str(x) for x in mask_lm_input_ids]))
                 tf.logging.debug("mask lm label ids: %s" %
@@ -169,16 +568,14 @@ def create_single_problem_generator(problem,
             return_dict = {
                 'input_ids': input_ids,
                 'input_mask': input_mask,
-                'segment_ids': segment_ids,
-                '%s_label_ids' % problem: label_id
+                'segment_ids': segment_ids
             }
         else:
-            if mode == 'train' and random.uniform(0, 1) <= params.augument_rate:
+            if masked_lm is not None:
                 return_dict = {
                     'input_ids': mask_lm_input_ids,
                     'input_mask': input_mask,
                     'segment_ids': segment_ids,
-                    '%s_label_ids' % problem: label_id,
                     "masked_lm_positions": masked_lm_positions,
                     "masked_lm_ids": masked_lm_ids,
                     "masked_lm_weights": masked_lm_weights,
@@ -188,18 +585,272 @@ def create_single_problem_generator(problem,
                     'input_ids': input_ids,
                     'input_mask': input_mask,
                     'segment_ids': segment_ids,
-                    '%s_label_ids' % problem: label_id,
                     "masked_lm_positions": np.zeros([params.max_predictions_per_seq]),
                     "masked_lm_ids": np.zeros([params.max_predictions_per_seq]),
                     "masked_lm_weights": np.zeros([params.max_predictions_per_seq]),
                 }
-
-        if problem_type in ['seq2seq_tag', 'seq2seq_text']:
-            return_dict['%s_mask' % problem] = label_mask
+        return_dict.update(label_features)
 
         yield return_dict
 
 
+class ProblemGenerator():
+    """Iterator of examples of a single problem, whose length is known
+    without featurizing the examples.
+
+    The length is the number of raw examples, examples that are skipped
+    while featurizing(e.g. empty ones) are counted as well unless read
+    from feature cache.
+
+    position is the number of examples read, counted from the start
+    of this input pipeline, which resumes the generator when passed as
+    start. These are raw examples, broken ones included, if raw_positions
+    is given: the featurize functions append the index of the raw example
+    of every featurized one to it. Otherwise yielded examples are counted,
+    which are cached examples if read from or written to feature cache.
+
+    Generators of raw examples also keep the raw examples and tokenizer,
+    so that chained problems can featurize shared inputs once instead,
+    see create_chained_problem_generator.
+    """
+
+    def __init__(self, example_gen, num_examples, label_encoder,
+                 raw_examples=None, tokenizer=None, start=0,
+                 raw_positions=None):
+        self.example_gen = example_gen
+        self.num_examples = num_examples
+        self.label_encoder = label_encoder
+        self.raw_examples = raw_examples
+        self.tokenizer = tokenizer
+        self.start = start
+        self.raw_positions = raw_positions
+        self.position = start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        example = next(self.example_gen)
+        if self.raw_positions is not None:
+            self.position = self.start + self.raw_positions.popleft() + 1
+        else:
+            self.position += 1
+        return example
+
+    def __len__(self):
+        return self.num_examples
+
+
+def create_single_problem_generator(problem,
+                                    inputs_list,
+                                    target_list,
+                                    label_encoder,
+                                    params,
+                                    tokenizer,
+                                    mode,
+                                    start=0):
+    """Function to create iterator for single problem
+
+    This function will:
+        0. Read featurized examples from feature cache if they are
+            cached for label_encoder. Otherwise take the examples of this
+            input pipeline and skip the ones already trained on when
+            resuming, see shard_raw_examples
+        1. Featurize examples, see featurize_single_example. If
+            params.num_featurize_workers > 1, featurize with process pool
+        2. Write featurized examples to feature cache if enabled and
+            no example is skipped
+        3. Padding and yield result dict, see finalize_single_problem_features
+
+    Arguments:
+        problem {str} -- problem name
+        inputs_list {list } -- inputs list
+        target_list {list} -- target list, should have the same length as inputs list.
+            If None, inputs_list is (inputs, target) examples with length, e.g. LazyExamples
+        label_encoder {LabelEncoder} -- label encoder
+        params {Params} -- params
+        tokenizer {tokenizer} -- Bert Tokenizer
+        mode {mode} -- mode
+
+    Keyword Arguments:
+        start {int} -- number of examples of this input pipeline to
+            skip, used to resume training, see ProblemGenerator.position
+            (default: {0})
+
+    Returns:
+        ProblemGenerator -- iterator of examples
+    """
+    # examples may be cached for the labels fitted by the reader
+    if use_feature_cache(params, mode):
+        feature_gen, _, num_examples = read_feature_cache(
+            params, problem, mode, start=start, label_encoder=label_encoder)
+        if feature_gen is not None:
+            return ProblemGenerator(
+                finalize_single_problem_features(
+                    problem, feature_gen, label_encoder, params,
+                    tokenizer, mode),
+                num_examples, label_encoder, start=start)
+
+    inputs_list, target_list, num_examples = shard_raw_examples(
+        params, inputs_list, target_list, start)
+
+    # positions count cached examples if the cache is used
+    if use_feature_cache(params, mode):
+        raw_positions = None
+    else:
+        raw_positions = collections.deque()
+    if params.num_featurize_workers > 1:
+        featurize_fn = featurize_single_problem_parallel
+    else:
+        featurize_fn = featurize_single_problem
+    feature_gen = featurize_fn(
+        problem, inputs_list, target_list, label_encoder,
+        params, tokenizer, mode, raw_positions)
+
+    # a pass that skips examples would publish a truncated cache
+    if use_feature_cache(params, mode) and not start:
+        feature_gen = write_feature_cache(
+            params, problem, mode, label_encoder, feature_gen)
+
+    return ProblemGenerator(
+        finalize_single_problem_features(
+            problem, feature_gen, label_encoder, params, tokenizer, mode),
+        num_examples, label_encoder,
+        raw_examples=(inputs_list, target_list), tokenizer=tokenizer,
+        start=start, raw_positions=raw_positions)
+
+
+def _iter_chained_raw_examples(problems, raw_examples_iter, params):
+    # inputs of the first problem are shared, check that the problems
+    # read the same inputs of every example, and that inputs and targets
+    # of seq_tag problems have the same length
+    seq_tag_inds = [ind for ind, problem in enumerate(problems)
+                    if params.problem_type[problem] == 'seq_tag']
+    for ex_index, raw_examples in enumerate(raw_examples_iter):
+        inputs = raw_examples[0][0]
+        for problem, (raw_inputs, _) in zip(problems[1:], raw_examples[1:]):
+            if raw_inputs != inputs:
+                raise ValueError(
+                    'Chained problems %s and %s read different inputs at '
+                    'example %d: %s, %s' % (
+                        problems[0], problem, ex_index, inputs, raw_inputs))
+        for ind in seq_tag_inds:
+            if len(raw_examples[ind][1]) != len(inputs):
+                raise ValueError(
+                    'Inputs and targets of %s differ in length at example '
+                    '%d of chained problems %s: %d, %d' % (
+                        problems[ind], ex_index, problems, len(inputs),
+                        len(raw_examples[ind][1])))
+        yield inputs, [target for _, target in raw_examples]
+
+
+def create_chained_problem_generator(problems, problem_generators, params, mode):
+    """Function to create iterator for chained problems that share inputs,
+    e.g. weibo_ner&weibo_cws. Raw examples of the problems are read in
+    lockstep, inputs are featurized once with the tokenizer of the first
+    problem and every problem adds its label ids, see
+    featurize_chained_example. The generators of the problems are not
+    iterated.
+
+    Arguments:
+        problems {list} -- problem names
+        problem_generators {list} -- ProblemGenerator of every problem,
+            created by create_single_problem_generator
+        params {Params} -- params
+        mode {mode} -- mode
+
+    Raises:
+        ValueError -- raw examples of a problem are not available, or
+            problems have different numbers of examples. While iterating,
+            if problems read different inputs
+
+    Returns:
+        ProblemGenerator -- iterator of examples with labels of all problems
+    """
+    for problem, problem_generator in zip(problems, problem_generators):
+        if problem_generator.raw_examples is None:
+            raise ValueError(
+                'Inputs of %s can not be shared with chained problems, '
+                'since its raw examples are not available.' % problem)
+    num_examples = len(problem_generators[0])
+    if any(len(g) != num_examples for g in problem_generators):
+        raise ValueError(
+            'Chained problems %s have different numbers of examples: %s' % (
+                problems, [len(g) for g in problem_generators]))
+
+    raw_example_iters = [_iter_raw_examples(*g.raw_examples)
+                         for g in problem_generators]
+    examples = _iter_chained_raw_examples(
+        problems, zip(*raw_example_iters), params)
+    label_encoders = [g.label_encoder for g in problem_generators]
+    tokenizer = problem_generators[0].tokenizer
+
+    raw_positions = collections.deque()
+    if params.num_featurize_workers > 1:
+        featurize_fn = featurize_chained_problems_parallel
+    else:
+        featurize_fn = featurize_chained_problems
+    feature_gen = featurize_fn(
+        problems, examples, label_encoders, params, tokenizer, mode,
+        raw_positions)
+
+    # raw examples of the problems start at the same position
+    return ProblemGenerator(
+        finalize_chained_problem_features(
+            problems, feature_gen, label_encoders, params, tokenizer, mode),
+        num_examples, label_encoders[0],
+        start=problem_generators[0].start, raw_positions=raw_positions)
+
+
+def create_problem_generator(params, problem, mode, shuffle_seed=None, start=0):
+    """Function to create iterator for single problem by name.
+    If featurized examples of the problem are cached, they will be
+    read from cache instead of calling read_data_fn of the problem.
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+        mode {mode} -- mode
+
+    Keyword Arguments:
+        shuffle_seed {int} -- if given, examples are read from feature
+            cache in a random permutation of this seed. The cache is
+            written first if it does not exist (default: {None})
+        start {int} -- number of examples to skip, used to resume
+            training. If the feature cache is enabled, it is written by a
+            full pass first and read from start, otherwise skipped raw
+            examples are not featurized (default: {0})
+    """
+    if params.problem_type[problem] != 'pretrain':
+        feature_gen, label_encoder, num_examples = read_feature_cache(
+            params, problem, mode, shuffle_seed, start)
+        # examples read in a permutation or from a position need the
+        # whole cache. The reader fits the label encoder if there is
+        # none in ckpt dir, and writes the cache by a full pass if it
+        # does not exist for the labels
+        if feature_gen is None and (shuffle_seed is not None or start) \
+                and use_feature_cache(params, mode):
+            problem_gen = params.read_data_fn[problem](params, mode)
+            feature_gen, label_encoder, num_examples = read_feature_cache(
+                params, problem, mode, shuffle_seed, start)
+            if feature_gen is None:
+                for _ in problem_gen:
+                    pass
+                feature_gen, label_encoder, num_examples = read_feature_cache(
+                    params, problem, mode, shuffle_seed, start)
+        if feature_gen is not None:
+            tokenizer = get_tokenizer(
+                params.vocab_file, cache_dir=params.cache_dir)
+            return ProblemGenerator(
+                finalize_single_problem_features(
+                    problem, feature_gen, label_encoder, params, tokenizer, mode),
+                num_examples, label_encoder, start=start)
+
+    if start:
+        return params.read_data_fn[problem](params, mode, start=start)
+    return params.read_data_fn[problem](params, mode)
+
+
 def create_pretraining_generator(problem,
                                  inputs_list,
                                  target_list,
@@ -216,6 +867,10 @@ def create_pretraining_generator(problem,
     if not isinstance(inputs_list[0][0], list):
         raise ValueError('inputs is expected to be list of list of list.')
 
+    # documents of this input pipeline
+    inputs_list = inputs_list[
+        params.input_pipeline_id::params.num_input_pipelines]
+
     all_documents = []
     for document in inputs_list:
         all_documents.append([])
@@ -226,57 +881,191 @@ def create_pretraining_generator(problem,
     rng = random.Random()
     rng.shuffle(all_documents)
 
-    vocab_words = list(tokenizer.vocab.keys())
-    instances = []
+    masker = MaskedLmMasker(
+        tokenizer.vocab, params.masked_lm_prob, params.max_predictions_per_seq)
+
+    def _finalize_instances(instances):
+        input_ids_list = [tokenizer.convert_tokens_to_ids(instance.tokens)
+                          for instance in instances]
+        if params.dynamic_masking:
+            # masked in input_fn
+            masked_lms = [(input_ids, [], []) for input_ids in input_ids_list]
+        else:
+            masked_lms = masker.mask(input_ids_list)
+        for instance, masked_lm in zip(instances, masked_lms):
+            input_ids, masked_lm_positions, masked_lm_ids = masked_lm
+            segment_ids = list(instance.segment_ids)
+
+            pad_len = get_padded_seq_len(params, input_ids) - len(input_ids)
+            input_mask = [1] * len(input_ids) + [0] * pad_len
+            input_ids = input_ids + [0] * pad_len
+            segment_ids = segment_ids + [0] * pad_len
+
+            prediction_pad_len = params.max_predictions_per_seq - \
+                len(masked_lm_positions)
+            masked_lm_weights = [1] * len(masked_lm_positions) + \
+                [0] * prediction_pad_len
+            masked_lm_positions = masked_lm_positions + \
+                [0] * prediction_pad_len
+            masked_lm_ids = masked_lm_ids + [0] * prediction_pad_len
+            next_sentence_label = 1 if instance.is_random_next else 0
+
+            yield {
+                "input_ids": input_ids,
+                "input_mask": input_mask,
+                "segment_ids": segment_ids,
+                "masked_lm_positions": masked_lm_positions,
+                "masked_lm_ids": masked_lm_ids,
+                "masked_lm_weights": masked_lm_weights,
+                "next_sentence_label_ids": next_sentence_label
+            }
 
     print_count = 0
+    instances = []
     for _ in range(params.dupe_factor):
         for document_index in range(len(all_documents)):
-            instances = create_instances_from_document(
+            instances += create_instances_from_document(
                 all_documents,
                 document_index,
                 params.max_seq_len,
                 params.short_seq_prob,
-                params.masked_lm_prob,
-                params.max_predictions_per_seq,
-                vocab_words, rng)
-            for instance in instances:
-                tokens = instance.tokens
-                segment_ids = list(instance.segment_ids)
-
-                input_mask, tokens, segment_ids, _ = create_mask_and_padding(
-                    tokens, segment_ids, None, params.max_seq_len)
-                masked_lm_positions = list(instance.masked_lm_positions)
-                masked_lm_weights, masked_lm_labels, masked_lm_positions, _ = create_mask_and_padding(
-                    instance.masked_lm_labels, masked_lm_positions, None, params.max_predictions_per_seq)
-                input_ids = tokenizer.convert_tokens_to_ids(tokens)
-                masked_lm_ids = tokenizer.convert_tokens_to_ids(
-                    masked_lm_labels)
-                next_sentence_label = 1 if instance.is_random_next else 0
-
-                yield_dict = {
-                    "input_ids": input_ids,
-                    "input_mask": input_mask,
-                    "segment_ids": segment_ids,
-                    "masked_lm_positions": masked_lm_positions,
-                    "masked_lm_ids": masked_lm_ids,
-                    "masked_lm_weights": masked_lm_weights,
-                    "next_sentence_label_ids": next_sentence_label
-                }
-
+                rng)
+            if len(instances) < MASK_BATCH_SIZE:
+                continue
+            for yield_dict in _finalize_instances(instances):
                 if print_count < 3:
-                    tf.logging.debug('%s : %s' %
-                                     ('tokens', ' '.join([str(x) for x in tokens])))
-                    for k, v in yield_dict.items():
-                        if not isinstance(v, int):
-                            tf.logging.debug('%s : %s' %
-                                             (k, ' '.join([str(x) for x in v])))
+                    _log_pretraining_example(yield_dict, tokenizer)
                     print_count += 1
-
                 yield yield_dict
+            instances = []
+
+    for yield_dict in _finalize_instances(instances):
+        if print_count < 3:
+            _log_pretraining_example(yield_dict, tokenizer)
+            print_count += 1
+        yield yield_dict
+
+
+def _log_pretraining_example(yield_dict, tokenizer):
+    tf.logging.debug('%s : %s' % ('tokens', ' '.join(
+        [printable_text(x) for x in tokenizer.convert_ids_to_tokens(
+            yield_dict['input_ids'])])))
+    for k, v in yield_dict.items():
+        if not isinstance(v, int):
+            tf.logging.debug('%s : %s' %
+                             (k, ' '.join([str(x) for x in v])))
+
+
+class MultitaskSampler():
+    """Sampler of problem chunks, built once per generator.
+
+    Sampling probabilities are computed from number of train examples
+    according to balance_type:
+        data_balanced: proportional to number of examples
+        problem_balanced: uniform
+        temperature_scaled: proportional to number of examples ** (1 / temperature)
+
+    Chunk indices are drawn by alias method in blocks of block_size.
+    """
+
+    def __init__(self, data_num_list, balance_type='data_balanced',
+                 temperature=1.0, block_size=1024):
+        data_num = np.array(data_num_list, dtype=np.float64)
+        if balance_type == 'data_balanced':
+            weights = data_num
+        elif balance_type == 'problem_balanced':
+            weights = np.ones_like(data_num)
+        elif balance_type == 'temperature_scaled':
+            weights = np.power(data_num, 1.0 / temperature)
+        else:
+            raise ValueError(
+                'Unknown multitask_balance_type: %s' % balance_type)
+        self.sample_prob = weights / np.sum(weights)
+        self.block_size = block_size
+        self.prob, self.alias = self._build_alias_table(self.sample_prob)
+        self.rng = np.random.RandomState()
+        self._block = []
+        # rng state before the current block was sampled and number of
+        # chunk indices drawn from the block, see get_state
+        self._block_rng_state = None
+        self._num_drawn = 0
+
+    @staticmethod
+    def _build_alias_table(sample_prob):
+        num_chunks = len(sample_prob)
+        prob = np.zeros(num_chunks, dtype=np.float64)
+        alias = np.zeros(num_chunks, dtype=np.int64)
+
+        scaled_prob = sample_prob * num_chunks
+        small = [i for i, p in enumerate(scaled_prob) if p < 1.0]
+        large = [i for i, p in enumerate(scaled_prob) if p >= 1.0]
+        while small and large:
+            small_ind = small.pop()
+            large_ind = large.pop()
+            prob[small_ind] = scaled_prob[small_ind]
+            alias[small_ind] = large_ind
+            scaled_prob[large_ind] -= 1.0 - scaled_prob[small_ind]
+            if scaled_prob[large_ind] < 1.0:
+                small.append(large_ind)
+            else:
+                large.append(large_ind)
+        # remaining ones are 1 up to numerical error
+        for ind in small + large:
+            prob[ind] = 1.0
+        return prob, alias
+
+    def sample_block(self, size):
+        """Sample size chunk indices
+
+        Arguments:
+            size {int} -- number of samples
+
+        Returns:
+            np.array -- chunk indices
+        """
+        columns = self.rng.randint(len(self.prob), size=size)
+        use_column = self.rng.random_sample(size) < self.prob[columns]
+        return np.where(use_column, columns, self.alias[columns])
+
+    def _get_rng_state(self):
+        name, keys, pos, has_gauss, cached_gaussian = self.rng.get_state()
+        return [name, keys.tolist(), pos, has_gauss, cached_gaussian]
+
+    def get_state(self):
+        """Json serializable state, the random state before the current
+        block was sampled and the number of chunk indices drawn from it.
+        States of a block share its random state, so taking the state
+        after every draw is cheap.
+        """
+        if self._block_rng_state is None:
+            return {'rng': self._get_rng_state(), 'num_drawn': 0}
+        return {'rng': self._block_rng_state, 'num_drawn': self._num_drawn}
+
+    def set_state(self, state):
+        name, keys, pos, has_gauss, cached_gaussian = state['rng']
+        self.rng.set_state(
+            (name, np.array(keys, dtype=np.uint32), pos, has_gauss,
+             cached_gaussian))
+        self._block = []
+        self._block_rng_state = None
+        for _ in range(state['num_drawn']):
+            next(self)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._block:
+            self._block_rng_state = self._get_rng_state()
+            self._block = self.sample_block(self.block_size).tolist()
+            self._block.reverse()
+            self._num_drawn = 0
+        self._num_drawn += 1
+        return self._block.pop()
 
 
-def create_generator(params, mode, epoch):
+def create_generator(params, mode, epoch, batch_size=None, input_context=None,
+                     input_state=None):
     """Function to create iterator for multiple problem
 
     This function dose the following things:
@@ -299,7 +1088,18 @@ def create_generator(params, mode, epoch):
         params {Params} -- params
         mode {mode} -- mode
         epoch {int} -- epochs to run
+
+    Keyword Arguments:
+        batch_size {int} -- if given, problem chunk is sampled once per
+            batch_size examples, see task_batch_generator (default: {None})
+        input_context {InputContext} -- if given, only examples of this
+            input pipeline are read (default: {None})
+        input_state {InputState} -- if given and params.resumable_input
+            is set, the position after every train example is recorded
+            to it (default: {None})
     """
+    if input_context is not None:
+        params = input_context.apply(params)
     # example
     # problem_list: ['NER', 'CWS', 'weibo_ner', 'weibo_cws']
     # problem_chunk: [['NER'], ['CWS'], ['weibo_ner', 'weibo_cws']]
@@ -310,61 +1110,160 @@ def create_generator(params, mode, epoch):
         problem_chunk.append(list(problem_dict.keys()))
 
     # get dummy labels
-    def _create_dummpy_label(problem_type):
+    # dummy labels of sequence problems are empty, they are padded at
+    # batch time and in BertMultiTask.pad_sparse_labels. Sequence packing
+    # stacks labels by slot, so they are dense there.
+    def _create_dummpy_label(problem_type, seq_len):
         if problem_type == 'cls':
             return 0
+        elif params.sequence_packing:
+            return [0]*seq_len
         else:
-            return [0]*params.max_seq_len
+            return []
+    dummy_problem_list = [
+        problem for problem in problem_list if params.problem_type[problem] != 'pretrain']
     dummy_label_dict = {problem+'_label_ids': _create_dummpy_label(
-        params.problem_type[problem]) for problem in problem_list if params.problem_type[problem] != 'pretrain'}
+        params.problem_type[problem], params.max_seq_len) for problem in dummy_problem_list}
 
-    # init gen
-    gen_dict = {problem: params.read_data_fn[problem](params, mode)
-                for problem in problem_list}
+    # resume from the input state saved with the latest checkpoint
+    resume_state = None
+    if params.resumable_input and mode == 'train':
+        # documents of pretrain problems are shuffled without a seed,
+        # so their position can not be restored
+        pretrain_problems = [problem for problem in problem_list
+                             if params.problem_type[problem] == 'pretrain']
+        if pretrain_problems:
+            raise ValueError(
+                'resumable_input does not support pretrain problems: %s' %
+                pretrain_problems)
+        resume_state = load_input_state(params.ckpt_dir)
+    # positions count cached examples with feature cache and raw
+    # examples otherwise, see ProblemGenerator.position
+    feature_cache = use_feature_cache(params, mode)
+    if resume_state is not None and \
+            resume_state['feature_cache'] != feature_cache:
+        raise ValueError(
+            'Input state of %s is saved with feature_cache=%s, please '
+            'resume with the same feature_cache.' % (
+                params.ckpt_dir, resume_state['feature_cache']))
 
-    while gen_dict:
-        # sample problem to train
-        if len(problem_chunk) > 1:
-            data_num_list = [params.data_num_dict[chunk[0]]
-                             for chunk in problem_chunk]
-            if params.multitask_balance_type == 'data_balanced':
-                sample_prob = np.array(data_num_list) / np.sum(data_num_list)
-                current_problem_chunk_ind = np.random.choice(
-                    list(range(len(problem_chunk))), p=sample_prob)
-                current_problem_chunk = problem_chunk[current_problem_chunk_ind]
-
-            elif params.multitask_balance_type == 'problem_balanced':
-                sample_prob = np.array(
-                    [1]*len(data_num_list)) / np.sum([1]*len(data_num_list))
-                current_problem_chunk_ind = np.random.choice(
-                    list(range(len(problem_chunk))), p=sample_prob)
-                current_problem_chunk = problem_chunk[current_problem_chunk_ind]
+    # with index shuffle, examples of every train epoch are read in a
+    # new permutation, the same for chained problems
+    if resume_state is not None:
+        shuffle_base_seed = resume_state['shuffle_base_seed']
+    else:
+        shuffle_base_seed = random.randint(0, 2**31 - 1)
+    # epoch of every problem and number of examples read in the epoch,
+    # see InputState
+    problem_epoch = collections.Counter()
+    problem_offset = collections.Counter()
+    if resume_state is not None:
+        problem_epoch.update({
+            problem: epoch for problem, epoch in resume_state['problem_epoch'].items()
+            if problem in problem_list})
+        problem_offset.update({
+            problem: offset for problem, offset in resume_state['problem_offset'].items()
+            if problem in problem_list})
+
+    def _create_problem_generator(problem, start=0):
+        shuffle_seed = None
+        if params.index_shuffle and mode == 'train':
+            shuffle_seed = (shuffle_base_seed + problem_epoch[problem]) % 2**32
+        return create_problem_generator(
+            params, problem, mode, shuffle_seed, start)
+
+    # generators are keyed by the problems they yield labels of.
+    # Chained problems that share inputs have one generator, problems
+    # read from feature cache are already featurized
+    share_inputs = params.share_chained_inputs and not feature_cache
+    chunk_keys = []
+    for chunk in problem_chunk:
+        if share_inputs and len(chunk) > 1 and all(
+                params.problem_type[problem] != 'pretrain' for problem in chunk):
+            chunk_keys.append([tuple(chunk)])
         else:
-            current_problem_chunk = problem_chunk[0]
+            chunk_keys.append([(problem,) for problem in chunk])
 
-        # create loss multiplier
-        loss_multiplier = {}
-        for problem in problem_list:
-            if problem in current_problem_chunk:
-                loss_multiplier[problem+'_loss_multiplier'] = 1
-            else:
-                loss_multiplier[problem+'_loss_multiplier'] = 0
+    def _create_key_generator(key):
+        generators = [_create_problem_generator(
+            problem, problem_offset[problem]) for problem in key]
+        if len(key) == 1:
+            return generators[0]
+        return create_chained_problem_generator(
+            list(key), generators, params, mode)
+
+    # init gen
+    gen_dict = {}
+    for keys in chunk_keys:
+        for key in keys:
+            if key not in gen_dict:
+                gen_dict[key] = _create_key_generator(key)
+
+    # sample problem to train
+    if len(problem_chunk) > 1:
+        sampler = MultitaskSampler(
+            [params.data_num_dict[chunk[0]] for chunk in problem_chunk],
+            params.multitask_balance_type,
+            params.multitask_sampling_temperature)
+        if resume_state is not None and resume_state['sampler_state'] is not None:
+            sampler.set_state(resume_state['sampler_state'])
+    else:
+        sampler = itertools.repeat(0)
+
+    # create loss multiplier
+    loss_multiplier_list = []
+    for chunk in problem_chunk:
+        loss_multiplier_list.append(
+            {problem+'_loss_multiplier': int(problem in chunk)
+             for problem in problem_list})
+
+    # the chunk of a run of batch_size examples is sampled once
+    run_size = batch_size or 1
+    run_left = 0
+    current_problem_chunk_ind = None
+    if resume_state is not None and resume_state['run_left']:
+        current_problem_chunk_ind = resume_state['chunk_ind']
+        loss_multiplier = loss_multiplier_list[current_problem_chunk_ind]
+        run_left = resume_state['run_left']
+
+    track_input = input_state is not None and \
+        params.resumable_input and mode == 'train'
+    if track_input:
+        input_state.start(
+            {'shuffle_base_seed': shuffle_base_seed,
+             'feature_cache': feature_cache},
+            InputState.create_position(
+                problem_epoch, problem_offset,
+                sampler.get_state() if len(problem_chunk) > 1 else None,
+                current_problem_chunk_ind, run_left))
+
+    while gen_dict:
+        if run_left == 0:
+            current_problem_chunk_ind = next(sampler)
+            loss_multiplier = loss_multiplier_list[current_problem_chunk_ind]
+            run_left = run_size
 
         base_dict = {}
         base_input = None
-        for problem in current_problem_chunk:
+        for key in chunk_keys[current_problem_chunk_ind]:
             try:
-                instance = next(gen_dict[problem])
+                instance = next(gen_dict[key])
             except StopIteration:
                 if mode == 'train':
-                    gen_dict[problem] = params.read_data_fn[problem](
-                        params, mode)
-                    instance = next(gen_dict[problem])
+                    for problem in key:
+                        problem_epoch[problem] += 1
+                        problem_offset[problem] = 0
+                    gen_dict[key] = _create_key_generator(key)
+                    instance = next(gen_dict[key])
                 else:
-                    del gen_dict[problem]
+                    del gen_dict[key]
                     continue
             except KeyError:
                 continue
+            for problem in key:
+                # pretrain generators have no position, see ProblemGenerator
+                problem_offset[problem] = getattr(
+                    gen_dict[key], 'position', problem_offset[problem] + 1)
 
             base_dict.update(instance)
             if base_input is None:
@@ -374,6 +1273,7 @@ def create_generator(params, mode, epoch):
                     'input_ids'], 'Inputs id of two chained problem not aligned. Please double check!'
 
         if not base_dict:
+            run_left = 0
             continue
 
         # add dummpy labels
@@ -382,4 +1282,86 @@ def create_generator(params, mode, epoch):
                 base_dict[dummy_problem] = dummy_label_dict[dummy_problem]
         # add loss multipliers
         base_dict.update(loss_multiplier)
+        run_left -= 1
+        if track_input:
+            input_state.produce(InputState.create_position_delta(
+                [(problem, problem_epoch[problem], problem_offset[problem])
+                 for problem in problem_chunk[current_problem_chunk_ind]],
+                sampler.get_state() if len(problem_chunk) > 1 else None,
+                current_problem_chunk_ind, run_left))
         yield base_dict
+
+
+# features that are packed along the sequence, others are stacked by slot
+PACKED_ROW_FEATURES = ['input_ids', 'input_mask', 'segment_ids']
+
+
+def _pack_examples(examples, params):
+    max_seq_len = params.max_seq_len
+    num_empty_slots = params.max_pack_num - len(examples)
+
+    packed = collections.defaultdict(list)
+    token_positions = []
+    for slot_ind, example in enumerate(examples):
+        length = sum(example['input_mask'])
+        start = len(packed['input_ids'])
+        token_positions.append(
+            list(range(start, start + length)) + [0] * (max_seq_len - length))
+        packed['input_ids'] += example['input_ids'][:length]
+        packed['segment_ids'] += example['segment_ids'][:length]
+        packed['position_ids'] += list(range(length))
+        packed['pack_ids'] += [slot_ind + 1] * length
+
+    pad_len = max_seq_len - len(packed['input_ids'])
+    packed['input_mask'] = [1] * len(packed['input_ids']) + [0] * pad_len
+    for k in ['input_ids', 'segment_ids', 'position_ids', 'pack_ids']:
+        packed[k] += [0] * pad_len
+
+    # empty slots have zero loss multipliers, so they are masked in tops
+    packed['pack_token_positions'] = token_positions + \
+        [[0] * max_seq_len] * num_empty_slots
+    packed['pack_input_mask'] = [e['input_mask'] for e in examples] + \
+        [[0] * max_seq_len] * num_empty_slots
+
+    slot_keys = []
+    for example in examples:
+        slot_keys += [k for k in example
+                      if k not in PACKED_ROW_FEATURES and k not in slot_keys]
+    for k in slot_keys:
+        empty_value = np.zeros_like(
+            [e[k] for e in examples if k in e][0]).tolist()
+        packed[k] = [e.get(k, empty_value) for e in examples] + \
+            [empty_value] * num_empty_slots
+    return dict(packed)
+
+
+def create_packed_generator(params, example_gen):
+    """Pack consecutive examples into rows of max_seq_len tokens.
+
+    Tokens of at most max_pack_num examples are concatenated in one row.
+    Positions restart at every example and pack_ids tells which example
+    a token belongs to, so that attention can be restricted to the
+    example itself. Labels, masks and loss multipliers are stacked
+    by slot, with empty slots zero filled.
+
+    Arguments:
+        params {Params} -- params
+        example_gen {generator} -- generator of padded examples,
+            e.g. create_generator
+
+    Yields:
+        dict -- packed row
+    """
+    examples = []
+    packed_len = 0
+    for example in example_gen:
+        length = sum(example['input_mask'])
+        if examples and (packed_len + length > params.max_seq_len
+                         or len(examples) == params.max_pack_num):
+            yield _pack_examples(examples, params)
+            examples = []
+            packed_len = 0
+        examples.append(example)
+        packed_len += length
+    if examples:
+        yield _pack_examples(examples, params)
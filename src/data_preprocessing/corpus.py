@@ -0,0 +1,356 @@
+import os
+import json
+import math
+import hashlib
+import itertools
+import functools
+from array import array
+
+import numpy as np
+
+from ..feature_cache import get_files_key
+
+# memorized line corpora, keyed by name and stat of files
+_LINE_CORPUS = {}
+# memorized split manifests, keyed by manifest file name
+_SPLIT_MANIFEST = {}
+
+
+def train_test_split_indices(num_examples, test_size, random_state):
+    """Indices of train and test examples, same as
+    sklearn.model_selection.train_test_split with float test_size,
+    so that existing train and eval sets are kept.
+
+    Arguments:
+        num_examples {int} -- number of examples
+        test_size {float} -- proportion of test examples
+        random_state {int} -- random seed
+
+    Returns:
+        tuple -- (train indices, test indices)
+    """
+    num_test = int(math.ceil(test_size * num_examples))
+    permutation = np.random.RandomState(random_state).permutation(num_examples)
+    return permutation[num_test:], permutation[:num_test]
+
+
+def get_split_manifest(name, num_examples, test_size, random_state,
+                       data_key='', params=None):
+    """Train and eval indices of a corpus, see train_test_split_indices.
+    The manifest is computed once and memorized, and if params is given,
+    persisted as json in params.cache_dir/splits, so that readers only
+    need to load the side they use.
+
+    Arguments:
+        name {str} -- name of corpus
+        num_examples {int} -- number of examples
+        test_size {float} -- proportion of eval examples
+        random_state {int} -- random seed
+
+    Keyword Arguments:
+        data_key {str} -- identifies content of corpus, e.g. checksum
+            of files (default: {''})
+        params {Params} -- params (default: {None})
+
+    Returns:
+        dict -- {'train': train indices, 'eval': eval indices}
+    """
+    key = json.dumps(
+        [name, num_examples, test_size, random_state, data_key])
+    file_name = '%s_%s.json' % (
+        name, hashlib.md5(key.encode('utf8')).hexdigest()[:12])
+    if file_name in _SPLIT_MANIFEST:
+        return _SPLIT_MANIFEST[file_name]
+
+    manifest_path = None
+    if params is not None:
+        manifest_path = os.path.join(params.cache_dir, 'splits', file_name)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf8') as f:
+                manifest = json.load(f)
+            _SPLIT_MANIFEST[file_name] = manifest
+            return manifest
+
+    train_indices, eval_indices = train_test_split_indices(
+        num_examples, test_size, random_state)
+    manifest = {
+        'train': [int(i) for i in train_indices],
+        'eval': [int(i) for i in eval_indices]
+    }
+
+    if manifest_path is not None:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        tmp_path = '%s.tmp-%d' % (manifest_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+    _SPLIT_MANIFEST[file_name] = manifest
+    return manifest
+
+
+def _split_lines(text):
+    # same as readlines() of text file, except that lone '\r'
+    # is not a line break
+    lines = text.replace('\r\n', '\n').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+        return [l + '\n' for l in lines]
+    return [l + '\n' for l in lines[:-1]] + [lines[-1]]
+
+
+class LazyExamples():
+    """Base class of (inputs, target) examples that are read lazily
+    and known in length.
+    """
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def __add__(self, other):
+        return ChainedExamples(self, other)
+
+    def map_target(self, fn):
+        """Examples with target replaced by fn(target)"""
+        return MappedExamples(self, fn)
+
+    def label_set(self):
+        """Set of labels of all targets, targets of sequence problems
+        are flattened.
+        """
+        labels = set()
+        for _, target in self:
+            if isinstance(target, list):
+                labels.update(target)
+            else:
+                labels.add(target)
+        return labels
+
+    def to_lists(self):
+        """Read all examples
+
+        Returns:
+            tuple -- (inputs list, target list)
+        """
+        inputs_list, target_list = [], []
+        for inputs, target in self:
+            inputs_list.append(inputs)
+            target_list.append(target)
+        return inputs_list, target_list
+
+
+class ListExamples(LazyExamples):
+    """Examples that are already in memory"""
+
+    def __init__(self, inputs_list, target_list):
+        self.inputs_list = inputs_list
+        self.target_list = target_list
+
+    def __len__(self):
+        return len(self.inputs_list)
+
+    def __iter__(self):
+        return zip(self.inputs_list, self.target_list)
+
+
+class ChainedExamples(LazyExamples):
+    def __init__(self, *examples_list):
+        self.examples_list = examples_list
+
+    def __len__(self):
+        return sum(len(examples) for examples in self.examples_list)
+
+    def __iter__(self):
+        return itertools.chain(*self.examples_list)
+
+
+class MappedExamples(LazyExamples):
+    def __init__(self, examples, target_fn):
+        self.examples = examples
+        self.target_fn = target_fn
+
+    def __len__(self):
+        return len(self.examples)
+
+    def __iter__(self):
+        for inputs, target in self.examples:
+            yield inputs, self.target_fn(target)
+
+
+class LineCorpus():
+    """Examples of line based files, parsed on the fly from byte
+    offsets of records, so only the offsets are kept in memory.
+
+    A record is a line, or a block of lines separated by blank lines if
+    by_block. parse_fn(lines, file_path) parses the lines of a record
+    into a list of (inputs, target) examples, which can be empty.
+
+    If one_per_record, parse_fn returns exactly one example per record,
+    so records are not parsed to count examples.
+    """
+
+    def __init__(self, file_list, parse_fn, by_block=False, name='corpus',
+                 one_per_record=False):
+        self.name = name
+        self.file_list = list(file_list)
+        self.parse_fn = parse_fn
+        self.by_block = by_block
+
+        # location of each example
+        self.file_inds = array('i')
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self.sub_inds = array('i')
+        for file_ind, file_path in enumerate(self.file_list):
+            for offset, data in self._iter_records(file_path):
+                if one_per_record:
+                    num_examples = 1
+                else:
+                    num_examples = len(self._parse(file_path, data))
+                for sub_ind in range(num_examples):
+                    self.file_inds.append(file_ind)
+                    self.offsets.append(offset)
+                    self.lengths.append(len(data))
+                    self.sub_inds.append(sub_ind)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _iter_records(self, file_path):
+        offset = 0
+        record_start = 0
+        block = []
+        with open(file_path, 'rb') as f:
+            for line in f:
+                if not self.by_block:
+                    yield offset, line
+                elif line in (b'\n', b'\r\n'):
+                    yield record_start, b''.join(block)
+                    record_start = offset + len(line)
+                    block = []
+                else:
+                    block.append(line)
+                offset += len(line)
+        # trailing empty block is dropped
+        if block:
+            yield record_start, b''.join(block)
+
+    def _parse(self, file_path, data):
+        if not data:
+            return self.parse_fn([], file_path)
+        return self.parse_fn(_split_lines(data.decode('utf8')), file_path)
+
+    def iter_examples(self, indices=None):
+        """Iterate examples
+
+        Keyword Arguments:
+            indices {iterable} -- indices of examples to read, in
+                order. If None, read all examples (default: {None})
+
+        Yields:
+            tuple -- (inputs, target)
+        """
+        if indices is None:
+            indices = range(len(self))
+        files = {}
+
+        # records of sentence split documents are shared by
+        # several examples
+        @functools.lru_cache(maxsize=1024)
+        def _read_record(file_ind, offset, length):
+            if file_ind not in files:
+                files[file_ind] = open(self.file_list[file_ind], 'rb')
+            f = files[file_ind]
+            f.seek(offset)
+            return self._parse(self.file_list[file_ind], f.read(length))
+
+        try:
+            for ind in indices:
+                examples = _read_record(
+                    self.file_inds[ind], self.offsets[ind], self.lengths[ind])
+                yield examples[self.sub_inds[ind]]
+        finally:
+            for f in files.values():
+                f.close()
+
+    def view(self, indices=None):
+        return CorpusView(self, indices)
+
+    def split(self, test_size, random_state, params=None):
+        """Split corpus to train and test views, see get_split_manifest
+
+        Returns:
+            tuple -- (train CorpusView, test CorpusView)
+        """
+        manifest = get_split_manifest(
+            self.name, len(self), test_size, random_state,
+            data_key='%s:%s' % (self.by_block, get_files_key(self.file_list)),
+            params=params)
+        return self.view(manifest['train']), self.view(manifest['eval'])
+
+
+class CorpusView(LazyExamples):
+    """Examples of LineCorpus at indices"""
+
+    def __init__(self, corpus, indices=None):
+        self.corpus = corpus
+        self.indices = indices
+
+    def __len__(self):
+        if self.indices is None:
+            return len(self.corpus)
+        return len(self.indices)
+
+    def __iter__(self):
+        return self.corpus.iter_examples(self.indices)
+
+
+def data_files(*file_patterns, eval_file_patterns=None):
+    """Decorator of readers in data_preprocessing, which registers glob
+    patterns of the train data files read by the reader, see
+    Params.data_file_patterns. Readers should pass the same patterns
+    to glob, so that the registered ones are never out of date.
+
+    Keyword Arguments:
+        eval_file_patterns {list} -- patterns of the files read in eval
+            mode, if not the train files (default: {None})
+
+    Returns:
+        function -- decorator
+    """
+    def decorator(read_data_fn):
+        read_data_fn.data_file_patterns = list(file_patterns)
+        read_data_fn.eval_data_file_patterns = list(
+            file_patterns if eval_file_patterns is None
+            else eval_file_patterns)
+        return read_data_fn
+    return decorator
+
+
+def get_line_corpus(name, file_list, parse_fn, by_block=False,
+                    one_per_record=False):
+    """Get LineCorpus of files, memorized by name and stat of files so
+    that offsets are only computed once per process.
+
+    Arguments:
+        name {str} -- name of corpus, should identify parse_fn
+        file_list {list} -- file paths
+        parse_fn {function} -- see LineCorpus
+
+    Keyword Arguments:
+        by_block {bool} -- see LineCorpus (default: {False})
+        one_per_record {bool} -- see LineCorpus (default: {False})
+
+    Returns:
+        LineCorpus -- corpus
+    """
+    key = (name, by_block, one_per_record) + tuple(
+        (os.path.abspath(f), os.stat(f).st_size, os.stat(f).st_mtime)
+        for f in file_list)
+    if key not in _LINE_CORPUS:
+        _LINE_CORPUS[key] = LineCorpus(
+            file_list, parse_fn, by_block, name=name,
+            one_per_record=one_per_record)
+    return _LINE_CORPUS[key]
@@ -1,128 +1,292 @@
 import sys
 import os
+import json
 import glob
 from tqdm import tqdm
 
-from sklearn.model_selection import train_test_split
-
-from ..tokenization import FullTokenizer
+from ..tokenization import get_tokenizer
 
 from ..utils import get_or_make_label_encoder, TRAIN, EVAL, PREDICT
 from ..create_generators import create_single_problem_generator
+from ..feature_cache import file_md5
+from .corpus import (
+    get_split_manifest, get_files_key, LazyExamples, data_files)
 
 
-def read_ctb_pos():
-    file_list = glob.glob('data/ctb8.0/data/postagged/*')
+CTB_POS_PATTERN = 'data/ctb8.0/data/postagged/*'
+CTB_SEG_PATTERN = 'data/ctb8.0/data/segmented/*'
 
-    input_list = []
-    target_list = []
+_CTB_SENTENCE_OFFSETS = {}
 
-    for file_path in file_list:
-        with open(file_path, 'r', encoding='utf8') as f:
-            raw_doc_list = f.readlines()
-        text_row_ind = [i+1 for i,
-                        text in enumerate(raw_doc_list) if '<S ID=' in text]
 
-        sentence_list = [text for i,
-                         text in enumerate(raw_doc_list) if i in text_row_ind]
+def get_ctb_sentence_offsets(file_path, params=None):
+    """Byte offsets of sentence lines of a CTB file, that is, lines
+    right after a '<S ID=...>' line. Offsets are cached in memory and,
+    if params is given, in params.cache_dir, keyed by checksum of file.
 
-        for sentence in sentence_list:
-            input_list.append([])
-            target_list.append([])
-            for word_tag in sentence.split():
-                if '_' not in word_tag:
-                    continue
-                word, tag = word_tag.split('_')
-                for char_ind, char in enumerate(word):
-                    if char_ind == 0:
-                        loc_char = 'B'
-                    else:
-                        loc_char = 'I'
-                    target_list[-1].append(loc_char +
-                                           '-'+tag)
-                    input_list[-1].append(char)
-    return input_list, target_list
+    Arguments:
+        file_path {str} -- CTB file path
 
+    Keyword Arguments:
+        params {Params} -- params (default: {None})
 
-def ctb_pos(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+    Returns:
+        list -- byte offsets
+    """
+    key = '%s_%s' % (os.path.basename(file_path), file_md5(file_path)[:12])
+    if key in _CTB_SENTENCE_OFFSETS:
+        return _CTB_SENTENCE_OFFSETS[key]
 
-    input_list, target_list = read_ctb_pos()
+    index_path = None
+    if params is not None:
+        index_path = os.path.join(params.cache_dir, 'ctb', '%s.json' % key)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf8') as f:
+                _CTB_SENTENCE_OFFSETS[key] = json.load(f)
+            return _CTB_SENTENCE_OFFSETS[key]
 
-    if mode == 'train':
-        input_list, _, target_list, _ = train_test_split(
-            input_list, target_list, test_size=0.2, random_state=3721)
-    else:
-        _, input_list, _, target_list = train_test_split(
-            input_list, target_list, test_size=0.2, random_state=3721)
+    offsets = []
+    offset = 0
+    after_sentence_id = False
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if after_sentence_id:
+                offsets.append(offset)
+            after_sentence_id = b'<S ID=' in line
+            offset += len(line)
 
-    flat_target_list = [item for sublist in target_list for item in sublist]
+    if index_path is not None:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp_path = '%s.tmp-%d' % (index_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(offsets, f)
+        os.replace(tmp_path, index_path)
+    _CTB_SENTENCE_OFFSETS[key] = offsets
+    return offsets
 
-    label_encoder = get_or_make_label_encoder(
-        params, 'ctb_pos', mode, flat_target_list, zero_class='[PAD]')
-    if mode == PREDICT:
-        return input_list, target_list, label_encoder
-    return create_single_problem_generator('ctb_pos',
-                                           input_list,
-                                           target_list,
-                                           label_encoder,
-                                           params,
-                                           tokenizer,
-                                           mode)
 
+def iter_ctb_sentences(file_pattern, params=None, indices=None):
+    """Iterate sentences of CTB files by sentence offsets
 
-def ctb_cws(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
-    file_list = glob.glob('data/ctb8.0/data/segmented/*')
+    Arguments:
+        file_pattern {str} -- glob pattern of CTB files
 
-    input_list = []
-    target_list = []
+    Keyword Arguments:
+        params {Params} -- params, see get_ctb_sentence_offsets (default: {None})
+        indices {iterable} -- indices of sentences to read, in order. If
+            None, read all sentences (default: {None})
 
-    # Create possible tags for fast lookup
-    possible_tags = []
-    for i in range(1, 300):
-        if i == 1:
-            possible_tags.append('s')
-        else:
-            possible_tags.append('b' + 'm' * (i - 2) + 'e')
-
-    for file_path in file_list:
-        with open(file_path, 'r', encoding='utf8') as f:
-            raw_doc_list = f.readlines()
-        text_row_ind = [i+1 for i,
-                        text in enumerate(raw_doc_list) if '<S ID=' in text]
-
-        sentence_list = [text for i,
-                         text in enumerate(raw_doc_list) if i in text_row_ind]
-
-        for sentence in sentence_list:
-            input_list.append([])
-            target_list.append([])
-            for word in sentence.split():
-                if word and len(word) <= 299:
-                    tag = possible_tags[len(word) - 1]
-                    input_list[-1] += list(word)
-                    target_list[-1] += list(tag)
+    Yields:
+        str -- sentence line
+    """
+    file_list = glob.glob(file_pattern)
+    if indices is None:
+        for file_path in file_list:
+            offsets = get_ctb_sentence_offsets(file_path, params)
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            for offset in offsets:
+                end = data.find(b'\n', offset)
+                if end == -1:
+                    end = len(data)
                 else:
-                    continue
+                    end += 1
+                yield data[offset:end].decode('utf8')
+        return
+
+    locations = [(file_path, offset) for file_path in file_list
+                 for offset in get_ctb_sentence_offsets(file_path, params)]
+    files = {}
+    try:
+        for ind in indices:
+            file_path, offset = locations[ind]
+            if file_path not in files:
+                files[file_path] = open(file_path, 'rb')
+            f = files[file_path]
+            f.seek(offset)
+            yield f.readline().decode('utf8')
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def get_ctb_split_indices(file_pattern, name, mode, params=None):
+    """Sentence indices of train or eval split of CTB files, see
+    get_split_manifest
 
-    if mode == 'train':
-        input_list, _, target_list, _ = train_test_split(
-            input_list, target_list, test_size=0.2, random_state=3721)
+    Arguments:
+        file_pattern {str} -- glob pattern of CTB files
+        name {str} -- name of split manifest
+        mode {str} -- mode
+
+    Keyword Arguments:
+        params {Params} -- params (default: {None})
+
+    Returns:
+        list -- sentence indices
+    """
+    file_list = glob.glob(file_pattern)
+    num_sentences = sum(len(get_ctb_sentence_offsets(file_path, params))
+                        for file_path in file_list)
+    manifest = get_split_manifest(
+        name, num_sentences, 0.2, 3721,
+        data_key=get_files_key(file_list), params=params)
+    if mode == TRAIN:
+        return manifest['train']
+    return manifest['eval']
+
+
+def _parse_ctb_pos_sentence(sentence):
+    inputs = []
+    target = []
+    for word_tag in sentence.split():
+        if '_' not in word_tag:
+            continue
+        word, tag = word_tag.split('_')
+        for char_ind, char in enumerate(word):
+            if char_ind == 0:
+                loc_char = 'B'
+            else:
+                loc_char = 'I'
+            target.append(loc_char +
+                          '-'+tag)
+            inputs.append(char)
+    return inputs, target
+
+
+# Create possible tags for fast lookup
+_CWS_POSSIBLE_TAGS = []
+for i in range(1, 300):
+    if i == 1:
+        _CWS_POSSIBLE_TAGS.append('s')
     else:
-        _, input_list, _, target_list = train_test_split(
-            input_list, target_list, test_size=0.2, random_state=3721)
+        _CWS_POSSIBLE_TAGS.append('b' + 'm' * (i - 2) + 'e')
+
+
+def _parse_ctb_cws_sentence(sentence):
+    inputs = []
+    target = []
+    for word in sentence.split():
+        if word and len(word) <= 299:
+            tag = _CWS_POSSIBLE_TAGS[len(word) - 1]
+            inputs += list(word)
+            target += list(tag)
+        else:
+            continue
+    return inputs, target
+
+
+class CTBExamples(LazyExamples):
+    """Examples of CTB files, parsed on the fly from sentence offsets,
+    see iter_ctb_sentences
+    """
+
+    def __init__(self, file_pattern, parse_fn, params=None, indices=None):
+        self.file_pattern = file_pattern
+        self.parse_fn = parse_fn
+        self.params = params
+        self.indices = indices
 
-    flat_target_list = [item for sublist in target_list for item in sublist]
+    def __len__(self):
+        if self.indices is not None:
+            return len(self.indices)
+        return sum(len(get_ctb_sentence_offsets(file_path, self.params))
+                   for file_path in glob.glob(self.file_pattern))
 
+    def __iter__(self):
+        for sentence in iter_ctb_sentences(
+                self.file_pattern, self.params, self.indices):
+            yield self.parse_fn(sentence)
+
+
+def get_ctb_pos_examples(params=None, mode=None):
+    """Examples of CTB pos tagging data
+
+    Keyword Arguments:
+        params {Params} -- params (default: {None})
+        mode {str} -- if given, only read the split of mode (default: {None})
+
+    Returns:
+        LazyExamples -- examples
+    """
+    indices = None
+    if mode is not None:
+        indices = get_ctb_split_indices(
+            CTB_POS_PATTERN, 'ctb_pos', mode, params)
+    return CTBExamples(
+        CTB_POS_PATTERN, _parse_ctb_pos_sentence, params, indices)
+
+
+def get_ctb_cws_examples(params=None, mode=None):
+    """Examples of CTB word segmentation data
+
+    Keyword Arguments:
+        params {Params} -- params (default: {None})
+        mode {str} -- if given, only read the split of mode (default: {None})
+
+    Returns:
+        LazyExamples -- examples
+    """
+    indices = None
+    if mode is not None:
+        indices = get_ctb_split_indices(
+            CTB_SEG_PATTERN, 'ctb_cws', mode, params)
+    return CTBExamples(
+        CTB_SEG_PATTERN, _parse_ctb_cws_sentence, params, indices)
+
+
+def read_ctb_pos(params=None, mode=None):
+    """Read CTB pos tagging data, see get_ctb_pos_examples
+
+    Keyword Arguments:
+        params {Params} -- params (default: {None})
+        mode {str} -- if given, only read the split of mode (default: {None})
+
+    Returns:
+        tuple -- (input list, target list)
+    """
+    return get_ctb_pos_examples(params, mode).to_lists()
+
+
+def read_ctb_cws(params=None, mode=None):
+    """Read CTB word segmentation data, see get_ctb_cws_examples
+
+    Keyword Arguments:
+        params {Params} -- params (default: {None})
+        mode {str} -- if given, only read the split of mode (default: {None})
+
+    Returns:
+        tuple -- (input list, target list)
+    """
+    return get_ctb_cws_examples(params, mode).to_lists()
+
+
+def _ctb_problem(problem, examples, params, mode, start):
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
+
+    # labels are only read if the label encoder is fitted
     label_encoder = get_or_make_label_encoder(
-        params, 'ctb_cws', mode, flat_target_list, zero_class='[PAD]')
+        params, problem, mode, examples.label_set, zero_class='[PAD]')
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
-    return create_single_problem_generator('ctb_cws',
-                                           input_list,
-                                           target_list,
+    return create_single_problem_generator(problem,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
+
+
+@data_files(CTB_POS_PATTERN)
+def ctb_pos(params, mode, start=0):
+    return _ctb_problem(
+        'ctb_pos', get_ctb_pos_examples(params, mode), params, mode, start)
+
+
+@data_files(CTB_SEG_PATTERN)
+def ctb_cws(params, mode, start=0):
+    return _ctb_problem(
+        'ctb_cws', get_ctb_cws_examples(params, mode), params, mode, start)
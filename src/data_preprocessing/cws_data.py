@@ -3,12 +3,17 @@ import os
 import glob
 from tqdm import tqdm
 
-from sklearn.model_selection import train_test_split
-
-from ..tokenization import FullTokenizer
+from ..tokenization import get_tokenizer
 
 from ..utils import get_or_make_label_encoder, TRAIN, EVAL, PREDICT
 from ..create_generators import create_single_problem_generator
+from .ctb_data import get_ctb_cws_examples, CTB_SEG_PATTERN
+from .corpus import get_line_corpus, data_files
+
+# icwb2 train files of a corpus, e.g. ICWB_TRAIN_PATTERN % 'msr_'
+ICWB_TRAIN_PATTERN = 'data/cws/training/%s*.utf8'
+# icwb2 gold test file of a corpus, read in eval mode
+ICWB_GOLD_PATTERN = 'data/cws/gold/%stest*_gold.utf8'
 
 
 def process_line_msr_pku(l):
@@ -38,334 +43,321 @@ def get_process_fn(filename):
         return process_line_cityu
 
 
-def _process_text_files(path_list):
-
-    # Create possible tags for fast lookup
-    possible_tags = []
-    for i in range(1, 300):
-        if i == 1:
-            possible_tags.append('s')
-        else:
-            possible_tags.append('b' + 'm' * (i - 2) + 'e')
-
-    inputs = []
-    target = []
-
-    for s in range(len(path_list)):
-        filename = path_list[s]
+# Create possible tags for fast lookup
+POSSIBLE_TAGS = ['s'] + ['b' + 'm' * (i - 2) + 'e' for i in range(2, 300)]
 
-        # Init left and right queue
 
-        with open(filename, 'r', encoding='utf8') as f:
+def _parse_icwb_line(lines, file_path):
+    process_fn = get_process_fn(os.path.split(file_path)[-1])
+    examples = []
+    for l in lines:
+        pos_tag = []
+        final_line = []
 
-            input_list = f.readlines()
+        decoded_line = process_fn(l)
 
-            process_fn = get_process_fn(os.path.split(filename)[-1])
+        for w in decoded_line:
+            if w and len(w) <= 299:
+                final_line.append(w)
+                pos_tag.append(POSSIBLE_TAGS[len(w) - 1])
 
-            for l in tqdm(input_list):
-                pos_tag = []
-                final_line = []
+        decode_str = ''.join(final_line)
 
-                decoded_line = process_fn(l)
+        pos_tag_str = ''.join(pos_tag)
 
-                for w in decoded_line:
-                    if w and len(w) <= 299:
-                        final_line.append(w)
-                        pos_tag.append(possible_tags[len(w) - 1])
+        if len(pos_tag_str) != len(decode_str):
+            print('Skip one row. ' + pos_tag_str + ';' + decode_str)
+            continue
 
-                decode_str = ''.join(final_line)
+        examples.append((list(decode_str), list(pos_tag_str)))
+    return examples
 
-                pos_tag_str = ''.join(pos_tag)
 
-                if len(pos_tag_str) != len(decode_str):
-                    print('Skip one row. ' + pos_tag_str + ';' + decode_str)
-                    continue
+def _process_text_files(path_list):
+    """Read icwb2 files, one sentence per line
 
-                inputs.append(list(decode_str))
-                target.append(list(pos_tag_str))
+    Arguments:
+        path_list {list} -- file paths
 
-    return inputs, target
+    Returns:
+        LazyExamples -- examples
+    """
+    return get_line_corpus('icwb', path_list, _parse_icwb_line).view()
 
 
-def CWS(params, mode):
+@data_files(CTB_SEG_PATTERN, ICWB_TRAIN_PATTERN % '',
+            eval_file_patterns=[CTB_SEG_PATTERN] + [
+                ICWB_GOLD_PATTERN % c for c in ['cityu_', 'msr_', 'pku_']])
+def CWS(params, mode, start=0):
     # ctb data
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
-    file_list = glob.glob('data/ctb8.0/data/segmented/*')
-
-    input_list = []
-    target_list = []
-
-    # Create possible tags for fast lookup
-    possible_tags = []
-    for i in range(1, 300):
-        if i == 1:
-            possible_tags.append('s')
-        else:
-            possible_tags.append('b' + 'm' * (i - 2) + 'e')
-
-    for file_path in file_list:
-        with open(file_path, 'r', encoding='utf8') as f:
-            raw_doc_list = f.readlines()
-        text_row_ind = [i+1 for i,
-                        text in enumerate(raw_doc_list) if '<S ID=' in text]
-
-        sentence_list = [text for i,
-                         text in enumerate(raw_doc_list) if i in text_row_ind]
-
-        for sentence in sentence_list:
-            input_list.append([])
-            target_list.append([])
-            for word in sentence.split():
-                if word and len(word) <= 299:
-                    tag = possible_tags[len(word) - 1]
-                    input_list[-1] += list(word)
-                    target_list[-1] += list(tag)
-                else:
-                    continue
-
-    if mode == 'train':
-        input_list, _, target_list, _ = train_test_split(
-            input_list, target_list, test_size=0.2, random_state=3721)
-    else:
-        _, input_list, _, target_list = train_test_split(
-            input_list, target_list, test_size=0.2, random_state=3721)
-
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % '')
     else:
         file_list = [  # 'as_testing_gold.utf8',
             'cityu_test_gold.utf8', 'msr_test_gold.utf8', 'pku_test_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    icwb_inputs, icwb_target = _process_text_files(file_list)
-
-    input_list += icwb_inputs
-    target_list += icwb_target
+    examples = get_ctb_cws_examples(params, mode) + \
+        _process_text_files(file_list)
 
     label_encoder = get_or_make_label_encoder(
         params, 'CWS', mode, ['b', 'm', 'e', 's'], zero_class='[PAD]')
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('CWS',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def as_cws(params, mode):
+@data_files(ICWB_TRAIN_PATTERN % 'as_',
+            eval_file_patterns=[ICWB_GOLD_PATTERN % 'as_'])
+def as_cws(params, mode, start=0):
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/as_*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % 'as_')
     else:
         file_list = ['as_testing_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    input_list, target_list = _process_text_files(file_list)
+    examples = _process_text_files(file_list)
 
     label_encoder = get_or_make_label_encoder(
         params, 'as_cws', mode, ['b', 'm', 'e', 's'], zero_class='[PAD]')
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('as_cws',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def msr_cws(params, mode):
+@data_files(ICWB_TRAIN_PATTERN % 'msr_',
+            eval_file_patterns=[ICWB_GOLD_PATTERN % 'msr_'])
+def msr_cws(params, mode, start=0):
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/msr_*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % 'msr_')
     else:
         file_list = ['msr_test_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    input_list, target_list = _process_text_files(file_list)
+    examples = _process_text_files(file_list)
 
     label_encoder = get_or_make_label_encoder(
         params, 'msr_cws', mode, ['b', 'm', 'e', 's'], zero_class='[PAD]')
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('msr_cws',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def pku_cws(params, mode):
+@data_files(ICWB_TRAIN_PATTERN % 'pku_',
+            eval_file_patterns=[ICWB_GOLD_PATTERN % 'pku_'])
+def pku_cws(params, mode, start=0):
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/pku_*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % 'pku_')
     else:
         file_list = ['pku_test_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    input_list, target_list = _process_text_files(file_list)
+    examples = _process_text_files(file_list)
 
     label_encoder = get_or_make_label_encoder(
         params, 'pku_cws', mode, ['b', 'm', 'e', 's'], zero_class='[PAD]')
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('pku_cws',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def city_cws(params, mode):
+@data_files(ICWB_TRAIN_PATTERN % 'cityu_',
+            eval_file_patterns=[ICWB_GOLD_PATTERN % 'cityu_'])
+def city_cws(params, mode, start=0):
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/cityu_*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % 'cityu_')
     else:
         file_list = ['cityu_test_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    input_list, target_list = _process_text_files(file_list)
+    examples = _process_text_files(file_list)
 
     label_encoder = get_or_make_label_encoder(
         params, 'city_cws', mode, ['b', 'm', 'e', 's'], zero_class='[PAD]')
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('city_cws',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def as_domain(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+@data_files(ICWB_TRAIN_PATTERN % 'as_',
+            eval_file_patterns=[ICWB_GOLD_PATTERN % 'as_'])
+def as_domain(params, mode, start=0):
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/as_*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % 'as_')
     else:
         file_list = ['as_testing_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    input_list, target_list = _process_text_files(file_list)
+    examples = _process_text_files(file_list)
 
-    target_list = ['as_cws' for _ in target_list]
+    examples = examples.map_target(lambda _: 'as_cws')
     flat_target_list = ['as_cws', 'pku_cws', 'city_cws', 'msr_cws']
     label_encoder = get_or_make_label_encoder(
         params, 'cws_domain', mode, flat_target_list)
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('as_domain',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def msr_domain(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+@data_files(ICWB_TRAIN_PATTERN % 'msr_',
+            eval_file_patterns=[ICWB_GOLD_PATTERN % 'msr_'])
+def msr_domain(params, mode, start=0):
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/msr_*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % 'msr_')
     else:
         file_list = ['msr_test_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    input_list, target_list = _process_text_files(file_list)
+    examples = _process_text_files(file_list)
 
-    target_list = ['msr_cws' for _ in target_list]
+    examples = examples.map_target(lambda _: 'msr_cws')
     flat_target_list = ['as_cws', 'pku_cws', 'city_cws', 'msr_cws']
     label_encoder = get_or_make_label_encoder(
         params, 'cws_domain', mode, flat_target_list)
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('msr_domain',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def pku_domain(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+@data_files(ICWB_TRAIN_PATTERN % 'pku_',
+            eval_file_patterns=[ICWB_GOLD_PATTERN % 'pku_'])
+def pku_domain(params, mode, start=0):
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/pku_*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % 'pku_')
     else:
         file_list = ['pku_test_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    input_list, target_list = _process_text_files(file_list)
+    examples = _process_text_files(file_list)
 
-    target_list = ['pku_cws' for _ in target_list]
+    examples = examples.map_target(lambda _: 'pku_cws')
     flat_target_list = ['as_cws', 'pku_cws', 'city_cws', 'msr_cws']
     label_encoder = get_or_make_label_encoder(
         params, 'cws_domain', mode, flat_target_list)
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('pku_domain',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def cityu_domain(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+@data_files(ICWB_TRAIN_PATTERN % 'cityu_',
+            eval_file_patterns=[ICWB_GOLD_PATTERN % 'cityu_'])
+def cityu_domain(params, mode, start=0):
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
     if mode == 'train':
-        file_list = glob.glob('data/cws/training/cityu_*.utf8')
+        file_list = glob.glob(ICWB_TRAIN_PATTERN % 'cityu_')
     else:
         file_list = ['cityu_test_gold.utf8']
         # file_list = ['msr_test_gold.utf8']
         file_list = [os.path.join('data/cws/gold', f) for f in file_list]
 
-    input_list, target_list = _process_text_files(file_list)
+    examples = _process_text_files(file_list)
 
-    target_list = ['city_cws' for _ in target_list]
+    examples = examples.map_target(lambda _: 'city_cws')
     flat_target_list = ['as_cws', 'pku_cws', 'city_cws', 'msr_cws']
     label_encoder = get_or_make_label_encoder(
         params, 'cws_domain', mode, flat_target_list)
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
 
     return create_single_problem_generator('cityu_domain',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
@@ -2,49 +2,48 @@ from glob import glob
 import re
 import random
 
-from sklearn.model_selection import train_test_split
-
-from ..tokenization import FullTokenizer
+from ..tokenization import get_tokenizer
 
 from ..utils import get_or_make_label_encoder, TRAIN, EVAL, PREDICT
 from ..create_generators import create_single_problem_generator, create_pretraining_generator
+from .corpus import get_line_corpus, data_files
 
 
-def emotion_analysis(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
-    with open('data/emotion_analysis/mer.negative.courpus_and_tag2.txt') as f:
-        neg_data = [list(t.replace(' ', '')) for t in f.readlines()]
+EMOTION_NEG_FILE = 'data/emotion_analysis/mer.negative.courpus_and_tag2.txt'
+EMOTION_POS_FILE = 'data/emotion_analysis/mer.positive.courpus_and_tag2.txt'
 
-    with open('data/emotion_analysis/mer.positive.courpus_and_tag2.txt') as f:
-        pos_data = [list(t.replace(' ', '')) for t in f.readlines()]
 
-    neg_label = ['1' for _ in neg_data]
-    pos_label = ['0' for _ in pos_data]
+def _parse_emotion_line(lines, file_path):
+    label = '1' if file_path == EMOTION_NEG_FILE else '0'
+    return [(list(t.replace(' ', '')), label) for t in lines]
 
-    all_inputs = neg_data + pos_data
-    all_label = neg_label + pos_label
 
-    train_input, eval_input, train_target, eval_target = train_test_split(
-        all_inputs, all_label,  test_size=0.2, random_state=1024)
+@data_files(EMOTION_NEG_FILE, EMOTION_POS_FILE)
+def emotion_analysis(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
+    corpus = get_line_corpus(
+        'emotion_analysis', [EMOTION_NEG_FILE, EMOTION_POS_FILE],
+        _parse_emotion_line)
+    train_examples, eval_examples = corpus.split(0.2, 1024, params)
 
     if mode == 'train':
-        inputs_list = train_input
-        target_list = train_target
+        examples = train_examples
     else:
-        inputs_list = eval_input
-        target_list = eval_target
+        examples = eval_examples
 
     label_encoder = get_or_make_label_encoder(
         params, 'emotion_analysis', mode, ['0', '1'], zero_class='0')
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
 
     return create_single_problem_generator(
         'emotion_analysis',
-        inputs_list,
-        target_list,
+        examples,
+        None,
         label_encoder,
         params,
         tokenizer,
-        mode)
+        mode,
+        start=start)
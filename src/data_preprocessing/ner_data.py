@@ -1,13 +1,17 @@
 from glob import glob
 import re
 import random
+import functools
 
-from sklearn.model_selection import train_test_split
-
-from ..tokenization import FullTokenizer
+from ..tokenization import get_tokenizer
 
 from ..utils import get_or_make_label_encoder, TRAIN, EVAL, PREDICT
 from ..create_generators import create_single_problem_generator, create_pretraining_generator
+from .corpus import get_line_corpus, ListExamples, ChainedExamples, data_files
+
+WEIBO_NER_PATTERN = 'data/ner/weiboNER*'
+BOSON_NER_PATTERN = 'data/ner/BosonNLP_NER_6C/BosonNLP*'
+MSRA_NER_PATTERN = 'data/ner/MSRA/train*'
 
 NER_TYPE = ['LOC',  # location
             'GPE',
@@ -65,92 +69,75 @@ def chinese_literature_ent_type_process_fn(d):
     return ent_type
 
 
-def read_ner_data(file_pattern='data/ner/weiboNER*', proc_fn=None):
-    """Read data from golden horse data
+def _parse_ner_block(lines, file_path, proc_fn):
+    inputs = []
+    target = []
+    for d in lines:
+        if d != '\n':
+            # put first char to input
+            inputs.append(d[0])
+            target.append(proc_fn(d))
+    return [(inputs, target)]
+
+
+def read_ner_data(file_pattern=WEIBO_NER_PATTERN, proc_fn=None):
+    """Read data from golden horse data, sentences are separated
+    by blank lines.
 
 
     Arguments:
         file_pattern {str} -- file patterns
 
     Returns:
-        dict -- dict, key: 'train', 'eval', value: dict {'inputs', 'target'}
+        dict -- dict, key: 'train', 'eval', value: LazyExamples of
+            (inputs, target)
     """
 
     result_dict = {
-        'train': {
-            'inputs': [],
-            'target': []
-        },
-        'eval': {
-            'inputs': [],
-            'target': []
-        }
+        'train': ListExamples([], []),
+        'eval': ListExamples([], [])
     }
     file_list = glob(file_pattern)
     for file_path in file_list:
-        with open(file_path, 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
-
-        inputs_list = [[]]
-        target_list = [[]]
-        for d in raw_data:
-            if d != '\n':
-                # put first char to input
-                inputs_list[-1].append(d[0])
-                ent_type = proc_fn(d)
-                target_list[-1].append(ent_type)
-            else:
-                inputs_list.append([])
-                target_list.append([])
-
-        # remove trailing empty str/list
-        if not inputs_list[-1]:
-            del inputs_list[-1]
-        if not target_list[-1]:
-            del target_list[-1]
-
-        inputs_with_ent = []
-        target_with_ent = []
-        for inputs, target in zip(inputs_list, target_list):
-            # if len(set(target)) > 1:
-            inputs_with_ent.append(inputs)
-            target_with_ent.append(target)
+        examples = get_line_corpus(
+            'gold_horse_%s' % proc_fn.__name__, [file_path],
+            functools.partial(_parse_ner_block, proc_fn=proc_fn),
+            by_block=True).view()
 
         if 'train' in file_path or 'dev' in file_path:
-            result_dict['train']['inputs'] = inputs_with_ent
-            result_dict['train']['target'] = target_with_ent
+            result_dict['train'] = examples
         else:
-            result_dict['eval']['inputs'] = inputs_with_ent
-            result_dict['eval']['target'] = target_with_ent
+            result_dict['eval'] = examples
     return result_dict
 
 
-def weibo_ner(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
-    data = read_ner_data(file_pattern='data/ner/weiboNER*',
+@data_files(WEIBO_NER_PATTERN)
+def weibo_ner(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
+    data = read_ner_data(file_pattern=WEIBO_NER_PATTERN,
                          proc_fn=gold_horse_ent_type_process_fn)
     if mode == 'train':
-        data = data['train']
+        examples = data['train']
     else:
-        data = data['eval']
-    inputs_list = data['inputs']
-    target_list = data['target']
-
-    flat_label = [item for sublist in target_list for item in sublist]
+        examples = data['eval']
 
+    # labels are only read if the label encoder is fitted
+    label_list = examples.label_set
     label_encoder = get_or_make_label_encoder(
-        params, 'weibo_ner', mode, flat_label)
+        params, 'weibo_ner', mode, label_list)
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
 
     return create_single_problem_generator('weibo_ner',
-                                           inputs_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
 def gold_horse_segment_process_fn(d):
@@ -160,360 +147,328 @@ def gold_horse_segment_process_fn(d):
     return ent_type
 
 
-def weibo_cws(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
-    data = read_ner_data(file_pattern='data/ner/weiboNER*',
+@data_files(WEIBO_NER_PATTERN)
+def weibo_cws(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
+    data = read_ner_data(file_pattern=WEIBO_NER_PATTERN,
                          proc_fn=gold_horse_segment_process_fn)
     if mode == 'train':
-        data = data['train']
+        examples = data['train']
     else:
-        data = data['eval']
-    inputs_list = data['inputs']
-    target_list = data['target']
-
-    flat_label = [item for sublist in target_list for item in sublist]
+        examples = data['eval']
 
+    # labels are only read if the label encoder is fitted
+    label_list = examples.label_set
     label_encoder = get_or_make_label_encoder(
-        params, 'weibo_cws', mode, flat_label, '0')
+        params, 'weibo_cws', mode, label_list, '0')
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
 
     return create_single_problem_generator('weibo_cws',
-                                           inputs_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
-
-
-def read_bosonnlp_data(file_pattern, eval_size=0.2):
-    file_list = glob(file_pattern)
-    sentence_split = r'[!?。？！]'
-
-    project_table = {
-        'person_name': 'PER',
-        'company_name': 'ORG',
-        'location': 'LOC',
-        'product_name': 'PRD',
-        'time': 'TME',
-        'org_name': 'ORG2'
-    }
-    input_list = []
-    target_list = []
-
-    if not file_list:
-        raise FileNotFoundError('Please make sure you have downloaded BosonNLP\
-        data and put it in the path you specified. \
-        Download: https://bosonnlp.com/resources/BosonNLP_NER_6C.zip')
-
-    for file_path in file_list:
-        with open(file_path, 'r', encoding='utf8') as f:
-            data_list = f.readlines()
+                                           mode,
+                                           start=start)
 
-        for doc in data_list:
-            if '}}}}' in doc:
-                continue
-            splited_doc = re.split(sentence_split, doc)
 
-            for sentence in splited_doc:
+BOSON_PROJECT_TABLE = {
+    'person_name': 'PER',
+    'company_name': 'ORG',
+    'location': 'LOC',
+    'product_name': 'PRD',
+    'time': 'TME',
+    'org_name': 'ORG2'
+}
 
-                # split doc into sentences
 
-                input_list.append([])
-                target_list.append([])
-
-                # split by {{
-                doc_chunk_list = sentence.split('{{')
-                for chunk in doc_chunk_list:
-                    if '}}' not in chunk or ':' not in chunk:
-                        target_list[-1] += ['O']*len(chunk)
-                        input_list[-1] += list(chunk)
+def _parse_bosonnlp_line(lines, file_path):
+    sentence_split = r'[!?。？！]'
+    examples = []
+    for doc in lines:
+        if '}}}}' in doc:
+            continue
+        splited_doc = re.split(sentence_split, doc)
+
+        for sentence in splited_doc:
+
+            # split doc into sentences
+
+            inputs = []
+            target = []
+
+            # split by {{
+            doc_chunk_list = sentence.split('{{')
+            for chunk in doc_chunk_list:
+                if '}}' not in chunk or ':' not in chunk:
+                    target += ['O']*len(chunk)
+                    inputs += list(chunk)
+                else:
+                    ent_chunk, text_chunk = chunk.split('}}')
+                    punc_ind = ent_chunk.index(':')
+                    ent_type = ent_chunk[:punc_ind]
+                    ent = ent_chunk[punc_ind+1:]
+                    if ent_type in BOSON_PROJECT_TABLE:
+                        for char_ind, ent_char in enumerate(ent):
+                            if char_ind == 0:
+                                loc_char = 'B'
+                            else:
+                                loc_char = 'I'
+                            target.append(loc_char +
+                                          '-'+BOSON_PROJECT_TABLE[ent_type])
+                            inputs.append(ent_char)
                     else:
-                        ent_chunk, text_chunk = chunk.split('}}')
-                        punc_ind = ent_chunk.index(':')
-                        ent_type = ent_chunk[:punc_ind]
-                        ent = ent_chunk[punc_ind+1:]
-                        if ent_type in project_table:
-                            for char_ind, ent_char in enumerate(ent):
-                                if char_ind == 0:
-                                    loc_char = 'B'
-                                else:
-                                    loc_char = 'I'
-                                target_list[-1].append(loc_char +
-                                                       '-'+project_table[ent_type])
-                                input_list[-1].append(ent_char)
-                        else:
-                            target_list[-1] += ['O']*len(ent)
-                            input_list[-1] += list(ent)
+                        target += ['O']*len(ent)
+                        inputs += list(ent)
 
-                        target_list[-1] += ['O']*len(text_chunk)
-                        input_list[-1] += list(text_chunk)
+                    target += ['O']*len(text_chunk)
+                    inputs += list(text_chunk)
 
-    return_input, return_target = [], []
-    for inp, tar in zip(input_list, target_list):
-        if inp and tar:
-            return_input.append(inp)
-            return_target.append(tar)
-        assert len(inp) == len(tar)
-
-    train_input, eval_input, train_target, eval_target = train_test_split(
-        return_input, return_target, test_size=eval_size, random_state=1024)
-    result_dict = {
-        'train': {},
-        'eval': {}
-    }
-    result_dict['train']['inputs'] = train_input
-    result_dict['train']['target'] = train_target
-    result_dict['eval']['inputs'] = eval_input
-    result_dict['eval']['target'] = eval_target
-    return result_dict
+            assert len(inputs) == len(target)
+            if inputs and target:
+                examples.append((inputs, target))
+    return examples
 
 
-def read_msra(file_pattern, eval_size):
+def read_bosonnlp_data(file_pattern, eval_size=0.2, params=None):
     file_list = glob(file_pattern)
 
-    project_table = {
-        'nr': 'PER',
-        'nt': 'ORG',
-        'ns': 'LOC'
+    if not file_list:
+        raise FileNotFoundError('Please make sure you have downloaded BosonNLP\
+        data and put it in the path you specified. \
+        Download: https://bosonnlp.com/resources/BosonNLP_NER_6C.zip')
+
+    corpus = get_line_corpus('bosonnlp', file_list, _parse_bosonnlp_line)
+    train_examples, eval_examples = corpus.split(eval_size, 1024, params)
+    return {
+        'train': train_examples,
+        'eval': eval_examples
     }
 
-    input_list = []
-    target_list = []
 
-    for file_path in file_list:
-        with open(file_path, 'r', encoding='utf8') as f:
-            data_list = f.readlines()
-
-        for sentence in data_list:
-            sentence = sentence.replace('\n', '')
-            input_list.append([])
-            target_list.append([])
-            sentence_word_list = sentence.split(' ')
-            for word in sentence_word_list:
-                if word:
-                    ent, ent_type = word.split('/')
-                    if ent_type not in project_table:
-                        input_list[-1] += list(ent)
-                        target_list[-1] += ['O'] * len(ent)
-                    else:
-                        for char_ind, ent_char in enumerate(ent):
-                            if char_ind == 0:
-                                loc_char = 'B'
-                            else:
-                                loc_char = 'I'
+MSRA_PROJECT_TABLE = {
+    'nr': 'PER',
+    'nt': 'ORG',
+    'ns': 'LOC'
+}
+
+
+def _parse_msra_line(lines, file_path):
+    examples = []
+    for sentence in lines:
+        sentence = sentence.replace('\n', '')
+        inputs = []
+        target = []
+        sentence_word_list = sentence.split(' ')
+        for word in sentence_word_list:
+            if word:
+                ent, ent_type = word.split('/')
+                if ent_type not in MSRA_PROJECT_TABLE:
+                    inputs += list(ent)
+                    target += ['O'] * len(ent)
+                else:
+                    for char_ind, ent_char in enumerate(ent):
+                        if char_ind == 0:
+                            loc_char = 'B'
+                        else:
+                            loc_char = 'I'
 
-                            target_list[-1].append(loc_char +
-                                                   '-'+project_table[ent_type])
-                            input_list[-1].append(ent_char)
+                        target.append(loc_char +
+                                      '-'+MSRA_PROJECT_TABLE[ent_type])
+                        inputs.append(ent_char)
+        assert len(inputs) == len(target)
+        if inputs and target:
+            examples.append((inputs, target))
+    return examples
 
-    return_input, return_target = [], []
-    for inp, tar in zip(input_list, target_list):
-        if inp and tar:
-            return_input.append(inp)
-            return_target.append(tar)
-        assert len(inp) == len(tar)
 
-    train_input, eval_input, train_target, eval_target = train_test_split(
-        return_input, return_target, test_size=eval_size, random_state=1024)
-    result_dict = {
-        'train': {},
-        'eval': {}
+def read_msra(file_pattern, eval_size, params=None):
+    file_list = glob(file_pattern)
+    corpus = get_line_corpus('msra', file_list, _parse_msra_line)
+    train_examples, eval_examples = corpus.split(eval_size, 1024, params)
+    return {
+        'train': train_examples,
+        'eval': eval_examples
     }
-    result_dict['train']['inputs'] = train_input
-    result_dict['train']['target'] = train_target
-    result_dict['eval']['inputs'] = eval_input
-    result_dict['eval']['target'] = eval_target
-    return result_dict
 
 
-def NER(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
-    weibo_data = read_ner_data(file_pattern='data/ner/weiboNER*',
+@data_files(WEIBO_NER_PATTERN, BOSON_NER_PATTERN, MSRA_NER_PATTERN)
+def NER(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
+    weibo_data = read_ner_data(file_pattern=WEIBO_NER_PATTERN,
                                proc_fn=gold_horse_ent_type_process_fn)
     boson_data = read_bosonnlp_data(
-        file_pattern='data/ner/BosonNLP_NER_6C/BosonNLP*', eval_size=0.2)
-    msra_data = read_msra(file_pattern='data/ner/MSRA/train*', eval_size=0.2)
+        file_pattern=BOSON_NER_PATTERN, eval_size=0.2,
+        params=params)
+    msra_data = read_msra(file_pattern=MSRA_NER_PATTERN, eval_size=0.2,
+                          params=params)
 
-    inputs_list = []
-    target_list = []
-    for data in [weibo_data, boson_data, msra_data]:
-        if mode == 'train':
-            inputs_list += data['train']['inputs']
-            target_list += data['train']['target']
-
-        else:
-            inputs_list += data['eval']['inputs']
-            target_list += data['eval']['target']
-
-    flat_target_list = [t for sublist in target_list for t in sublist]
+    split = 'train' if mode == 'train' else 'eval'
+    examples = ChainedExamples(
+        *[data[split] for data in [weibo_data, boson_data, msra_data]])
 
+    # labels are only read if the label encoder is fitted
+    label_list = examples.label_set
     label_encoder = get_or_make_label_encoder(
-        params, 'NER', mode, flat_target_list, zero_class='O')
+        params, 'NER', mode, label_list, zero_class='O')
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
+
     return create_single_problem_generator('NER',
-                                           inputs_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
-
-
-def msra_ner(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
+                                           mode,
+                                           start=start)
 
-    msra_data = read_msra(file_pattern='data/ner/MSRA/train*', eval_size=0.2)
 
-    inputs_list = []
-    target_list = []
-    for data in [msra_data]:
-        if mode == 'train':
-            inputs_list += data['train']['inputs']
-            target_list += data['train']['target']
-
-        else:
-            inputs_list += data['eval']['inputs']
-            target_list += data['eval']['target']
-    flat_target_list = [t for sublist in target_list for t in sublist]
+@data_files(MSRA_NER_PATTERN)
+def msra_ner(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
+    msra_data = read_msra(file_pattern=MSRA_NER_PATTERN, eval_size=0.2,
+                          params=params)
+    if mode == 'train':
+        examples = msra_data['train']
+    else:
+        examples = msra_data['eval']
 
+    # labels are only read if the label encoder is fitted
+    label_list = examples.label_set
     label_encoder = get_or_make_label_encoder(
-        params, 'msra_ner', mode, flat_target_list, zero_class='O')
-
+        params, 'msra_ner', mode, label_list, zero_class='O')
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
+
     return create_single_problem_generator('msra_ner',
-                                           inputs_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
-
+                                           mode,
+                                           start=start)
 
-def boson_ner(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
 
+@data_files(BOSON_NER_PATTERN)
+def boson_ner(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
     boson_data = read_bosonnlp_data(
-        file_pattern='data/ner/BosonNLP_NER_6C/BosonNLP*', eval_size=0.2)
-
-    inputs_list = []
-    target_list = []
-    for data in [boson_data]:
-        if mode == 'train':
-            inputs_list += data['train']['inputs']
-            target_list += data['train']['target']
+        file_pattern=BOSON_NER_PATTERN, eval_size=0.2,
+        params=params)
+    if mode == 'train':
+        examples = boson_data['train']
+    else:
+        examples = boson_data['eval']
 
-        else:
-            inputs_list += data['eval']['inputs']
-            target_list += data['eval']['target']
-    flat_target_list = [t for sublist in target_list for t in sublist]
+    # labels are only read if the label encoder is fitted
+    label_list = examples.label_set
     label_encoder = get_or_make_label_encoder(
-        params, 'boson_ner', mode, flat_target_list, zero_class='O')
+        params, 'boson_ner', mode, label_list, zero_class='O')
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
 
     return create_single_problem_generator('boson_ner',
-                                           inputs_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def boson_domain(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
-
+@data_files(BOSON_NER_PATTERN)
+def boson_domain(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
     boson_data = read_bosonnlp_data(
-        file_pattern='data/ner/BosonNLP_NER_6C/BosonNLP*', eval_size=0.2)
-
-    inputs_list = []
-    target_list = []
-    for data in [boson_data]:
-        if mode == 'train':
-            inputs_list += data['train']['inputs']
-            target_list += data['train']['target']
+        file_pattern=BOSON_NER_PATTERN, eval_size=0.2,
+        params=params)
+    if mode == 'train':
+        examples = boson_data['train']
+    else:
+        examples = boson_data['eval']
 
-        else:
-            inputs_list += data['eval']['inputs']
-            target_list += data['eval']['target']
-    target_list = ['boson_ner' for _ in target_list]
+    examples = examples.map_target(lambda _: 'boson_ner')
     flat_target_list = ['boson_ner', 'weibo_ner', 'msra_ner']
     label_encoder = get_or_make_label_encoder(
         params, 'ner_domain', mode, flat_target_list)
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
     return create_single_problem_generator('boson_domain',
-                                           inputs_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def Weibo_domain(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
-    data = read_ner_data(file_pattern='data/ner/weiboNER*',
+@data_files(WEIBO_NER_PATTERN)
+def Weibo_domain(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
+    data = read_ner_data(file_pattern=WEIBO_NER_PATTERN,
                          proc_fn=gold_horse_ent_type_process_fn)
     if mode == 'train':
-        data = data['train']
+        examples = data['train']
     else:
-        data = data['eval']
-    inputs_list = data['inputs']
-    target_list = data['target']
+        examples = data['eval']
 
-    target_list = ['weibo_ner' for _ in target_list]
+    examples = examples.map_target(lambda _: 'weibo_ner')
     flat_target_list = ['boson_ner', 'weibo_ner', 'msra_ner']
     label_encoder = get_or_make_label_encoder(
         params, 'ner_domain', mode, flat_target_list)
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
     return create_single_problem_generator('Weibo_domain',
-                                           inputs_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
-
-
-def msra_domain(params, mode):
-    tokenizer = FullTokenizer(
-        vocab_file=params.vocab_file, do_lower_case=False)
+                                           mode,
+                                           start=start)
 
-    msra_data = read_msra(file_pattern='data/ner/MSRA/train*', eval_size=0.2)
 
-    inputs_list = []
-    target_list = []
-    for data in [msra_data]:
-        if mode == 'train':
-            inputs_list += data['train']['inputs']
-            target_list += data['train']['target']
-
-        else:
-            inputs_list += data['eval']['inputs']
-            target_list += data['eval']['target']
+@data_files(MSRA_NER_PATTERN)
+def msra_domain(params, mode, start=0):
+    tokenizer = get_tokenizer(
+        params.vocab_file, do_lower_case=False, cache_dir=params.cache_dir)
+    msra_data = read_msra(file_pattern=MSRA_NER_PATTERN, eval_size=0.2,
+                          params=params)
+    if mode == 'train':
+        examples = msra_data['train']
+    else:
+        examples = msra_data['eval']
 
-    target_list = ['msra_ner' for _ in target_list]
+    examples = examples.map_target(lambda _: 'msra_ner')
     flat_target_list = ['boson_ner', 'weibo_ner', 'msra_ner']
     label_encoder = get_or_make_label_encoder(
         params, 'ner_domain', mode, flat_target_list)
     if mode == PREDICT:
+        inputs_list, target_list = examples.to_lists()
         return inputs_list, target_list, label_encoder
     return create_single_problem_generator('msra_domain',
-                                           inputs_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
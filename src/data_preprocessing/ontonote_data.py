@@ -1,6 +1,7 @@
 import re
+import operator
 
-from ..tokenization import FullTokenizer
+from ..tokenization import get_tokenizer
 
 from ..utils import (
     get_or_make_label_encoder,
@@ -8,6 +9,16 @@ from ..utils import (
     EOS_TOKEN,
     PREDICT)
 from ..create_generators import create_single_problem_generator
+from .corpus import get_line_corpus, data_files
+
+ONTONOTES_TRAIN_FILE = 'data/ontonote/train.fuse.parse'
+ONTONOTES_TEST_FILE = 'data/ontonote/test.fuse.parse'
+
+# index of targets in parsed OntoNotes examples
+ONTONOTES_SEG = 0
+ONTONOTES_NER = 1
+ONTONOTES_FULL_POS = 2
+ONTONOTES_POS = 3
 
 
 def parse_one(s):
@@ -61,123 +72,83 @@ def parse_one(s):
     return seg, ner, full_pos, text, pos_result
 
 
-def ontonotes_ner(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+def _parse_ontonotes_line(lines, file_path):
+    seg, ner, full_pos, text, pos_result = parse_one(''.join(lines))
+    return [(text, (seg, ner, full_pos, pos_result))]
 
-    if mode == 'train':
-        with open('data/ontonote/train.fuse.parse', 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
-    else:
-        with open('data/ontonote/test.fuse.parse', 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
 
-    _, target, _, inputs_list, _ = zip(*[parse_one(s) for s in raw_data])
-    flat_target_list = [t for sublist in target for t in sublist]
-    label_encoder = get_or_make_label_encoder(
-        params, 'ontonotes_ner', mode, flat_target_list)
-    if mode == PREDICT:
-        return inputs_list, target, label_encoder
-    return create_single_problem_generator('ontonotes_ner',
-                                           inputs_list,
-                                           target,
-                                           label_encoder,
-                                           params,
-                                           tokenizer,
-                                           mode)
+def get_ontonotes_examples(file_path, target_ind):
+    """Examples of OntoNotes file, parsed lazily with parse_one, one
+    example per line.
+
+    Arguments:
+        file_path {str} -- path of *.fuse.parse file
+        target_ind {int} -- which target of parse_one to use, one of
+            ONTONOTES_SEG, ONTONOTES_NER, ONTONOTES_FULL_POS, ONTONOTES_POS
+
+    Returns:
+        LazyExamples -- examples
+    """
+    corpus = get_line_corpus(
+        'ontonotes', [file_path], _parse_ontonotes_line, one_per_record=True)
+    return corpus.view().map_target(operator.itemgetter(target_ind))
 
 
-def ontonotes_cws(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+def _ontonotes_problem(problem, target_ind, params, mode, start):
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
 
     if mode == 'train':
-        with open('data/ontonote/train.fuse.parse', 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
+        examples = get_ontonotes_examples(ONTONOTES_TRAIN_FILE, target_ind)
     else:
-        with open('data/ontonote/test.fuse.parse', 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
+        examples = get_ontonotes_examples(ONTONOTES_TEST_FILE, target_ind)
+    # labels are only read if the label encoder is fitted
+    label_list = examples.label_set
+    if target_ind in (ONTONOTES_FULL_POS, ONTONOTES_POS):
+        if mode == 'train':
+            # some label not in train, weird
+            test_examples = get_ontonotes_examples(
+                ONTONOTES_TEST_FILE, target_ind)
+
+            def label_list():
+                return examples.label_set() | test_examples.label_set() | {
+                    BOS_TOKEN, EOS_TOKEN}
+        else:
+            label_list = None
 
-    target, _, _, inputs_list, _ = zip(*[parse_one(s) for s in raw_data])
-    flat_target_list = [t for sublist in target for t in sublist]
     label_encoder = get_or_make_label_encoder(
-        params, 'ontonotes_cws', mode, flat_target_list)
+        params, problem, mode, label_list)
     if mode == PREDICT:
+        inputs_list, target = examples.to_lists()
         return inputs_list, target, label_encoder
-    return create_single_problem_generator('ontonotes_cws',
-                                           inputs_list,
-                                           target,
+    return create_single_problem_generator(problem,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def ontonotes_chunk(params, mode):
+@data_files(ONTONOTES_TRAIN_FILE, eval_file_patterns=[ONTONOTES_TEST_FILE])
+def ontonotes_ner(params, mode, start=0):
+    return _ontonotes_problem(
+        'ontonotes_ner', ONTONOTES_NER, params, mode, start)
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
 
-    if mode == 'train':
-        with open('data/ontonote/train.fuse.parse', 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
-
-        # some label not in train, weird
-        with open('data/ontonote/test.fuse.parse', 'r', encoding='utf8') as f:
-            test_raw_data = f.readlines()
-        all_raw_data = raw_data + test_raw_data
-        _, _, target, inputs_list, _ = zip(*[parse_one(s) for s in raw_data])
-        _, _, all_target, _ = zip(*[parse_one(s) for s in all_raw_data])
-        flat_target_list = [t for sublist in all_target for t in sublist]
-        flat_target_list.extend([BOS_TOKEN, EOS_TOKEN])
-    else:
-        with open('data/ontonote/test.fuse.parse', 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
-        flat_target_list = None
-        _, _, target, inputs_list, _ = zip(*[parse_one(s) for s in raw_data])
-
-    label_encoder = get_or_make_label_encoder(
-        params, 'ontonotes_chunk', mode, flat_target_list)
-    if mode == PREDICT:
-        return inputs_list, target, label_encoder
-    return create_single_problem_generator(
-        'ontonotes_chunk',
-        inputs_list,
-        target,
-        label_encoder,
-        params,
-        tokenizer,
-        mode)
+@data_files(ONTONOTES_TRAIN_FILE, eval_file_patterns=[ONTONOTES_TEST_FILE])
+def ontonotes_cws(params, mode, start=0):
+    return _ontonotes_problem(
+        'ontonotes_cws', ONTONOTES_SEG, params, mode, start)
 
 
-def ontonotes_pos(params, mode):
+@data_files(ONTONOTES_TRAIN_FILE, ONTONOTES_TEST_FILE)
+def ontonotes_chunk(params, mode, start=0):
+    return _ontonotes_problem(
+        'ontonotes_chunk', ONTONOTES_FULL_POS, params, mode, start)
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
 
-    if mode == 'train':
-        with open('data/ontonote/train.fuse.parse', 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
-
-        # some label not in train, weird
-        with open('data/ontonote/test.fuse.parse', 'r', encoding='utf8') as f:
-            test_raw_data = f.readlines()
-        all_raw_data = raw_data + test_raw_data
-        _, _, _, inputs_list, target = zip(*[parse_one(s) for s in raw_data])
-        _, _, _, _, all_target = zip(*[parse_one(s) for s in all_raw_data])
-        flat_target_list = [t for sublist in all_target for t in sublist]
-        flat_target_list.extend([BOS_TOKEN, EOS_TOKEN])
-    else:
-        with open('data/ontonote/test.fuse.parse', 'r', encoding='utf8') as f:
-            raw_data = f.readlines()
-        flat_target_list = None
-        _, _, _, inputs_list, target = zip(*[parse_one(s) for s in raw_data])
-
-    label_encoder = get_or_make_label_encoder(
-        params, 'ontonotes_pos', mode, flat_target_list)
-    if mode == PREDICT:
-        return inputs_list, target, label_encoder
-    return create_single_problem_generator(
-        'ontonotes_pos',
-        inputs_list,
-        target,
-        label_encoder,
-        params,
-        tokenizer,
-        mode)
+@data_files(ONTONOTES_TRAIN_FILE, ONTONOTES_TEST_FILE)
+def ontonotes_pos(params, mode, start=0):
+    return _ontonotes_problem(
+        'ontonotes_pos', ONTONOTES_POS, params, mode, start)
@@ -1,34 +1,28 @@
-from sklearn.model_selection import train_test_split
-
-from ..tokenization import FullTokenizer
+from ..tokenization import get_tokenizer
 
 from ..utils import get_or_make_label_encoder, TRAIN, EVAL, PREDICT
 from ..create_generators import create_single_problem_generator
-from .ctb_data import read_ctb_pos
-
-
-def POS(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
+from .ctb_data import get_ctb_pos_examples, CTB_POS_PATTERN
+from .corpus import data_files
 
-    input_list, target_list = read_ctb_pos()
 
-    if mode == 'train':
-        input_list, _, target_list, _ = train_test_split(
-            input_list, target_list, test_size=0.2, random_state=3721)
-    else:
-        _, input_list, _, target_list = train_test_split(
-            input_list, target_list, test_size=0.2, random_state=3721)
+@data_files(CTB_POS_PATTERN)
+def POS(params, mode, start=0):
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
 
-    flat_target_list = [item for sublist in target_list for item in sublist]
+    examples = get_ctb_pos_examples(params, mode)
 
+    # labels are only read if the label encoder is fitted
     label_encoder = get_or_make_label_encoder(
-        params, 'POS', mode, flat_target_list, zero_class='[PAD]')
+        params, 'POS', mode, examples.label_set, zero_class='[PAD]')
     if mode == PREDICT:
+        input_list, target_list = examples.to_lists()
         return input_list, target_list, label_encoder
     return create_single_problem_generator('POS',
-                                           input_list,
-                                           target_list,
+                                           examples,
+                                           None,
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
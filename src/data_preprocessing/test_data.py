@@ -2,31 +2,35 @@
 
 import re
 
-from ..tokenization import FullTokenizer
+from ..tokenization import get_tokenizer
 
 from ..utils import (
     get_or_make_label_encoder, BOS_TOKEN, EOS_TOKEN)
 from ..create_generators import create_pretraining_generator, create_single_problem_generator
 
-from .ner_data import gold_horse_ent_type_process_fn, read_ner_data
+from .ner_data import (
+    gold_horse_ent_type_process_fn, read_ner_data, WEIBO_NER_PATTERN)
+from .corpus import data_files
 
 
-def weibo_fake_cls(params, mode):
+@data_files(WEIBO_NER_PATTERN)
+def weibo_fake_cls(params, mode, start=0):
     """Just a test problem to test multiproblem support
 
     Arguments:
         params {Params} -- params
         mode {mode} -- mode
     """
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
-    data = read_ner_data(file_pattern='data/ner/weiboNER*',
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
+    data = read_ner_data(file_pattern=WEIBO_NER_PATTERN,
                          proc_fn=gold_horse_ent_type_process_fn)
     if mode == 'train':
         data = data['train']
     else:
         data = data['eval']
-    inputs_list = data['inputs'][:100]
-    target_list = data['target'][:100]
+    inputs_list, target_list = data.to_lists()
+    inputs_list = inputs_list[:100]
+    target_list = target_list[:100]
 
     new_target_list = ['1' if len(set(t)) > 1 else '0' for t in target_list]
 
@@ -39,20 +43,23 @@ def weibo_fake_cls(params, mode):
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
 
 
-def weibo_fake_seq2seq_tag(params, mode: str):
+@data_files(WEIBO_NER_PATTERN)
+def weibo_fake_seq2seq_tag(params, mode: str, start=0):
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
-    data = read_ner_data(file_pattern='data/ner/weiboNER*',
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
+    data = read_ner_data(file_pattern=WEIBO_NER_PATTERN,
                          proc_fn=gold_horse_ent_type_process_fn)
     if mode == 'train':
         data = data['train']
     else:
         data = data['eval']
-    inputs_list = data['inputs'][:100]
-    target_list = data['target'][:100]
+    inputs_list, target_list = data.to_lists()
+    inputs_list = inputs_list[:100]
+    target_list = target_list[:100]
     new_target_list = [['1', '2'] for t in target_list]
     label_encoder = get_or_make_label_encoder(
         params,
@@ -68,21 +75,23 @@ def weibo_fake_seq2seq_tag(params, mode: str):
         label_encoder,
         params,
         tokenizer,
-        mode)
+        mode,
+        start=start)
 
 
+@data_files(WEIBO_NER_PATTERN)
 def weibo_pretrain(params, mode):
 
     sentence_split = r'[.!?。？！]'
 
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
-    data = read_ner_data(file_pattern='data/ner/weiboNER*',
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
+    data = read_ner_data(file_pattern=WEIBO_NER_PATTERN,
                          proc_fn=gold_horse_segment_process_fn)
     if mode == 'train':
         data = data['train']
     else:
         data = data['eval']
-    inputs_list = data['inputs']
+    inputs_list, _ = data.to_lists()
 
     segmented_list = []
     for document in inputs_list:
@@ -103,16 +112,18 @@ def weibo_pretrain(params, mode):
                                         mode)
 
 
-def weibo_fake_seq_tag(params, mode):
-    tokenizer = FullTokenizer(vocab_file=params.vocab_file)
-    data = read_ner_data(file_pattern='data/ner/weiboNER*',
+@data_files(WEIBO_NER_PATTERN)
+def weibo_fake_seq_tag(params, mode, start=0):
+    tokenizer = get_tokenizer(params.vocab_file, cache_dir=params.cache_dir)
+    data = read_ner_data(file_pattern=WEIBO_NER_PATTERN,
                          proc_fn=gold_horse_ent_type_process_fn)
     if mode == 'train':
         data = data['train']
     else:
         data = data['eval']
-    inputs_list = data['inputs'][:100]
-    target_list = data['target'][:100]
+    inputs_list, target_list = data.to_lists()
+    inputs_list = inputs_list[:100]
+    target_list = target_list[:100]
 
     flat_label = [item for sublist in target_list for item in sublist]
 
@@ -125,4 +136,5 @@ def weibo_fake_seq_tag(params, mode):
                                            label_encoder,
                                            params,
                                            tokenizer,
-                                           mode)
+                                           mode,
+                                           start=start)
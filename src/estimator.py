@@ -67,6 +67,9 @@ from tensorflow.python.util import function_utils
 from tensorflow.python.util import nest
 from tensorflow.python.util.tf_export import estimator_export
 
+from .utils import InputContext
+from .input_state import InputStateSaverListener
+
 
 _VALID_MODEL_FN_ARGS = set(
     ['features', 'labels', 'mode', 'params', 'self', 'config'])
@@ -351,6 +354,9 @@ class Estimator(object):
       hooks.extend(self._convert_train_steps_to_hooks(steps, max_steps))
 
       saving_listeners = _check_listeners_type(saving_listeners)
+      if getattr(self._params, 'resumable_input', False):
+        # save position of input with checkpoints
+        saving_listeners.append(InputStateSaverListener(self._model_dir))
       loss = self._train_model(input_fn, hooks, saving_listeners)
       logging.info('Loss for final step: %s.', loss)
       return self
@@ -1158,6 +1164,13 @@ class Estimator(object):
       kwargs['params'] = self.params
     if 'config' in input_fn_args:
       kwargs['config'] = self.config
+    if ('input_context' in input_fn_args and
+        mode == model_fn_lib.ModeKeys.TRAIN):
+      # one input pipeline per worker, eval reads all examples.
+      # Replicas of MirroredStrategy in one worker share its pipeline
+      kwargs['input_context'] = InputContext(
+          num_input_pipelines=max(1, self.config.num_worker_replicas),
+          input_pipeline_id=self.config.global_id_in_cluster or 0)
     with ops.device('/cpu:0'):
       return input_fn(**kwargs)
 
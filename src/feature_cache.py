@@ -0,0 +1,489 @@
+import os
+import glob
+import json
+import mmap
+import struct
+import shutil
+import hashlib
+import itertools
+from array import array
+
+import numpy as np
+import tensorflow as tf
+
+from .utils import (create_path, get_label_encoder_labels,
+                    get_or_make_label_encoder, restore_label_encoder, TRAIN)
+
+# bump this if the layout of cached features changes
+CACHE_VERSION = 1
+SHARD_SIZE = 10000
+MANIFEST_NAME = 'manifest.json'
+DATA_INFO_INDEX_NAME = 'data_info_index.json'
+
+_FILE_MD5 = {}
+# memorized byte offsets of records of tfrecord files
+_RECORD_OFFSETS = {}
+
+
+def file_md5(path):
+    """Md5 of file content, memorized by path, size and mtime
+
+    Arguments:
+        path {str} -- file path
+
+    Returns:
+        str -- hex digest
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if memo_key not in _FILE_MD5:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                md5.update(chunk)
+        _FILE_MD5[memo_key] = md5.hexdigest()
+    return _FILE_MD5[memo_key]
+
+
+def get_files_key(file_list):
+    """Checksum of content of files, used as data_key of split manifest
+    and in the keys of feature cache and data info index"""
+    md5 = hashlib.md5()
+    for file_path in file_list:
+        md5.update(('%s:%s;' % (
+            os.path.basename(file_path), file_md5(file_path))).encode('utf8'))
+    return md5.hexdigest()
+
+
+def get_data_files_key(params, problem, mode=TRAIN):
+    """Checksum of the data files that the reader of problem reads in
+    mode, registered with data_preprocessing.corpus.data_files.
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+
+    Keyword Arguments:
+        mode {str} -- mode (default: {TRAIN})
+
+    Returns:
+        str -- hex digest, None if data files of problem are unknown
+    """
+    if mode == TRAIN:
+        file_patterns = params.data_file_patterns.get(problem)
+    else:
+        file_patterns = params.eval_data_file_patterns.get(problem)
+    if not file_patterns:
+        return None
+    file_list = sorted(set(
+        f for pattern in file_patterns
+        for f in glob.glob(pattern) if os.path.isfile(f)))
+    if not file_list:
+        return None
+    return get_files_key(file_list)
+
+
+def labels_md5(labels):
+    return hashlib.md5(
+        json.dumps(labels, ensure_ascii=False).encode('utf8')).hexdigest()
+
+
+def use_feature_cache(params, mode):
+    """Whether featurized examples can be cached.
+    Punctuation augumentation changes raw inputs randomly, so the
+    featurized train examples are not deterministic.
+    """
+    if not params.feature_cache:
+        return False
+    if mode == TRAIN and params.punc_replace_prob > 0:
+        return False
+    return True
+
+
+def get_cache_path(params, problem, mode):
+    """Cache path of (problem, mode, vocab, max_seq_len, data files,
+    input pipeline). Different label encoders are stored as sub dirs
+    of this path.
+    """
+    key = '_'.join([
+        'v%d' % CACHE_VERSION,
+        file_md5(params.vocab_file)[:12],
+        str(params.max_seq_len),
+        str(params.decode_max_seq_len)])
+    # readers without registered data files are only keyed by the above
+    data_key = get_data_files_key(params, problem, mode)
+    if data_key is not None:
+        key += '_' + data_key[:12]
+    # every input pipeline caches its own slice of examples
+    if params.num_input_pipelines > 1:
+        key += '_shard%dof%d' % (
+            params.input_pipeline_id, params.num_input_pipelines)
+    return os.path.join(params.cache_dir, 'features', problem, mode, key)
+
+
+def _to_example(features):
+    feature = {
+        k: tf.train.Feature(int64_list=tf.train.Int64List(
+            value=[int(i) for i in v] if isinstance(v, list) else [int(v)]))
+        for k, v in features.items()}
+    return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def _from_example(serialized, scalar_keys):
+    example = tf.train.Example.FromString(serialized)
+    features = {}
+    for k, v in example.features.feature.items():
+        features[k] = list(v.int64_list.value)
+        if k in scalar_keys:
+            features[k] = features[k][0]
+    return features
+
+
+def write_feature_cache(params, problem, mode, label_encoder, feature_gen):
+    """Pass through featurized examples and write them to cache shards.
+    The cache only becomes visible when feature_gen is exhausted.
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+        mode {str} -- mode
+        label_encoder {LabelEncoder} -- label encoder used to featurize
+        feature_gen {generator} -- generator of unpadded features
+
+    Yields:
+        dict -- unpadded features
+    """
+    labels = get_label_encoder_labels(label_encoder)
+    cache_path = os.path.join(
+        get_cache_path(params, problem, mode), labels_md5(labels)[:12])
+    if os.path.exists(os.path.join(cache_path, MANIFEST_NAME)):
+        for features in feature_gen:
+            yield features
+        return
+
+    tmp_path = '%s.tmp-%d' % (cache_path, os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    create_path(tmp_path)
+
+    shards = []
+    scalar_keys = set()
+    writer = None
+    num_examples = 0
+    try:
+        for features in feature_gen:
+            if num_examples % SHARD_SIZE == 0:
+                if writer is not None:
+                    writer.close()
+                shards.append('shard-%05d.tfrecord' % len(shards))
+                writer = tf.python_io.TFRecordWriter(
+                    os.path.join(tmp_path, shards[-1]))
+            scalar_keys.update(
+                k for k, v in features.items() if not isinstance(v, list))
+            writer.write(_to_example(features).SerializeToString())
+            num_examples += 1
+            yield features
+    except BaseException:
+        # not exhausted or broken, drop the partial cache
+        if writer is not None:
+            writer.close()
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    if writer is not None:
+        writer.close()
+
+    manifest = {
+        'problem': problem,
+        'mode': mode,
+        'num_examples': num_examples,
+        'shards': shards,
+        'scalar_keys': sorted(scalar_keys),
+        'label_encoder': label_encoder.name,
+        'labels': labels
+    }
+    with open(os.path.join(tmp_path, MANIFEST_NAME), 'w', encoding='utf8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # cache written by others in the mean time
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    tf.logging.info('Write %d %s examples of %s to feature cache %s' % (
+        num_examples, mode, problem, cache_path))
+    # the number of featurized train examples replaces the raw count
+    if mode == TRAIN and params.num_input_pipelines <= 1:
+        write_data_info_index(
+            params, problem, num_examples, label_encoder, featurized=True)
+
+
+def load_feature_cache_manifest(params, problem, mode, label_encoder=None):
+    """Find the cache that matches the label encoder. Caches are only
+    reused for the labels the reader fits, so without a label encoder
+    in checkpoint dir the cache is missed, and the reader is called
+    to fit one, see create_problem_generator.
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+        mode {str} -- mode
+
+    Keyword Arguments:
+        label_encoder {LabelEncoder} -- label encoder of problem, loaded
+            from checkpoint dir if not given (default: {None})
+
+    Raises:
+        ValueError -- the cache of the label encoder holds other labels
+
+    Returns:
+        tuple -- (cache path, manifest, label encoder) or (None, None, None)
+    """
+    if not use_feature_cache(params, mode):
+        return None, None, None
+    if label_encoder is None:
+        le_path = os.path.join(
+            params.ckpt_dir, '%s_label_encoder.pkl' % problem)
+        if not os.path.exists(le_path):
+            return None, None, None
+        label_encoder = get_or_make_label_encoder(params, problem, mode)
+
+    labels = get_label_encoder_labels(label_encoder)
+    cache_path = os.path.join(
+        get_cache_path(params, problem, mode), labels_md5(labels)[:12])
+    manifest_path = os.path.join(cache_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None, None, None
+    with open(manifest_path, 'r', encoding='utf8') as f:
+        manifest = json.load(f)
+    if manifest['labels'] != labels:
+        raise ValueError(
+            'Feature cache %s of %s is written with other labels than its '
+            'label encoder, please remove it: %s, %s' % (
+                cache_path, problem, manifest['labels'], labels))
+    return cache_path, manifest, label_encoder
+
+
+def get_record_offsets(path):
+    """Byte offsets of records of a tfrecord file, read from record
+    headers only. Memorized by path, size and mtime.
+
+    Arguments:
+        path {str} -- tfrecord file path
+
+    Returns:
+        array -- byte offsets
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if memo_key not in _RECORD_OFFSETS:
+        offsets = array('q')
+        offset = 0
+        with open(path, 'rb') as f:
+            while offset < stat.st_size:
+                offsets.append(offset)
+                f.seek(offset)
+                length, = struct.unpack('<Q', f.read(8))
+                # length, crc of length, data, crc of data
+                offset += 8 + 4 + length + 4
+        _RECORD_OFFSETS[memo_key] = offsets
+    return _RECORD_OFFSETS[memo_key]
+
+
+def _iter_shuffled_records(shard_paths, shuffle_seed, start=0):
+    # gather records of memory mapped shards in a random permutation
+    shard_offsets = [get_record_offsets(path) for path in shard_paths]
+    shard_starts = np.cumsum([0] + [len(offsets)
+                                    for offsets in shard_offsets])
+    permutation = np.random.RandomState(
+        shuffle_seed).permutation(shard_starts[-1])[start:]
+
+    files = [open(path, 'rb') for path in shard_paths]
+    try:
+        shards = [mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                  if os.fstat(f.fileno()).st_size else b'' for f in files]
+        for ind in permutation:
+            shard_ind = int(np.searchsorted(shard_starts, ind, side='right')) - 1
+            offset = shard_offsets[shard_ind][ind - shard_starts[shard_ind]]
+            shard = shards[shard_ind]
+            length, = struct.unpack('<Q', shard[offset:offset + 8])
+            yield shard[offset + 12:offset + 12 + length]
+    finally:
+        for f in files:
+            f.close()
+
+
+def read_feature_cache(params, problem, mode, shuffle_seed=None, start=0,
+                       label_encoder=None):
+    """Read featurized examples from cache
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+        mode {str} -- mode
+
+    Keyword Arguments:
+        shuffle_seed {int} -- if given, examples are read in a random
+            permutation of this seed, gathered from memory mapped
+            shards (default: {None})
+        start {int} -- number of examples to skip (default: {0})
+        label_encoder {LabelEncoder} -- see load_feature_cache_manifest
+            (default: {None})
+
+    Returns:
+        tuple -- (generator of unpadded features, label encoder,
+            number of examples), (None, None, None) if cache miss
+    """
+    cache_path, manifest, label_encoder = load_feature_cache_manifest(
+        params, problem, mode, label_encoder)
+    if cache_path is None:
+        return None, None, None
+
+    shard_paths = [os.path.join(cache_path, shard)
+                   for shard in manifest['shards']]
+
+    def gen():
+        scalar_keys = set(manifest['scalar_keys'])
+        if shuffle_seed is None:
+            records = itertools.islice(
+                (serialized for path in shard_paths
+                 for serialized in tf.python_io.tf_record_iterator(path)),
+                start, None)
+        else:
+            records = _iter_shuffled_records(shard_paths, shuffle_seed, start)
+        for serialized in records:
+            yield _from_example(serialized, scalar_keys)
+    return gen(), label_encoder, max(0, manifest['num_examples'] - start)
+
+
+def get_data_info_key(params, problem):
+    """Key of problem in data info index, made of checksums of its
+    train data files and max_seq_len. None if data files of problem
+    are unknown.
+    """
+    data_key = get_data_files_key(params, problem)
+    if data_key is None:
+        return None
+    return '%s_%d_%s' % (problem, params.max_seq_len, data_key[:12])
+
+
+def _load_data_info_index(params):
+    index_path = os.path.join(params.cache_dir, DATA_INFO_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def read_data_info_index(params, problem):
+    """Read number of train examples of problem from data info index
+    and restore its label encoder.
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+
+    Returns:
+        tuple -- (number of train examples, whether it is the number of
+            featurized examples), (None, None) if not found
+    """
+    key = get_data_info_key(params, problem)
+    if key is None:
+        return None, None
+    index = _load_data_info_index(params)
+    if key not in index:
+        return None, None
+    data_info = index[key]
+    if data_info['label_encoder'] is not None:
+        label_encoder = restore_label_encoder(
+            params, data_info['label_encoder'], data_info['labels'])
+        if label_encoder is None:
+            return None, None
+    return data_info['data_num'], data_info.get('featurized', False)
+
+
+def write_data_info_index(params, problem, data_num, label_encoder=None,
+                          featurized=False):
+    """Write number of train examples and label encoder of problem
+    to data info index.
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+        data_num {int} -- number of train examples
+
+    Keyword Arguments:
+        label_encoder {LabelEncoder} -- label encoder of problem (default: {None})
+        featurized {bool} -- whether data_num is the number of featurized
+            examples, raw examples otherwise (default: {False})
+    """
+    key = get_data_info_key(params, problem)
+    if key is None:
+        return
+    create_path(params.cache_dir)
+    index = _load_data_info_index(params)
+    index[key] = {
+        'data_num': data_num,
+        'featurized': featurized,
+        'label_encoder': None if label_encoder is None else label_encoder.name,
+        'labels': None if label_encoder is None else get_label_encoder_labels(label_encoder)
+    }
+    index_path = os.path.join(params.cache_dir, DATA_INFO_INDEX_NAME)
+    tmp_path = '%s.tmp-%d' % (index_path, os.getpid())
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+
+
+def read_feature_cache_dataset(params, problem, mode, shuffle_shards=False):
+    """Read featurized examples from cache as tf dataset. Shards are
+    read in parallel and examples are decoded with parallel calls.
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+        mode {str} -- mode
+
+    Keyword Arguments:
+        shuffle_shards {bool} -- shuffle the order of shards, otherwise
+            examples are read in the order they are written (default: {False})
+
+    Returns:
+        tuple -- (dataset of unpadded int32 features, label encoder,
+            number of examples), (None, None, None) if cache miss
+    """
+    cache_path, manifest, label_encoder = load_feature_cache_manifest(
+        params, problem, mode)
+    if cache_path is None:
+        return None, None, None
+
+    label_key = '%s_label_ids' % problem
+    feature_spec = {
+        'input_ids': tf.VarLenFeature(tf.int64),
+        'segment_ids': tf.VarLenFeature(tf.int64)
+    }
+    if params.problem_type[problem] == 'cls':
+        feature_spec[label_key] = tf.FixedLenFeature([], tf.int64)
+    else:
+        feature_spec[label_key] = tf.VarLenFeature(tf.int64)
+
+    def parse_fn(serialized):
+        example = tf.parse_single_example(serialized, feature_spec)
+        features = {}
+        for k, v in example.items():
+            if isinstance(v, tf.SparseTensor):
+                v = tf.sparse_tensor_to_dense(v)
+            features[k] = tf.cast(v, tf.int32)
+        return features
+
+    shard_paths = [os.path.join(cache_path, shard)
+                   for shard in manifest['shards']]
+    dataset = tf.data.Dataset.from_tensor_slices(
+        tf.constant(shard_paths, dtype=tf.string))
+    if shuffle_shards:
+        dataset = dataset.shuffle(len(shard_paths))
+    dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=max(1, min(len(shard_paths), params.num_input_readers)),
+        sloppy=shuffle_shards))
+    dataset = dataset.map(
+        parse_fn, num_parallel_calls=tf.contrib.data.AUTOTUNE)
+    return dataset, label_encoder, manifest['num_examples']
@@ -1,19 +1,430 @@
+import time
 
 from tqdm import tqdm
 import numpy as np
 
 import tensorflow as tf
 
-from .tokenization import FullTokenizer
+from .tokenization import get_tokenizer
 
 from .params import Params
 from .utils import (tokenize_text_with_seqs, truncate_seq_pair,
                     add_special_tokens_with_seqs, create_mask_and_padding,
-                    TRAIN, EVAL, PREDICT)
-from .create_generators import create_generator
+                    BOS_TOKEN, TRAIN, EVAL, PREDICT,
+                    get_label_pad_id)
+from .create_generators import (create_generator, create_packed_generator,
+                                MultitaskSampler)
+from .feature_cache import read_feature_cache_dataset
+from .input_stats_hook import INPUT_STATS, add_input_stats
+from .input_state import InputState, add_input_state
+
+
+def get_token_budget(config: Params, mode='train'):
+    '''Max number of tokens(padded tokens counted) per batch, None if
+    batching by number of examples. Like batch size, budget of eval and
+    predict is doubled.
+    '''
+    if config.max_tokens_per_batch is None:
+        return None
+    if mode == 'train':
+        return config.max_tokens_per_batch
+    return config.max_tokens_per_batch*2
+
+
+def get_bucket_batch_sizes(config: Params, batch_size, token_budget=None):
+    '''Batch size of each length bucket. With token budget, batch size of
+    a bucket is the number of its longest possible examples that
+    fit in the budget.
+    '''
+    if token_budget is None:
+        return [batch_size] * (len(config.bucket_boundaries) + 1)
+
+    # bucket i holds length in [boundaries[i-1], boundaries[i])
+    upper_bounds = list(config.bucket_boundaries) + [config.max_seq_len + 1]
+    return [max(1, token_budget // max(1, bound - 1)) for bound in upper_bounds]
+
+
+def get_packed_output_signature(config: Params, output_type, output_shapes):
+    '''Output types and shapes of packed rows, see create_packed_generator.
+    Row features keep their shapes, other features are stacked by slot.
+    '''
+    row_features = ['input_ids', 'input_mask', 'segment_ids']
+    packed_type = {
+        'position_ids': tf.int32,
+        'pack_ids': tf.int32,
+        'pack_token_positions': tf.int32,
+        'pack_input_mask': tf.int32
+    }
+    packed_shapes = {
+        'position_ids': [config.max_seq_len],
+        'pack_ids': [config.max_seq_len],
+        'pack_token_positions': [config.max_pack_num, config.max_seq_len],
+        'pack_input_mask': [config.max_pack_num, config.max_seq_len]
+    }
+    for k in output_type:
+        packed_type[k] = output_type[k]
+        if k in row_features:
+            packed_shapes[k] = output_shapes[k]
+        else:
+            packed_shapes[k] = [config.max_pack_num] + output_shapes[k]
+    return packed_type, packed_shapes
+
+
+def get_label_padding_values(config: Params):
+    '''Padding values of labels of sequence problems, that is, the id
+    of their [PAD] label. Other features are padded with 0.
+
+    Arguments:
+        config {Params} -- Params objects
+
+    Returns:
+        dict -- {'{problem}_label_ids': label pad id}
+    '''
+    padding_values = {}
+    for problem_dict in config.run_problem_list:
+        for problem, problem_type in problem_dict.items():
+            if problem_type in ['seq_tag', 'seq2seq_tag', 'seq2seq_text']:
+                padding_values['%s_label_ids' % problem] = get_label_pad_id(
+                    config, problem)
+    return padding_values
+
+
+def _pad_batch(batch, padding_values=None):
+    # pad list features to the longest in batch
+    padding_values = padding_values or {}
+    padded = {}
+    for k in batch[0]:
+        if isinstance(batch[0][k], list):
+            max_len = max(len(example[k]) for example in batch)
+            pad = [padding_values.get(k, 0)]
+            padded[k] = [example[k] + pad * (max_len - len(example[k]))
+                         for example in batch]
+        else:
+            padded[k] = [example[k] for example in batch]
+    return padded
+
+
+def token_budget_batch_generator(example_gen, token_budget):
+    '''Group consecutive unpadded examples into batches that have at most
+    token_budget tokens after padding to the longest example. The order of
+    examples is kept.
+
+    Arguments:
+        example_gen {generator} -- generator of feature dict of lists
+        token_budget {int} -- max number of tokens per batch
 
+    Yields:
+        dict -- padded batch, feature dict of list of lists
+    '''
+    batch = []
+    max_len = 0
+    for example in example_gen:
+        length = len(example['input_ids'])
+        if batch and (len(batch) + 1) * max(max_len, length) > token_budget:
+            yield _pad_batch(batch)
+            batch = []
+            max_len = 0
+        batch.append(example)
+        max_len = max(max_len, length)
+    if batch:
+        yield _pad_batch(batch)
+
+
+def task_batch_generator(example_gen, batch_size, token_budget=None,
+                         padding_values=None):
+    '''Group consecutive examples of the same problem chunk into batches,
+    so that every batch only has examples of one chunk. Used with
+    create_generator(batch_size=...), which yields runs of batch_size
+    examples of a chunk.
+
+    Arguments:
+        example_gen {generator} -- generator of feature dict
+        batch_size {int} -- max number of examples per batch
+
+    Keyword Arguments:
+        token_budget {int} -- if given, max number of tokens per batch
+            after padding to the longest example (default: {None})
+        padding_values {dict} -- padding value of features, 0 if not
+            given, see get_label_padding_values (default: {None})
+
+    Yields:
+        dict -- padded batch
+    '''
+    batch = []
+    batch_chunk = None
+    max_len = 0
+    for example in example_gen:
+        chunk = tuple(sorted(
+            k for k, v in example.items()
+            if k.endswith('_loss_multiplier') and v))
+        length = len(example['input_ids'])
+        is_full = len(batch) == batch_size or (
+            token_budget is not None and
+            (len(batch) + 1) * max(max_len, length) > token_budget)
+        if batch and (chunk != batch_chunk or is_full):
+            yield _pad_batch(batch, padding_values)
+            batch = []
+            max_len = 0
+        batch.append(example)
+        batch_chunk = chunk
+        max_len = max(max_len, length)
+    if batch:
+        yield _pad_batch(batch, padding_values)
+
+
+def create_dynamic_masking_fn(config: Params, mask_rate=1.0):
+    '''Create a tf.data map function that masks input ids of an example,
+    same as MaskedLmMasker but with tf ops, so every pass over the data
+    gets a new mask.
+
+    Arguments:
+        config {Params} -- Params objects
+
+    Keyword Arguments:
+        mask_rate {float} -- rate of examples to mask, masked lm features
+            of the others are zeros (default: {1.0})
+
+    Returns:
+        function -- map function of feature dict
+    '''
+    vocab = get_tokenizer(config.vocab_file, cache_dir=config.cache_dir).vocab
+    vocab_size = len(vocab)
+    mask_id = vocab['[MASK]']
+    cls_id = vocab['[CLS]']
+    sep_id = vocab['[SEP]']
+    max_predictions_per_seq = config.max_predictions_per_seq
+
+    def mask_fn(features):
+        input_ids = features['input_ids']
+        seq_len = tf.shape(input_ids)[0]
+        length = tf.reduce_sum(features['input_mask'])
+        is_cand = tf.logical_and(
+            tf.cast(features['input_mask'], tf.bool),
+            tf.logical_and(tf.not_equal(input_ids, cls_id),
+                           tf.not_equal(input_ids, sep_id)))
+
+        num_to_predict = tf.cast(tf.round(
+            tf.cast(length, tf.float32) * config.masked_lm_prob), tf.int32)
+        num_to_predict = tf.minimum(
+            tf.maximum(1, num_to_predict), max_predictions_per_seq)
+        num_to_predict = tf.minimum(
+            num_to_predict, tf.reduce_sum(tf.cast(is_cand, tf.int32)))
+
+        # candidates with the lowest random scores are masked
+        scores = tf.where(
+            is_cand, tf.random_uniform([seq_len]), tf.fill([seq_len], 2.0))
+        num_cols = tf.minimum(seq_len, max_predictions_per_seq)
+        _, top_positions = tf.nn.top_k(-scores, k=num_cols)
+        is_selected = tf.range(num_cols) < num_to_predict
+        # sort positions ascendingly, unselected ones are moved to the end
+        positions, _ = tf.nn.top_k(
+            -tf.where(is_selected, top_positions,
+                      tf.fill([num_cols], seq_len)), k=num_cols)
+        positions = -positions
+        is_selected = positions < seq_len
+        positions = tf.where(is_selected, positions, tf.zeros_like(positions))
+
+        label_ids = tf.gather(input_ids, positions)
+        dice = tf.random_uniform([num_cols])
+        random_ids = tf.random_uniform(
+            [num_cols], maxval=vocab_size, dtype=tf.int32)
+        replace_ids = tf.where(
+            dice < 0.8, tf.fill([num_cols], mask_id),
+            tf.where(dice < 0.9, label_ids, random_ids))
+
+        do_mask = tf.random_uniform([]) < mask_rate
+        is_selected = tf.logical_and(is_selected, do_mask)
+        selected = tf.cast(is_selected, tf.int32)
+        # positions are unique, so the one hot deltas do not overlap
+        delta = tf.reduce_sum(
+            tf.one_hot(positions, seq_len, dtype=tf.int32) *
+            tf.expand_dims((replace_ids - label_ids) * selected, 1), axis=0)
+
+        pad = [[0, max_predictions_per_seq - num_cols]]
+        features = dict(features)
+        features['input_ids'] = input_ids + delta
+        features['masked_lm_positions'] = tf.pad(positions * selected, pad)
+        features['masked_lm_ids'] = tf.pad(label_ids * selected, pad)
+        features['masked_lm_weights'] = tf.pad(
+            tf.cast(selected, tf.float32), pad)
+        for k in ['masked_lm_positions', 'masked_lm_ids', 'masked_lm_weights']:
+            features[k].set_shape([max_predictions_per_seq])
+        return features
+
+    return mask_fn
+
+
+def create_problem_dataset(config: Params, problem, mode, shuffle_shards=False,
+                           input_context=None):
+    '''Dataset of padded examples of a single problem read from feature
+    cache, same as finalize_single_problem_features but with tf ops.
+    If the cache does not exist, it is written by a pass over the data.
 
-def train_eval_input_fn(config: Params, mode='train', epoch=None):
+    Arguments:
+        config {Params} -- Params objects
+        problem {str} -- problem name
+        mode {str} -- ModeKeys
+
+    Keyword Arguments:
+        shuffle_shards {bool} -- see read_feature_cache_dataset (default: {False})
+        input_context {InputContext} -- if given, only examples of this
+            input pipeline are read (default: {None})
+
+    Returns:
+        tuple -- (dataset of feature dict, number of examples)
+    '''
+    if input_context is not None:
+        config = input_context.apply(config)
+    dataset, label_encoder, num_examples = read_feature_cache_dataset(
+        config, problem, mode, shuffle_shards)
+    if dataset is None:
+        # the reader fits the label encoder, the cache of its labels
+        # is written by a full pass if it does not exist
+        problem_gen = config.read_data_fn[problem](config, mode)
+        dataset, label_encoder, num_examples = read_feature_cache_dataset(
+            config, problem, mode, shuffle_shards)
+        if dataset is None:
+            for _ in problem_gen:
+                pass
+            dataset, label_encoder, num_examples = read_feature_cache_dataset(
+                config, problem, mode, shuffle_shards)
+    if dataset is None:
+        raise ValueError(
+            'Feature cache of %s is not written, please make sure '
+            'feature_cache is enabled.' % problem)
+
+    problem_type = config.problem_type[problem]
+    label_key = '%s_label_ids' % problem
+    # labels are padded with [PAD], which is not always 0
+    label_pad_id = int(label_encoder.transform([BOS_TOKEN])[0])
+
+    def finalize_fn(features):
+        input_ids = features['input_ids']
+        if config.dynamic_padding:
+            pad = [[0, 0]]
+        else:
+            pad = [[0, config.max_seq_len - tf.shape(input_ids)[0]]]
+        return_dict = {
+            'input_ids': tf.pad(input_ids, pad),
+            'input_mask': tf.pad(tf.ones_like(input_ids), pad),
+            'segment_ids': tf.pad(features['segment_ids'], pad)
+        }
+        label_ids = features[label_key]
+        if problem_type == 'seq_tag':
+            label_ids = tf.pad(label_ids, pad, constant_values=label_pad_id)
+        elif problem_type in ['seq2seq_tag', 'seq2seq_text']:
+            label_pad = [
+                [0, config.decode_max_seq_len - tf.shape(label_ids)[0]]]
+            return_dict['%s_mask' % problem] = tf.pad(
+                tf.ones_like(label_ids), label_pad)
+            label_ids = tf.pad(
+                label_ids, label_pad, constant_values=label_pad_id)
+        return_dict[label_key] = label_ids
+        return return_dict
+
+    return dataset.map(
+        finalize_fn, num_parallel_calls=tf.contrib.data.AUTOTUNE), num_examples
+
+
+def create_native_dataset(config: Params, mode='train', input_context=None):
+    '''Dataset of multitask examples read from feature cache with
+    tf.data, the counterpart of create_generator. Problem chunks are
+    sampled with sample_from_datasets by the same probabilities as
+    MultitaskSampler while training, and read one after another
+    otherwise. Problems of a chunk are zipped, so their caches should
+    hold the same examples in the same order.
+
+    Arguments:
+        config {Params} -- Params objects
+
+    Keyword Arguments:
+        mode {str} -- ModeKeys (default: {'train'})
+        input_context {InputContext} -- if given, only examples of this
+            input pipeline are read (default: {None})
+
+    Returns:
+        tf Dataset -- dataset of feature dict
+    '''
+    problem_chunk = [list(problem_dict.keys())
+                     for problem_dict in config.run_problem_list]
+    problem_list = [problem for chunk in problem_chunk for problem in chunk]
+
+    def _merge_features(*features_tuple):
+        features = dict(features_tuple[0])
+        for problem_features in features_tuple[1:]:
+            for k, v in problem_features.items():
+                if k not in features:
+                    features[k] = v
+        return features
+
+    def _create_multitask_fn(chunk):
+        def multitask_fn(features):
+            features = dict(features)
+            for problem in problem_list:
+                problem_type = config.problem_type[problem]
+                features['%s_loss_multiplier' % problem] = tf.constant(
+                    int(problem in chunk), dtype=tf.int32)
+                # dummy labels, see create_generator
+                label_key = '%s_label_ids' % problem
+                if label_key in features or problem_type == 'pretrain':
+                    continue
+                if problem_type == 'cls':
+                    features[label_key] = tf.constant(0, dtype=tf.int32)
+                else:
+                    features[label_key] = tf.zeros([0], dtype=tf.int32)
+                if problem_type in ['seq2seq_tag', 'seq2seq_text']:
+                    features['%s_mask' % problem] = tf.zeros(
+                        [0], dtype=tf.int32)
+            if config.augument_mask_lm and mode != 'train':
+                for k, dtype in [('masked_lm_positions', tf.int32),
+                                 ('masked_lm_ids', tf.int32),
+                                 ('masked_lm_weights', tf.float32)]:
+                    features[k] = tf.zeros(
+                        [config.max_predictions_per_seq], dtype=dtype)
+            return features
+        return multitask_fn
+
+    chunk_datasets = []
+    for chunk in problem_chunk:
+        # shards of chained problems are read in the same order
+        shuffle_shards = mode == 'train' and len(chunk) == 1
+        datasets, num_examples = zip(*[create_problem_dataset(
+            config, problem, mode, shuffle_shards, input_context)
+            for problem in chunk])
+        # zip stops at the shortest cache and pairs examples by position,
+        # broken examples dropped by only some problems misalign them
+        if len(set(num_examples)) > 1:
+            raise ValueError(
+                'Feature caches of chained problems have different '
+                'number of examples: %s' % dict(zip(chunk, num_examples)))
+        if len(datasets) == 1:
+            dataset = datasets[0]
+        else:
+            dataset = tf.data.Dataset.zip(tuple(datasets)).map(
+                _merge_features)
+        dataset = dataset.map(
+            _create_multitask_fn(chunk),
+            num_parallel_calls=tf.contrib.data.AUTOTUNE)
+        chunk_datasets.append(dataset)
+
+    if mode != 'train':
+        dataset = chunk_datasets[0]
+        for chunk_dataset in chunk_datasets[1:]:
+            dataset = dataset.concatenate(chunk_dataset)
+        return dataset
+
+    chunk_datasets = [dataset.repeat() for dataset in chunk_datasets]
+    if len(chunk_datasets) == 1:
+        return chunk_datasets[0]
+    sampler = MultitaskSampler(
+        [config.data_num_dict[chunk[0]] for chunk in problem_chunk],
+        config.multitask_balance_type,
+        config.multitask_sampling_temperature)
+    return tf.contrib.data.sample_from_datasets(
+        chunk_datasets, weights=sampler.sample_prob.tolist())
+
+
+def train_eval_input_fn(config: Params, mode='train', epoch=None, input_context=None):
     '''Train and eval input function of estimator.
     This function will create as tf dataset from generator. 
     Training data and eval data will be processed based on processing
@@ -25,10 +436,25 @@ def train_eval_input_fn(config: Params, mode='train', epoch=None):
     Keyword Arguments:
         mode {str} -- ModeKeys (default: {'train'})
         epoch {int} -- Number of epochs to train (default: {None})
+        input_context {InputContext} -- if given, only examples of this
+            input pipeline are read (default: {None})
 
     Returns:
         tf Dataset -- Tensorflow dataset
     '''
+    if mode == 'train':
+        batch_size = config.batch_size
+    else:
+        batch_size = config.batch_size*2
+    token_budget = get_token_budget(config, mode)
+    if token_budget is not None and not config.dynamic_padding:
+        # every example is padded to max_seq_len
+        batch_size = max(1, token_budget // config.max_seq_len)
+    label_padding_values = get_label_padding_values(config)
+    # examples read by the model, saved with checkpoints
+    input_state = None
+    if config.resumable_input and mode == 'train':
+        input_state = InputState()
 
     def gen():
         if mode == 'train':
@@ -36,19 +462,53 @@ def train_eval_input_fn(config: Params, mode='train', epoch=None):
         else:
             epoch = 1
 
-        g = create_generator(params=config, mode=mode, epoch=epoch)
-        for example in g:
+        if config.task_homogeneous_batch:
+            g = create_generator(
+                params=config, mode=mode, epoch=epoch, batch_size=batch_size,
+                input_context=input_context, input_state=input_state)
+            g = task_batch_generator(
+                g, batch_size,
+                token_budget if config.dynamic_padding else None,
+                label_padding_values)
+        else:
+            g = create_generator(
+                params=config, mode=mode, epoch=epoch,
+                input_context=input_context, input_state=input_state)
+        if config.sequence_packing:
+            g = create_packed_generator(config, g)
+        if not config.input_stats:
+            for example in g:
+                yield example
+            return
+        while True:
+            start_time = time.time()
+            try:
+                example = next(g)
+            except StopIteration:
+                return
+            INPUT_STATS.record(example, time.time() - start_time)
             yield example
 
+    def _add_input_tracking(dataset):
+        # batches are counted when the model takes them
+        if input_state is not None:
+            dataset = add_input_state(
+                dataset, input_state, config.sequence_packing)
+        if config.input_stats and mode == 'train':
+            return add_input_stats(dataset)
+        return dataset
+
+    # with dynamic padding, length of inputs is only known at batch time
+    seq_len = None if config.dynamic_padding else config.max_seq_len
     output_type = {
         'input_ids': tf.int32,
         'input_mask': tf.int32,
         'segment_ids': tf.int32
     }
     output_shapes = {
-        'input_ids': [config.max_seq_len],
-        'input_mask': [config.max_seq_len],
-        'segment_ids': [config.max_seq_len]
+        'input_ids': [seq_len],
+        'input_mask': [seq_len],
+        'segment_ids': [seq_len]
     }
     if config.augument_mask_lm:
         output_type.update({
@@ -62,6 +522,14 @@ def train_eval_input_fn(config: Params, mode='train', epoch=None):
             "masked_lm_ids": [config.max_predictions_per_seq],
             "masked_lm_weights": [config.max_predictions_per_seq]
         })
+    # dummy labels of sequence problems are empty unless packed, see
+    # create_generator, so labels are padded at batch time
+    if config.sequence_packing:
+        label_seq_len = seq_len
+        label_decode_len = config.decode_max_seq_len
+    else:
+        label_seq_len = None
+        label_decode_len = None
     for problem_dict in config.run_problem_list:
         for problem, problem_type in problem_dict.items():
             output_type.update({'%s_loss_multiplier' % problem: tf.int32})
@@ -70,14 +538,14 @@ def train_eval_input_fn(config: Params, mode='train', epoch=None):
             if problem_type in ['seq_tag']:
                 output_type.update({'%s_label_ids' % problem: tf.int32})
                 output_shapes.update(
-                    {'%s_label_ids' % problem: [config.max_seq_len]})
+                    {'%s_label_ids' % problem: [label_seq_len]})
             elif problem_type in ['cls']:
                 output_type.update({'%s_label_ids' % problem: tf.int32})
                 output_shapes.update({'%s_label_ids' % problem: []})
             elif problem_type in ['seq2seq_tag', 'seq2seq_text']:
                 output_type.update({'%s_label_ids' % problem: tf.int32})
                 output_shapes.update(
-                    {'%s_label_ids' % problem: [config.decode_max_seq_len]})
+                    {'%s_label_ids' % problem: [label_decode_len]})
 
                 output_type.update({'%s_mask' % problem: tf.int32})
                 output_shapes.update(
@@ -98,21 +566,99 @@ def train_eval_input_fn(config: Params, mode='train', epoch=None):
                     "next_sentence_label_ids": []
                 })
 
+    if config.sequence_packing:
+        if config.dynamic_padding or config.augument_mask_lm or 'pretrain' in [
+                config.problem_type[p] for p in config.problem_list]:
+            raise ValueError(
+                'Sequence packing cannot be used with dynamic padding, '
+                'mask lm augumentation or pretrain problems.')
+        output_type, output_shapes = get_packed_output_signature(
+            config, output_type, output_shapes)
+
+    if config.task_homogeneous_batch:
+        if config.sequence_packing or config.dynamic_masking:
+            raise ValueError(
+                'Task homogeneous batch cannot be used with sequence '
+                'packing or dynamic masking.')
+        # generator yields padded batches
+        output_shapes = {k: [None] + v for k, v in output_shapes.items()}
+
     tf.logging.info(output_type)
     tf.logging.info(output_shapes)
 
-    dataset = tf.data.Dataset.from_generator(
-        gen, output_types=output_type, output_shapes=output_shapes)
-
-    if mode == 'train':
+    if config.index_shuffle and (
+            not config.feature_cache or config.punc_replace_prob > 0 or
+            config.native_input_pipeline):
+        raise ValueError(
+            'Index shuffle requires feature cache without punctuation '
+            'augumentation, and cannot be used with native input pipeline.')
+
+    if config.native_input_pipeline:
+        if config.sequence_packing or config.task_homogeneous_batch or \
+                'pretrain' in [config.problem_type[p] for p in config.problem_list]:
+            raise ValueError(
+                'Native input pipeline cannot be used with sequence packing, '
+                'task homogeneous batch or pretrain problems.')
+        if input_state is not None:
+            raise ValueError(
+                'Native input pipeline cannot be used with resumable_input.')
+        if config.augument_mask_lm and not config.dynamic_masking:
+            raise ValueError(
+                'Native input pipeline requires dynamic_masking to '
+                'augument mask lm.')
+        dataset = create_native_dataset(config, mode, input_context)
+    else:
+        dataset = tf.data.Dataset.from_generator(
+            gen, output_types=output_type, output_shapes=output_shapes)
+
+    if config.task_homogeneous_batch:
+        # whole batches are shuffled, examples of a batch are consecutive
+        # examples of its chunk. Use index_shuffle to shuffle examples
+        if mode == 'train' and not config.index_shuffle:
+            dataset = dataset.shuffle(
+                max(1, config.shuffle_buffer // batch_size))
+        return _add_input_tracking(dataset.prefetch(config.prefetch))
+
+    if config.dynamic_masking:
+        is_pretrain = 'pretrain' in [
+            config.problem_type[p] for p in config.problem_list]
+        if is_pretrain:
+            dataset = dataset.map(
+                create_dynamic_masking_fn(config),
+                num_parallel_calls=tf.contrib.data.AUTOTUNE)
+        elif config.augument_mask_lm and mode == 'train':
+            dataset = dataset.map(
+                create_dynamic_masking_fn(config, config.augument_rate),
+                num_parallel_calls=tf.contrib.data.AUTOTUNE)
+
+    # with index shuffle, examples are already shuffled globally
+    if mode == 'train' and not config.index_shuffle:
         dataset = dataset.shuffle(config.shuffle_buffer)
 
     dataset = dataset.prefetch(config.prefetch)
-    if mode == 'train':
-        dataset = dataset.batch(config.batch_size)
+
+    # labels of sequence problems are padded with the id of [PAD], same
+    # as examples padded in create_generator, since the non-crf loss
+    # is not masked
+    padding_values = {
+        k: tf.constant(label_padding_values.get(k, 0), dtype=output_type[k])
+        for k in output_type}
+    if config.dynamic_padding:
+        # group examples by length and pad each batch to its longest
+        # example.
+        dataset = dataset.apply(tf.contrib.data.bucket_by_sequence_length(
+            element_length_func=lambda features: tf.shape(
+                features['input_ids'])[0],
+            bucket_boundaries=config.bucket_boundaries,
+            bucket_batch_sizes=get_bucket_batch_sizes(
+                config, batch_size, token_budget),
+            padded_shapes=output_shapes,
+            padding_values=padding_values))
     else:
-        dataset = dataset.batch(config.batch_size*2)
-    return dataset
+        dataset = dataset.padded_batch(
+            batch_size, padded_shapes=output_shapes,
+            padding_values=padding_values)
+    return _add_input_tracking(dataset)
 
 
 def predict_input_fn(input_file_or_list, config: Params, mode=PREDICT):
@@ -136,10 +682,17 @@ def predict_input_fn(input_file_or_list, config: Params, mode=PREDICT):
     else:
         inputs = input_file_or_list
 
-    tokenizer = FullTokenizer(config.vocab_file)
+    tokenizer = get_tokenizer(config.vocab_file, cache_dir=config.cache_dir)
+    token_budget = get_token_budget(config, mode)
 
-    def gen():
-        data_dict = {}
+    # examples are padded at batch time with token budget or
+    # dynamic padding
+    if token_budget is not None or config.dynamic_padding:
+        pad_len = None
+    else:
+        pad_len = config.max_seq_len
+
+    def example_gen():
         for doc in tqdm(inputs, desc='Processing Inputs'):
             inputs_a = list(doc)
             tokens, target = tokenize_text_with_seqs(
@@ -152,27 +705,46 @@ def predict_input_fn(input_file_or_list, config: Params, mode=PREDICT):
                 tokens_a, tokens_b, target)
 
             input_mask, tokens, segment_ids, target = create_mask_and_padding(
-                tokens, segment_ids, target, config.max_seq_len)
+                tokens, segment_ids, target,
+                pad_len if pad_len is not None else len(tokens))
 
             input_ids = tokenizer.convert_tokens_to_ids(tokens)
+            data_dict = {}
             data_dict['input_ids'] = input_ids
             data_dict['input_mask'] = input_mask
             data_dict['segment_ids'] = segment_ids
             yield data_dict
+
+    def gen():
+        if token_budget is not None:
+            return token_budget_batch_generator(example_gen(), token_budget)
+        return example_gen()
+
     output_type = {
         'input_ids': tf.int32,
         'input_mask': tf.int32,
         'segment_ids': tf.int32
     }
     output_shapes = {
-        'input_ids': [config.max_seq_len],
-        'input_mask': [config.max_seq_len],
-        'segment_ids': [config.max_seq_len]
+        'input_ids': [pad_len],
+        'input_mask': [pad_len],
+        'segment_ids': [pad_len]
     }
+    if token_budget is not None:
+        # generator yields padded batches
+        output_shapes = {k: [None] + v for k, v in output_shapes.items()}
+
     # dataset = tf.data.Dataset.from_tensor_slices(data_dict)
     dataset = tf.data.Dataset.from_generator(
         gen, output_types=output_type, output_shapes=output_shapes)
-    dataset = dataset.batch(config.batch_size*2)
+    if token_budget is not None:
+        return dataset
+    if config.dynamic_padding:
+        # keep the order of inputs, so no bucketing here
+        dataset = dataset.padded_batch(
+            config.batch_size*2, padded_shapes=output_shapes)
+    else:
+        dataset = dataset.batch(config.batch_size*2)
 
     return dataset
 
@@ -198,7 +770,8 @@ def to_serving_input(input_file_or_list, config: Params, mode=PREDICT, tokenizer
         inputs = input_file_or_list
 
     if tokenizer is None:
-        tokenizer = FullTokenizer(config.vocab_file)
+        tokenizer = get_tokenizer(
+            config.vocab_file, cache_dir=config.cache_dir)
 
     data_dict = {}
     for doc in tqdm(inputs, desc='Processing Inputs'):
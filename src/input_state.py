@@ -0,0 +1,234 @@
+import os
+import re
+import glob
+import json
+import threading
+import collections
+
+import tensorflow as tf
+
+INPUT_STATE_PREFIX = 'input_state'
+# input states of train input pipelines of the graph, see add_input_state
+INPUT_STATE_COLLECTION = 'input_states'
+
+
+class InputState():
+    """Position of a train input pipeline after the examples the model
+    has read: epoch of every problem, number of examples read in that
+    epoch, multitask sampler state and the chunk of the current run of
+    examples, see create_generator.
+
+    create_generator records its position after every example it yields,
+    and the input pipeline counts the examples of every batch taken by
+    the model, see add_input_state. The position saved with a checkpoint
+    is the one after as many yielded examples as the model has read, so
+    examples still in shuffle and prefetch buffers are read again on
+    resume. Without shuffle buffer(e.g. with index_shuffle) this is
+    exact. With it, the examples read are a random subset of the ones
+    yielded, so some buffered examples are read twice and as many are
+    skipped.
+
+    Positions are recorded as deltas of the problems of the sampled
+    chunk, kept until their example is read. All methods are called
+    from different threads and take the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.static_state = None
+        self.position = None
+        # position deltas of yielded examples not read yet
+        self.pending = collections.deque()
+
+    @staticmethod
+    def create_position(problem_epoch, problem_offset, sampler_state,
+                        chunk_ind, run_left):
+        """Position of create_generator
+
+        Arguments:
+            problem_epoch {dict} -- epoch of every problem
+            problem_offset {dict} -- examples read in the epoch of every
+                problem, see ProblemGenerator.position
+            sampler_state {dict} -- see MultitaskSampler.get_state, None
+                if single chunk
+            chunk_ind {int} -- chunk of the current run
+            run_left {int} -- examples left in the current run
+
+        Returns:
+            dict -- position
+        """
+        return {
+            'problem_epoch': dict(problem_epoch),
+            'problem_offset': dict(problem_offset),
+            'sampler_state': sampler_state,
+            'chunk_ind': chunk_ind,
+            'run_left': run_left
+        }
+
+    @staticmethod
+    def create_position_delta(problem_positions, sampler_state,
+                              chunk_ind, run_left):
+        """Change of position by an example, see create_position
+
+        Arguments:
+            problem_positions {list} -- (problem, epoch, offset) of the
+                problems of the example
+        """
+        return (tuple(problem_positions), sampler_state, chunk_ind, run_left)
+
+    def start(self, static_state, position):
+        """Start from position, nothing is yielded or read yet
+
+        Arguments:
+            static_state {dict} -- state that does not change while
+                training, e.g. shuffle base seed
+            position {dict} -- see create_position
+        """
+        with self.lock:
+            self.static_state = dict(static_state)
+            self.position = position
+            self.pending.clear()
+
+    def produce(self, position_delta):
+        """Record position after an example yielded by the generator
+
+        Arguments:
+            position_delta {tuple} -- see create_position_delta
+        """
+        with self.lock:
+            self.pending.append(position_delta)
+
+    def consume(self, num_examples):
+        """Move position forward by examples read by the model
+
+        Arguments:
+            num_examples {int} -- number of examples read
+        """
+        with self.lock:
+            for _ in range(min(num_examples, len(self.pending))):
+                problem_positions, sampler_state, chunk_ind, run_left = \
+                    self.pending.popleft()
+                for problem, epoch, offset in problem_positions:
+                    self.position['problem_epoch'][problem] = epoch
+                    self.position['problem_offset'][problem] = offset
+                self.position['sampler_state'] = sampler_state
+                self.position['chunk_ind'] = chunk_ind
+                self.position['run_left'] = run_left
+
+    def snapshot(self):
+        """Json serializable copy of state, None if not started"""
+        with self.lock:
+            if self.position is None:
+                return None
+            state = dict(self.static_state)
+            state.update({
+                'problem_epoch': dict(self.position['problem_epoch']),
+                'problem_offset': dict(self.position['problem_offset']),
+                'sampler_state': self.position['sampler_state'],
+                'chunk_ind': self.position['chunk_ind'],
+                'run_left': self.position['run_left']
+            })
+            return state
+
+
+def add_input_state(dataset, input_state, sequence_packing=False):
+    """Count the examples of every batch taken from dataset, see
+    InputState. Batches are counted when the model takes them, so no
+    buffer should follow in the pipeline.
+
+    Arguments:
+        dataset {tf Dataset} -- batched dataset
+        input_state {InputState} -- input state of the generator of dataset
+
+    Keyword Arguments:
+        sequence_packing {bool} -- whether batches hold packed rows, see
+            create_packed_generator (default: {False})
+
+    Returns:
+        tf Dataset -- dataset
+    """
+    def _consume(num_examples):
+        input_state.consume(int(num_examples))
+        return num_examples
+
+    def consume_fn(features):
+        if sequence_packing:
+            # every example has tokens, empty slots do not
+            num_examples = tf.reduce_sum(tf.cast(tf.reduce_any(
+                tf.cast(features['pack_input_mask'], tf.bool), axis=-1),
+                tf.int64))
+        else:
+            num_examples = tf.cast(
+                tf.shape(features['input_ids'])[0], tf.int64)
+        num_consumed = tf.py_func(
+            _consume, [num_examples], tf.int64, stateful=True)
+        with tf.control_dependencies([num_consumed]):
+            return {k: tf.identity(v) for k, v in features.items()}
+
+    tf.add_to_collection(INPUT_STATE_COLLECTION, input_state)
+    return dataset.map(consume_fn)
+
+
+def get_input_state_path(model_dir, global_step):
+    return os.path.join(
+        model_dir, '%s-%d.json' % (INPUT_STATE_PREFIX, global_step))
+
+
+def load_input_state(model_dir):
+    """Load input state saved with the latest checkpoint of model_dir
+
+    Arguments:
+        model_dir {str} -- checkpoint dir
+
+    Returns:
+        dict -- see InputState.snapshot, None if not found
+    """
+    latest_checkpoint = tf.train.latest_checkpoint(model_dir)
+    if latest_checkpoint is None:
+        return None
+    global_step = int(latest_checkpoint.rsplit('-', 1)[-1])
+    state_path = get_input_state_path(model_dir, global_step)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r', encoding='utf8') as f:
+        tf.logging.info('Resume input from %s' % state_path)
+        return json.load(f)
+
+
+class InputStateSaverListener(tf.train.CheckpointSaverListener):
+    """Save input state of the train input pipeline of the graph with
+    every checkpoint, and remove the ones whose checkpoints are removed.
+    """
+
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+
+    def after_save(self, session, global_step_value):
+        input_states = session.graph.get_collection(INPUT_STATE_COLLECTION)
+        if not input_states:
+            return
+        if len(input_states) > 1:
+            raise ValueError(
+                'resumable_input supports one train input pipeline per '
+                'graph, got %d' % len(input_states))
+        state = input_states[0].snapshot()
+        if state is None:
+            return
+        state_path = get_input_state_path(self.model_dir, global_step_value)
+        tmp_path = '%s.tmp-%d' % (state_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+        ckpt_state = tf.train.get_checkpoint_state(self.model_dir)
+        if ckpt_state is None:
+            return
+        kept_steps = set(
+            int(path.rsplit('-', 1)[-1])
+            for path in ckpt_state.all_model_checkpoint_paths)
+        pattern = re.compile(r'%s-(\d+)\.json$' % INPUT_STATE_PREFIX)
+        for path in glob.glob(os.path.join(
+                self.model_dir, '%s-*.json' % INPUT_STATE_PREFIX)):
+            match = pattern.search(path)
+            if match and int(match.group(1)) not in kept_steps:
+                os.remove(path)
@@ -0,0 +1,182 @@
+import threading
+import collections
+
+import tensorflow as tf
+
+# collection of serialized summary of tf.data stats aggregator
+INPUT_STATS_SUMMARY_COLLECTION = 'input_stats_summary'
+
+
+class InputStats():
+    """Counters of examples produced by the input generator, updated
+    by train_eval_input_fn and read by InputStatsHook.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.num_elements = 0
+            self.problem_examples = collections.Counter()
+            self.produce_time = 0.0
+
+    def record(self, example, produce_time):
+        """Record an element yielded by the generator
+
+        Arguments:
+            example {dict} -- feature dict, an example or a batch
+            produce_time {float} -- seconds spent producing it
+        """
+        with self.lock:
+            self.num_elements += 1
+            self.produce_time += produce_time
+            for k, v in example.items():
+                if not k.endswith('_loss_multiplier'):
+                    continue
+                # batches and packed rows have lists of loss multipliers
+                num_examples = sum(v) if isinstance(v, list) else v
+                if num_examples:
+                    self.problem_examples[
+                        k[:-len('_loss_multiplier')]] += num_examples
+
+    def snapshot(self):
+        with self.lock:
+            return (self.num_elements, dict(self.problem_examples),
+                    self.produce_time)
+
+
+INPUT_STATS = InputStats()
+
+
+def add_input_stats(dataset):
+    """Record latency of getting elements of dataset, which is the time
+    the model is blocked on IteratorGetNext, see InputStatsHook.
+
+    Arguments:
+        dataset {tf Dataset} -- final dataset of input_fn
+
+    Returns:
+        tf Dataset -- dataset
+    """
+    aggregator = tf.contrib.data.StatsAggregator()
+    dataset = dataset.apply(
+        tf.contrib.data.latency_stats('input/get_next_latency'))
+    dataset = dataset.apply(
+        tf.contrib.data.set_stats_aggregator(aggregator))
+    tf.add_to_collection(
+        INPUT_STATS_SUMMARY_COLLECTION, aggregator.get_summary())
+    return dataset
+
+
+class InputStatsHook(tf.train.SessionRunHook):
+    """Write input pipeline summaries every log_every_n_steps:
+        input/get_next_latency: time blocked on IteratorGetNext
+        input/{problem}_examples_per_sec: examples produced by generator
+        input/generator_time_per_element: seconds to produce an element
+        input/shuffle_buffer_fill, input/prefetch_depth: number of batches
+            in shuffle buffer and prefetch buffer, estimated by elements
+            produced by generator minus elements consumed by the model
+
+    Generator counters are not available with native_input_pipeline.
+    Buffer estimates are skipped if the number of examples per batch
+    is variable, that is, with max_tokens_per_batch and dynamic_padding.
+    """
+
+    def __init__(self, params, num_replicas=1):
+        tf.logging.info("Create InputStatsHook.")
+
+        self.params = params
+        self.num_replicas = num_replicas
+        self.timer = tf.train.SecondOrStepTimer(
+            every_steps=params.log_every_n_steps)
+        INPUT_STATS.reset()
+
+    def begin(self):
+        self.global_step = tf.train.get_global_step()
+        summaries = tf.get_collection(INPUT_STATS_SUMMARY_COLLECTION)
+        self.stats_summary = summaries[-1] if summaries else None
+        self.writer = tf.summary.FileWriterCache.get(self.params.ckpt_dir)
+        self.iter_count = 0
+        self.last_snapshot = None
+
+    def _elements_per_batch(self):
+        # number of generator elements in a train batch, None if variable
+        if self.params.task_homogeneous_batch:
+            # generator yields batches
+            return 1
+        if self.params.max_tokens_per_batch is None:
+            return self.params.batch_size
+        if self.params.dynamic_padding:
+            # batch size depends on length bucket
+            return None
+        # every example is padded to max_seq_len
+        return max(
+            1, self.params.max_tokens_per_batch // self.params.max_seq_len)
+
+    def before_run(self, run_context):
+        self.should_trigger = self.timer.should_trigger_for_step(
+            self.iter_count)
+        fetches = {'global_step': self.global_step}
+        if self.should_trigger and self.stats_summary is not None:
+            fetches['stats_summary'] = self.stats_summary
+        return tf.train.SessionRunArgs(fetches)
+
+    def after_run(self, run_context, run_values):
+        self.iter_count += 1
+        if not self.should_trigger:
+            return
+        global_step = run_values.results['global_step']
+        elapsed_time, _ = self.timer.update_last_triggered_step(
+            self.iter_count - 1)
+
+        if 'stats_summary' in run_values.results:
+            self.writer.add_summary(
+                run_values.results['stats_summary'], global_step)
+
+        snapshot = INPUT_STATS.snapshot()
+        num_elements, problem_examples, produce_time = snapshot
+        values = []
+        if self.last_snapshot is not None and elapsed_time:
+            last_num_elements, last_problem_examples, last_produce_time = \
+                self.last_snapshot
+            for problem, num_examples in problem_examples.items():
+                values.append(tf.Summary.Value(
+                    tag='input/%s_examples_per_sec' % problem,
+                    simple_value=(num_examples - last_problem_examples.get(
+                        problem, 0)) / elapsed_time))
+            if num_elements > last_num_elements:
+                values.append(tf.Summary.Value(
+                    tag='input/generator_time_per_element',
+                    simple_value=(produce_time - last_produce_time) /
+                    (num_elements - last_num_elements)))
+        self.last_snapshot = snapshot
+
+        elements_per_batch = self._elements_per_batch()
+        if num_elements and elements_per_batch is not None:
+            # buffers hold generator elements, shuffle buffer and
+            # prefetch buffer are applied before batching
+            consumed = self.iter_count * self.num_replicas * \
+                elements_per_batch
+            in_flight = max(0, num_elements - consumed)
+            if self.params.index_shuffle:
+                shuffle_buffer = 0
+            elif self.params.task_homogeneous_batch:
+                shuffle_buffer = max(
+                    1, self.params.shuffle_buffer // self.params.batch_size)
+            else:
+                shuffle_buffer = self.params.shuffle_buffer
+            values.append(tf.Summary.Value(
+                tag='input/shuffle_buffer_fill',
+                simple_value=min(in_flight, shuffle_buffer) /
+                elements_per_batch))
+            values.append(tf.Summary.Value(
+                tag='input/prefetch_depth',
+                simple_value=min(max(0, in_flight - shuffle_buffer),
+                                 self.params.prefetch) / elements_per_batch))
+        if values:
+            self.writer.add_summary(tf.Summary(value=values), global_step)
+
+    def end(self, session):
+        self.writer.flush()
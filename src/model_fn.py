@@ -5,7 +5,9 @@ from .bert import modeling
 from .bert.modeling import BertModel
 
 from .params import Params
+from .utils import get_label_pad_id
 from .optimizer import AdamWeightDecayOptimizer
+from .top_utils import gather_indexes
 from .top import (
     Seq2Seq, SequenceLabel, Classification, LabelTransferHidden, MaskLM, PreTrain, GridTransformer, TaskTransformer)
 
@@ -75,13 +77,28 @@ class BertMultiTask():
         input_mask = features["input_mask"]
         segment_ids = features["segment_ids"]
         is_training = (mode == tf.estimator.ModeKeys.TRAIN)
+        if 'pack_ids' in features:
+            # tokens only attend to tokens of the same packed example
+            pack_ids = features['pack_ids']
+            attention_mask = tf.cast(tf.logical_and(
+                tf.equal(tf.expand_dims(pack_ids, 2),
+                         tf.expand_dims(pack_ids, 1)),
+                tf.expand_dims(pack_ids > 0, 1)), tf.float32)
+            packed_kwargs = {
+                'position_ids': features['position_ids'],
+                'attention_mask': attention_mask,
+                'pooled_positions': features['pack_token_positions'][:, :, 0]
+            }
+        else:
+            packed_kwargs = {}
         model = BertModel(
             config=config.bert_config,
             is_training=is_training,
             input_ids=input_ids,
             input_mask=input_mask,
             token_type_ids=segment_ids,
-            use_one_hot_embeddings=config.use_one_hot_embeddings)
+            use_one_hot_embeddings=config.use_one_hot_embeddings,
+            **packed_kwargs)
 
         feature_dict = {}
         for logit_type in ['seq', 'pooled', 'all', 'embed', 'embed_table']:
@@ -111,6 +128,105 @@ class BertMultiTask():
 
         return feature_dict
 
+    def unpack(self, features, hidden_feature):
+        """Unpack packed rows to one example per row, so that tops
+        see the same features as without sequence packing.
+
+        Arguments:
+            features {dict} -- packed feature dict, see create_packed_generator
+            hidden_feature {dict} -- hidden feature dict extracted by bert,
+                pooled is already one per example
+
+        Returns:
+            tuple -- (features, hidden_feature) of
+                [batch_size * max_pack_num, ...]
+        """
+        token_positions = features['pack_token_positions']
+        shape = modeling.get_shape_list(token_positions, expected_rank=3)
+        num_examples = shape[0] * shape[1]
+
+        def _unpack_sequence(sequence_tensor):
+            is_2d = sequence_tensor.shape.ndims == 2
+            if is_2d:
+                sequence_tensor = tf.expand_dims(sequence_tensor, -1)
+            # [batch_size * max_pack_num * max_seq_len, width]
+            unpacked = gather_indexes(
+                sequence_tensor,
+                tf.reshape(token_positions, [shape[0], -1]))
+            unpacked = tf.reshape(
+                unpacked,
+                [num_examples, shape[2], unpacked.shape[-1].value])
+            if is_2d:
+                unpacked = tf.squeeze(unpacked, -1)
+            return unpacked
+
+        unpacked_hidden_feature = {
+            'seq': _unpack_sequence(hidden_feature['seq']),
+            'pooled': hidden_feature['pooled'],
+            'embed': _unpack_sequence(hidden_feature['embed']),
+            'embed_table': hidden_feature['embed_table'],
+            'all': tf.concat(
+                [_unpack_sequence(layer_output) for layer_output in tf.split(
+                    hidden_feature['all'],
+                    self.config.bert_config.num_hidden_layers, axis=1)],
+                axis=1)
+        }
+
+        unpacked_features = {
+            'input_ids': _unpack_sequence(features['input_ids']),
+            'segment_ids': _unpack_sequence(features['segment_ids']),
+            'input_mask': tf.reshape(
+                features['pack_input_mask'], [num_examples, shape[2]])
+        }
+        packed_only = ['input_ids', 'input_mask', 'segment_ids',
+                       'position_ids', 'pack_ids',
+                       'pack_token_positions', 'pack_input_mask']
+        for k, v in features.items():
+            if k in packed_only:
+                continue
+            v_shape = modeling.get_shape_list(v)
+            unpacked_features[k] = tf.reshape(
+                v, [num_examples] + v_shape[2:])
+        return unpacked_features, unpacked_hidden_feature
+
+    def pad_sparse_labels(self, features):
+        """Dummy labels of sequence problems are empty, so labels of a
+        problem that is absent in the whole batch have zero length.
+        Pad them to full length with the id of [PAD] label so that tops
+        see the same shapes and labels as padded in input_fn.
+
+        Arguments:
+            features {dict} -- feature dict
+
+        Returns:
+            dict -- feature dict with padded labels
+        """
+        features = dict(features)
+        if self.config.dynamic_padding:
+            seq_len = None
+        else:
+            seq_len = self.config.max_seq_len
+        for problem_dict in self.config.run_problem_list:
+            for problem, problem_type in problem_dict.items():
+                label_key = '%s_label_ids' % problem
+                if problem_type == 'seq_tag':
+                    full_len = tf.shape(features['input_ids'])[1]
+                    static_len = seq_len
+                elif problem_type in ['seq2seq_tag', 'seq2seq_text']:
+                    full_len = self.config.decode_max_seq_len
+                    static_len = full_len
+                else:
+                    continue
+                if label_key not in features:
+                    continue
+                label_ids = features[label_key]
+                label_ids = tf.pad(
+                    label_ids, [[0, 0], [0, full_len - tf.shape(label_ids)[1]]],
+                    constant_values=get_label_pad_id(self.config, problem))
+                label_ids.set_shape([None, static_len])
+                features[label_key] = label_ids
+        return features
+
     def top(self, features, hidden_feature, mode):
         """Top model. This fn will return:
         1. loss, if mode is train
@@ -129,6 +245,9 @@ class BertMultiTask():
             'seq2seq_tag': Seq2Seq,
             'seq2seq_text': Seq2Seq
         }
+        if mode != tf.estimator.ModeKeys.PREDICT:
+            features = self.pad_sparse_labels(features)
+
         if self.config.label_transfer:
             ori_hidden_feature = {
                 'ori_'+k: v for k,
@@ -169,6 +288,25 @@ class BertMultiTask():
                 if mode == tf.estimator.ModeKeys.PREDICT:
                     feature_this_round = features
                     hidden_feature_this_round = hidden_feature
+                elif self.config.task_homogeneous_batch and \
+                        mode == tf.estimator.ModeKeys.TRAIN:
+                    # the whole batch is of one problem chunk, the top
+                    # is only run for that chunk, see below
+                    feature_this_round = features
+                    hidden_feature_this_round = dict(hidden_feature)
+                elif self.config.task_homogeneous_batch:
+                    # the whole batch is of one problem chunk, so keep it
+                    # or slice it to empty
+                    loss_multiplier = features[
+                        '%s_loss_multiplier' % problem]
+                    num_records = tf.shape(loss_multiplier)[0] * \
+                        tf.reduce_max(loss_multiplier)
+                    feature_this_round = {
+                        k: v[:num_records] for k, v in features.items()}
+                    # embedding table is not batched
+                    hidden_feature_this_round = {
+                        k: v if k == 'embed_table' else v[:num_records]
+                        for k, v in hidden_feature.items()}
                 else:
                     record_ind = tf.cast(
                         features['%s_loss_multiplier' % problem], tf.bool)
@@ -191,27 +329,50 @@ class BertMultiTask():
                         'Label Transfer and grid transformer cannot be enabled in the same time.'
                     )
 
-                if self.config.grid_transformer:
-                    with tf.variable_scope(top_scope_name):
-                        grid_layer = GridTransformer(self.config)
-
-                        hidden_feature_key = 'pooled' if problem_type == 'cls' else 'seq'
-
-                        hidden_feature_this_round[hidden_feature_key] = grid_layer(
-                            feature_this_round, hidden_feature_this_round, mode, problem)
-                    self.config.hidden_dense = False
-
-                with tf.variable_scope(top_scope_name, reuse=tf.AUTO_REUSE):
-                    layer = problem_type_layer[
-                        problem_type](
-                        self.config)
-                    return_dict[scope_name] = layer(
-                        feature_this_round,
-                        hidden_feature_this_round, mode, problem)
+                if self.config.dynamic_padding and self.config.grid_transformer:
+                    raise ValueError(
+                        'Grid transformer requires inputs padded to max_seq_len, please disable dynamic padding.'
+                    )
 
-                    if mode == tf.estimator.ModeKeys.TRAIN:
-                        return_dict[scope_name] = filter_loss(
-                            return_dict[scope_name], feature_this_round, problem)
+                def _create_top(feature_this_round, hidden_feature_this_round):
+                    if self.config.grid_transformer:
+                        with tf.variable_scope(top_scope_name):
+                            grid_layer = GridTransformer(self.config)
+
+                            hidden_feature_key = 'pooled' if problem_type == 'cls' else 'seq'
+
+                            hidden_feature_this_round[hidden_feature_key] = grid_layer(
+                                feature_this_round, hidden_feature_this_round, mode, problem)
+                        self.config.hidden_dense = False
+
+                    with tf.variable_scope(top_scope_name, reuse=tf.AUTO_REUSE):
+                        layer = problem_type_layer[
+                            problem_type](
+                            self.config)
+                        top_output = layer(
+                            feature_this_round,
+                            hidden_feature_this_round, mode, problem)
+
+                        if mode == tf.estimator.ModeKeys.TRAIN:
+                            top_output = filter_loss(
+                                top_output, feature_this_round, problem)
+                    return top_output
+
+                if self.config.task_homogeneous_batch and \
+                        mode == tf.estimator.ModeKeys.TRAIN:
+                    # only the tops of the chunk of the batch are run.
+                    # Eval metrics are updated by every batch, so eval
+                    # still runs every top on a slice
+                    is_this_chunk = tf.reduce_max(
+                        features['%s_loss_multiplier' % problem]) > 0
+                    return_dict[scope_name] = tf.cond(
+                        is_this_chunk,
+                        lambda: _create_top(
+                            feature_this_round, hidden_feature_this_round),
+                        lambda: tf.constant(0.0))
+                else:
+                    return_dict[scope_name] = _create_top(
+                        feature_this_round, hidden_feature_this_round)
 
         if self.config.augument_mask_lm and mode == tf.estimator.ModeKeys.TRAIN:
             try:
@@ -394,6 +555,10 @@ class BertMultiTask():
             hidden_feature = self.body(
                 features, mode)
 
+            if 'pack_ids' in features:
+                features, hidden_feature = self.unpack(
+                    features, hidden_feature)
+
             loss_eval_pred = self.top(features, hidden_feature, mode)
 
             spec = self.create_spec(
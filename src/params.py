@@ -7,6 +7,9 @@ from .bert.modeling import BertConfig
 
 from . import data_preprocessing
 from .utils import create_path, EOS_TOKEN, get_or_make_label_encoder
+from .create_generators import create_problem_generator, ProblemGenerator
+from .feature_cache import (read_data_info_index, write_data_info_index,
+                            read_feature_cache)
 
 
 class Params():
@@ -69,10 +72,16 @@ class Params():
 
         self.multitask_balance_type = 'data_balanced'
         # self.multitask_balance_type = 'problem_balanced'
+        # self.multitask_balance_type = 'temperature_scaled'
+        # sample problems proportional to data_num ** (1 / temperature)
+        # if temperature_scaled
+        self.multitask_sampling_temperature = 2.0
 
         # logging control
         self.log_every_n_steps = 100
         self.detail_log = True
+        # if True, record input pipeline stats for InputStatsHook
+        self.input_stats = False
 
         # training
         self.init_lr = 2e-5
@@ -81,6 +90,83 @@ class Params():
         self.freeze_step = 0
         self.prefetch = 5000
 
+        # data cache
+        # if True, featurized examples will be written to cache_dir
+        # at the first pass and read from there afterwards
+        self.feature_cache = False
+        self.cache_dir = 'tmp/cache'
+        # if True, train examples of every epoch are read from feature
+        # cache in a random permutation instead of shuffled by a buffer
+        # of shuffle_buffer examples
+        self.index_shuffle = False
+        # if True, train and eval examples are read from feature cache
+        # shards with tf.data instead of python generator. Caches that
+        # do not exist are written by a first pass over the data
+        self.native_input_pipeline = False
+        # number of cache shards of a problem read in parallel
+        self.num_input_readers = 4
+        # featurize with multiple processes if > 1
+        self.num_featurize_workers = 0
+        self.featurize_chunk_size = 256
+        # seed of random augumentation while featurizing with
+        # multiple processes, output is not deterministic if None
+        self.featurize_seed = None
+        # if True, inputs of chained problems(e.g. weibo_ner&weibo_cws) are
+        # featurized once and every problem only adds its labels. The
+        # problems should read the same inputs in the same order. Not used
+        # with feature cache, since cached problems are already featurized
+        self.share_chained_inputs = False
+
+        # dynamic padding
+        # if True, examples are not padded to max_seq_len but to the
+        # longest example in batch, and are batched by length buckets
+        self.dynamic_padding = False
+        self.bucket_boundaries = [16, 32, 64, 96]
+        # if set, batch by number of tokens(padding included)
+        # instead of batch_size
+        self.max_tokens_per_batch = None
+
+        # sequence packing
+        # if True, short train and eval examples are packed into rows of
+        # max_seq_len tokens, at most max_pack_num examples per row.
+        # train_steps is still computed from the number of examples while
+        # a packed batch holds more examples, so consider fewer train_epoch
+        self.sequence_packing = False
+        self.max_pack_num = 8
+
+        # resumable input
+        # if True, position of train input is saved with checkpoints and
+        # restored when training resumes from ckpt_dir. The position is
+        # after the examples the model has read, examples in shuffle and
+        # prefetch buffers are read again. It is exact with index_shuffle.
+        # With a shuffle buffer, as many examples are read as before, but
+        # some in the buffer may be read twice and others skipped. See
+        # InputState. Positions count cached examples with feature_cache
+        # and raw examples otherwise, so feature_cache should not change
+        # between restarts. Not supported by pretrain problems
+        self.resumable_input = False
+
+        # input sharding
+        # set on a copy of params from the input context passed to
+        # create_generator, see InputContext.apply. Every input
+        # pipeline only reads and featurizes every num_input_pipelines-th
+        # example of each problem, starting from input_pipeline_id.
+        # There is one input pipeline per worker of a multi-worker cluster.
+        # MirroredStrategy in a single process(e.g. --gpu replicas in
+        # main.py) has one input pipeline feeding all replicas, so it is
+        # not sharded
+        self.num_input_pipelines = 1
+        self.input_pipeline_id = 0
+
+        # task homogeneous batch
+        # if True, problem chunk is sampled once per train and eval batch
+        # and the whole batch comes from that chunk. While training only
+        # the tops of that chunk are run, in eval tops of other problems
+        # get empty batches instead of masked ones. Batches instead of
+        # examples are shuffled by the shuffle buffer, and examples of a
+        # batch are read in order, so consider index_shuffle
+        self.task_homogeneous_batch = False
+
         # hparm
         self.dropout_keep_prob = 0.9
         self.max_seq_len = 128
@@ -128,11 +214,26 @@ class Params():
         self.mask_lm_hidden_size = 768
         self.mask_lm_hidden_act = 'gelu'
         self.mask_lm_initializer_range = 0.02
+        # if True, tokens of pretrain and mask lm augument problems are
+        # masked in tf.data instead of in generators, so that every
+        # epoch sees different masks
+        self.dynamic_masking = False
 
         self.train_problem = None
 
         # get generator function for each problem
         self.read_data_fn = {}
+        # train data files of each problem, registered with its reader
+        # by data_preprocessing.corpus.data_files. Number of examples of
+        # the problems are shared between ckpt dirs in cache_dir, keyed
+        # by checksums of these files. The count is the number of
+        # featurized examples, written when the train feature cache is
+        # written. Before that, it is the number of raw examples,
+        # broken examples included
+        self.data_file_patterns = {}
+        # data files read in eval mode, feature caches are keyed by
+        # checksums of the files of their mode
+        self.eval_data_file_patterns = {}
         for problem in self.problem_type:
             try:
                 self.read_data_fn[problem] = getattr(
@@ -140,6 +241,11 @@ class Params():
             except AttributeError:
                 raise AttributeError(
                     '%s function not implemented in data_preprocessing.py' % problem)
+            if hasattr(self.read_data_fn[problem], 'data_file_patterns'):
+                self.data_file_patterns[problem] = \
+                    self.read_data_fn[problem].data_file_patterns
+                self.eval_data_file_patterns[problem] = \
+                    self.read_data_fn[problem].eval_data_file_patterns
 
     def assign_problem(self, flag_string: str, gpu=2, base_dir=None, dir_name=None):
         """Assign the actual run problem to param. This function will
@@ -189,6 +295,7 @@ class Params():
         # training
         return [
                 'multitask_balance_type',
+                'multitask_sampling_temperature',
                 'init_lr',
                 'batch_size',
                 'train_epoch',
@@ -251,7 +358,8 @@ class Params():
         self.bert_config.num_hidden_layers = dump_dict['bert_num_hidden_layer']
 
     def get_data_info(self, problem_list, base):
-        '''Get number of data, number of classes of data and eos_id of data.
+        '''Get number of data, number of classes of data, eos_id and
+        label_pad_id of data.
 
         Arguments:
             problem_list {list} -- problem list
@@ -264,31 +372,73 @@ class Params():
             self.data_num_dict = data_info['data_num']
             self.num_classes = data_info['num_classes']
             self.eos_id = data_info['eos_id']
+            self.label_pad_id = data_info.get('label_pad_id', {})
         else:
             self.data_num_dict = {}
             self.num_classes = {}
             self.eos_id = {}
+            self.label_pad_id = {}
 
         # update data_num and train_steps
         self.data_num = 0
         for problem in problem_list:
             if problem not in self.data_num_dict:
-                self.data_num += len(
-                    list(self.read_data_fn[problem](self, 'train')))
-                self.data_num_dict[problem] = len(
-                    list(self.read_data_fn[problem](self, 'train')))
-            else:
-                self.data_num += self.data_num_dict[problem]
+                self.data_num_dict[problem] = self.count_examples(problem)
+            self.data_num += self.data_num_dict[problem]
 
         data_info = {
             'data_num': self.data_num_dict,
             'num_classes': self.num_classes,
-            'eos_id': self.eos_id
+            'eos_id': self.eos_id,
+            'label_pad_id': self.label_pad_id
         }
 
         json.dump(data_info, open(json_path, 'w', encoding='utf8'))
         return json_path
 
+    def count_examples(self, problem):
+        '''Count train examples of problem. The count is read from the
+        data info index in cache_dir if data files of the problem are
+        not changed, the label encoder of problem is restored as well.
+        Otherwise they are counted from the feature cache, or without
+        featurizing them if there is no cache, except pretrain problems.
+        Only in the last case broken examples are counted as well, see
+        ProblemGenerator. The index is updated with the number of
+        featurized examples when the cache is written.
+
+        Arguments:
+            problem {str} -- problem name
+
+        Returns:
+            int -- number of train examples
+        '''
+        data_num, featurized = read_data_info_index(self, problem)
+        if featurized:
+            return data_num
+        # a raw count is only used while there is no feature cache
+        if data_num is not None:
+            feature_gen, label_encoder, num_cached = read_feature_cache(
+                self, problem, 'train')
+            if feature_gen is None:
+                return data_num
+            write_data_info_index(
+                self, problem, num_cached, label_encoder, featurized=True)
+            return num_cached
+
+        problem_gen = create_problem_generator(self, problem, 'train')
+        if isinstance(problem_gen, ProblemGenerator):
+            data_num = len(problem_gen)
+            label_encoder = problem_gen.label_encoder
+            # raw examples are only kept if not read from feature cache
+            featurized = problem_gen.raw_examples is None
+        else:
+            data_num = len(list(problem_gen))
+            label_encoder = None
+            featurized = False
+        write_data_info_index(
+            self, problem, data_num, label_encoder, featurized)
+        return data_num
+
     def parse_problem_string(self, flag_string):
         '''Parse problem string
         Example:
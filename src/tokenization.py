@@ -18,11 +18,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import pickle
+import hashlib
+import threading
 import collections
 import unicodedata
+from array import array
 import six
 import tensorflow as tf
 
+# compiled vocabs, keyed by vocab path and stat of vocab file
+_COMPILED_VOCAB = {}
+# code points covered by the char to id table of FullTokenizer
+_CHAR_TABLE_SIZE = 0x10000
+# shared tokenizers, keyed by vocab path and do_lower_case
+_TOKENIZERS = {}
+_TOKENIZERS_LOCK = threading.Lock()
+
 
 def convert_to_unicode(text):
     """Converts `text` to Unicode (if it's not already), assuming utf-8 input."""
@@ -67,21 +80,101 @@ def printable_text(text):
         raise ValueError("Not running on Python2 or Python 3?")
 
 
-def load_vocab(vocab_file):
-    """Loads a vocabulary file into a dictionary."""
-    vocab = collections.OrderedDict()
-    index = 0
+def read_vocab_tokens(vocab_file):
+    """Reads tokens of a vocabulary file, the index of a token is its id."""
+    tokens = []
     with tf.gfile.GFile(vocab_file, "r") as reader:
         while True:
             token = convert_to_unicode(reader.readline())
             if not token:
                 break
-            token = token.strip()
-            vocab[token] = index
-            index += 1
+            tokens.append(token.strip())
+    return tokens
+
+
+def load_vocab(vocab_file):
+    """Loads a vocabulary file into a dictionary."""
+    vocab = collections.OrderedDict()
+    for index, token in enumerate(read_vocab_tokens(vocab_file)):
+        vocab[token] = index
     return vocab
 
 
+class CompiledVocab(object):
+    """Vocab of a vocab file, as token to id dict and id to token list"""
+
+    def __init__(self, id_to_token):
+        self.id_to_token = id_to_token
+        self.vocab = collections.OrderedDict(
+            (token, index) for index, token in enumerate(id_to_token))
+        self.inv_vocab = {v: k for k, v in self.vocab.items()}
+
+
+def load_compiled_vocab(vocab_file, cache_dir=None):
+    """Load vocab file as CompiledVocab, memorized by path and stat of
+    vocab file. If cache_dir is given, the token list is also pickled
+    in cache_dir/vocab, which is faster to load than the vocab file.
+
+    Arguments:
+        vocab_file {str} -- path of vocab file
+
+    Keyword Arguments:
+        cache_dir {str} -- cache dir (default: {None})
+
+    Returns:
+        CompiledVocab -- compiled vocab
+    """
+    stat = tf.gfile.Stat(vocab_file)
+    key = (os.path.abspath(vocab_file), stat.length, stat.mtime_nsec)
+    if key in _COMPILED_VOCAB:
+        return _COMPILED_VOCAB[key]
+
+    pickle_path = None
+    if cache_dir is not None:
+        pickle_path = os.path.join(cache_dir, 'vocab', '%s_%s.pkl' % (
+            os.path.basename(vocab_file),
+            hashlib.md5(repr(key).encode('utf8')).hexdigest()[:12]))
+
+    if pickle_path is not None and os.path.exists(pickle_path):
+        with open(pickle_path, 'rb') as f:
+            id_to_token = pickle.load(f)
+    else:
+        id_to_token = read_vocab_tokens(vocab_file)
+        if pickle_path is not None:
+            os.makedirs(os.path.dirname(pickle_path), exist_ok=True)
+            tmp_path = '%s.tmp-%d' % (pickle_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(id_to_token, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, pickle_path)
+
+    compiled_vocab = CompiledVocab(id_to_token)
+    _COMPILED_VOCAB[key] = compiled_vocab
+    return compiled_vocab
+
+
+def get_tokenizer(vocab_file, do_lower_case=True, cache_dir=None):
+    """Get the FullTokenizer of vocab file shared in the process, so
+    that the vocab is only loaded once by all readers and input fns.
+
+    Arguments:
+        vocab_file {str} -- path of vocab file
+
+    Keyword Arguments:
+        do_lower_case {bool} -- whether to lower case the input (default: {True})
+        cache_dir {str} -- see load_compiled_vocab (default: {None})
+
+    Returns:
+        FullTokenizer -- tokenizer, should not be modified
+    """
+    key = (os.path.abspath(vocab_file), do_lower_case)
+    with _TOKENIZERS_LOCK:
+        if key not in _TOKENIZERS:
+            _TOKENIZERS[key] = FullTokenizer(
+                vocab_file, do_lower_case=do_lower_case,
+                compiled_vocab=load_compiled_vocab(vocab_file, cache_dir))
+        return _TOKENIZERS[key]
+
+
 def convert_by_vocab(vocab, items):
     """Converts a sequence of [tokens|ids] using the vocab."""
     output = []
@@ -113,11 +206,19 @@ def whitespace_tokenize(text):
 class FullTokenizer(object):
     """Runs end-to-end tokenziation."""
 
-    def __init__(self, vocab_file, do_lower_case=True):
-        self.vocab = load_vocab(vocab_file)
-        self.inv_vocab = {v: k for k, v in self.vocab.items()}
+    def __init__(self, vocab_file, do_lower_case=True, compiled_vocab=None):
+        if compiled_vocab is None:
+            compiled_vocab = load_compiled_vocab(vocab_file)
+        self.vocab_file = vocab_file
+        self.do_lower_case = do_lower_case
+        self.vocab = compiled_vocab.vocab
+        self.inv_vocab = compiled_vocab.inv_vocab
+        self.id_to_token = compiled_vocab.id_to_token
         self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case)
         self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab)
+        # built on first use, see convert_chars_to_ids
+        self._char_id_table = None
+        self._other_char_ids = {}
 
     def tokenize(self, text):
         split_tokens = []
@@ -133,6 +234,53 @@ class FullTokenizer(object):
     def convert_ids_to_tokens(self, ids):
         return convert_by_vocab(self.inv_vocab, ids)
 
+    def _char_id(self, char):
+        # id of char as an item of char list inputs, -1 if
+        # tokenization drops it
+        if char == '\t':
+            # tab is the separator of char list inputs, replaced by space
+            char = ' '
+        tokens = self.tokenize(char)
+        if len(tokens) != 1:
+            return -1
+        return self.vocab.get(tokens[0], self.vocab['[UNK]'])
+
+    def convert_chars_to_ids(self, chars):
+        """Converts char list inputs to ids, same as tokenizing the tab
+        joined chars and converting tokens to ids, but with a lookup table
+        of code points, so that a char is only tokenized once per process.
+
+        Arguments:
+            chars {list} -- single characters
+
+        Returns:
+            tuple -- (ids, indices of chars that are dropped by
+                tokenization or are not single characters)
+        """
+        if self._char_id_table is None:
+            self._char_id_table = array(
+                'i', [self._char_id(chr(cp)) for cp in range(_CHAR_TABLE_SIZE)])
+        table = self._char_id_table
+        ids = []
+        dropped = []
+        for char_ind, char in enumerate(chars):
+            if len(char) != 1:
+                dropped.append(char_ind)
+                continue
+            cp = ord(char)
+            if cp < _CHAR_TABLE_SIZE:
+                char_id = table[cp]
+            else:
+                char_id = self._other_char_ids.get(char)
+                if char_id is None:
+                    char_id = self._char_id(char)
+                    self._other_char_ids[char] = char_id
+            if char_id < 0:
+                dropped.append(char_ind)
+            else:
+                ids.append(char_id)
+        return ids, dropped
+
 
 class BasicTokenizer(object):
     """Runs basic tokenization (punctuation splitting, lower casing, etc.)."""
@@ -144,11 +292,13 @@ class BasicTokenizer(object):
           do_lower_case: Whether to lower case the input.
         """
         self.do_lower_case = do_lower_case
+        # lower cased and accent stripped tokens, tokens are single
+        # characters or special tokens so this stays small
+        self._lower_tokens = {}
 
     def tokenize(self, text):
         """Tokenizes a piece of text."""
         text = convert_to_unicode(text)
-        text = self._clean_text(text)
 
         # This was added on November 1st, 2018 for the multilingual and Chinese
         # models. This is also applied to the English models now, but it doesn't
@@ -156,14 +306,17 @@ class BasicTokenizer(object):
         # and generally don't have any Chinese data in them (there are Chinese
         # characters in the vocabulary because Wikipedia does have some Chinese
         # words in the English Wikipedia.).
-        text = self._tokenize_chinese_chars(text)
-
-        orig_tokens = whitespace_tokenize(text)
+        # Cleaning splits text to single characters, so CJK characters are
+        # separated in the same scan, see _clean_and_split.
+        orig_tokens = self._clean_and_split(text)
         split_tokens = []
         for token in orig_tokens:
             if self.do_lower_case:
-                token = token.lower()
-                token = self._run_strip_accents(token)
+                lower_token = self._lower_tokens.get(token)
+                if lower_token is None:
+                    lower_token = self._run_strip_accents(token.lower())
+                    self._lower_tokens[token] = lower_token
+                token = lower_token
             # split_tokens.extend(self._run_split_on_punc(token))
             split_tokens.append(token)
 
@@ -175,8 +328,7 @@ class BasicTokenizer(object):
         text = unicodedata.normalize("NFD", text)
         output = []
         for char in text:
-            cat = unicodedata.category(char)
-            if cat == "Mn":
+            if _char_class(char) & _ACCENT:
                 output.append('[UNK]')
                 continue
             output.append(char)
@@ -206,8 +358,7 @@ class BasicTokenizer(object):
         """Adds whitespace around any CJK character."""
         output = []
         for char in text:
-            cp = ord(char)
-            if self._is_chinese_char(cp):
+            if _char_class(char) & _CHINESE:
                 output.append(" ")
                 output.append(char)
                 output.append(" ")
@@ -217,46 +368,45 @@ class BasicTokenizer(object):
 
     def _is_chinese_char(self, cp):
         """Checks whether CP is the codepoint of a CJK character."""
-        # This defines a "chinese character" as anything in the CJK Unicode block:
-        #   https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
-        #
-        # Note that the CJK Unicode block is NOT all Japanese and Korean characters,
-        # despite its name. The modern Korean Hangul alphabet is a different block,
-        # as is Japanese Hiragana and Katakana. Those alphabets are used to write
-        # space-separated words, so they are not treated specially and handled
-        # like the all of the other languages.
-        if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
-            (cp >= 0x3400 and cp <= 0x4DBF) or  #
-            (cp >= 0x20000 and cp <= 0x2A6DF) or  #
-            (cp >= 0x2A700 and cp <= 0x2B73F) or  #
-            (cp >= 0x2B740 and cp <= 0x2B81F) or  #
-            (cp >= 0x2B820 and cp <= 0x2CEAF) or
-            (cp >= 0xF900 and cp <= 0xFAFF) or  #
-                (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
-            return True
-
-        return False
+        return bool(_code_point_class(cp) & _CHINESE)
 
     def _clean_text(self, text):
         """Performs invalid character removal and whitespace cleanup on text."""
         output = []
 
         for char in text.split('\t'):
-            try:
-                cp = ord(char)
-            except:
+            if len(char) != 1:
                 for _ in char:
                     output.append('[UNK]')
                 continue
-            if cp == 0 or cp == 0xfffd or _is_control(char):
+            char_class = _char_class(char)
+            if char_class & _INVALID:
                 output.append('[UNK]')
                 continue
-            if _is_whitespace(char):
+            if char_class & _WHITESPACE:
                 output.append("[unused1]")
             else:
                 output.append(char)
         return " ".join(output)
 
+    def _clean_and_split(self, text):
+        """Same as whitespace_tokenize after _clean_text and
+        _tokenize_chinese_chars, in a single scan of text."""
+        output = []
+        for char in text.split('\t'):
+            if len(char) != 1:
+                for _ in char:
+                    output.append('[UNK]')
+                continue
+            char_class = _char_class(char)
+            if char_class & _INVALID:
+                output.append('[UNK]')
+            elif char_class & _WHITESPACE:
+                output.append("[unused1]")
+            elif not char_class & _SPLIT_SPACE:
+                output.append(char)
+        return output
+
 
 class WordpieceTokenizer(object):
     """Runs WordPiece tokenziation."""
@@ -265,12 +415,53 @@ class WordpieceTokenizer(object):
         self.vocab = vocab
         self.unk_token = unk_token
         self.max_input_chars_per_word = max_input_chars_per_word
+        # tries of vocab tokens and of continuation tokens without "##",
+        # built on first use
+        self._trie = None
+        self._continuation_trie = None
+
+    def _build_tries(self):
+        self._trie = {}
+        self._continuation_trie = {}
+        for token in self.vocab:
+            node = self._trie
+            if token.startswith("##"):
+                # also a token itself, e.g. "##" or "###"
+                _add_to_trie(node, token)
+                node = self._continuation_trie
+                token = token[2:]
+            _add_to_trie(node, token)
+
+    def _tokenize_word(self, word):
+        if len(word) > self.max_input_chars_per_word:
+            return [self.unk_token]
+
+        start = 0
+        sub_tokens = []
+        while start < len(word):
+            # longest vocab token that is a prefix of word[start:]
+            node = self._trie if start == 0 else self._continuation_trie
+            end = None
+            for char_ind in range(start, len(word)):
+                node = node.get(word[char_ind])
+                if node is None:
+                    break
+                if _TRIE_END in node:
+                    end = char_ind + 1
+            if end is None:
+                return [self.unk_token]
+            if start > 0:
+                sub_tokens.append("##" + word[start:end])
+            else:
+                sub_tokens.append(word[start:end])
+            start = end
+        return sub_tokens
 
     def tokenize(self, text):
         """Tokenizes a piece of text into its word pieces.
 
         This uses a greedy longest-match-first algorithm to perform tokenization
-        using the given vocabulary.
+        using the given vocabulary, matched with a trie of the vocabulary.
 
         For example:
           input = "unaffable"
@@ -283,78 +474,164 @@ class WordpieceTokenizer(object):
         Returns:
           A list of wordpiece tokens.
         """
+        if self._trie is None:
+            self._build_tries()
 
         text = convert_to_unicode(text)
 
         output_tokens = []
         for token in whitespace_tokenize(text):
-            chars = list(token)
-            if len(chars) > self.max_input_chars_per_word:
-                output_tokens.append(self.unk_token)
-                continue
+            output_tokens.extend(self._tokenize_word(token))
+        return output_tokens
 
-            is_bad = False
-            start = 0
-            sub_tokens = []
-            while start < len(chars):
-                end = len(chars)
-                cur_substr = None
-                while start < end:
-                    substr = "".join(chars[start:end])
-                    if start > 0:
-                        substr = "##" + substr
-                    if substr in self.vocab:
-                        cur_substr = substr
-                        break
-                    end -= 1
-                if cur_substr is None:
-                    is_bad = True
-                    break
-                sub_tokens.append(cur_substr)
-                start = end
+    def tokenize_many(self, texts):
+        """Tokenizes a batch of texts, words that occur several times in
+        the batch are only tokenized once.
 
-            if is_bad:
-                output_tokens.append(self.unk_token)
-            else:
-                output_tokens.extend(sub_tokens)
-        return output_tokens
+        Args:
+          texts: A list of texts, see `tokenize`.
 
+        Returns:
+          A list of lists of wordpiece tokens.
+        """
+        if self._trie is None:
+            self._build_tries()
 
-def _is_whitespace(char):
-    """Checks whether `chars` is a whitespace character."""
-    # \t, \n, and \r are technically contorl characters but we treat them
-    # as whitespace since they are generally considered as such.
-    if char == " " or char == "\t" or char == "\n" or char == "\r":
-        return True
+        word_pieces = {}
+        output = []
+        for text in texts:
+            output_tokens = []
+            for token in whitespace_tokenize(convert_to_unicode(text)):
+                if token not in word_pieces:
+                    word_pieces[token] = self._tokenize_word(token)
+                output_tokens.extend(word_pieces[token])
+            output.append(output_tokens)
+        return output
+
+
+# marks the end of a token in a trie node, chars are strings
+_TRIE_END = None
+
+
+def _add_to_trie(trie, token):
+    node = trie
+    for char in token:
+        node = node.setdefault(char, {})
+    node[_TRIE_END] = True
+
+
+# character classes, bit flags of _CHAR_CLASSES
+_WHITESPACE = 1
+_CONTROL = 2
+_PUNCTUATION = 4
+_CHINESE = 8
+# removed by _clean_text
+_INVALID = 16
+# non-spacing mark, removed by _run_strip_accents
+_ACCENT = 32
+# not whitespace of _is_whitespace, but split by str.split
+_SPLIT_SPACE = 64
+# see _is_dirty_char
+_DIRTY = 128
+
+
+def _compute_char_class(char):
+    """Character class of a single character, see _CHAR_CLASSES."""
+    cp = ord(char)
     cat = unicodedata.category(char)
-    if cat == "Zs":
-        return True
-    return False
+    char_class = 0
 
+    # \t, \n, and \r are technically contorl characters but we treat them
+    # as whitespace since they are generally considered as such.
+    if char == " " or char == "\t" or char == "\n" or char == "\r" or \
+            cat == "Zs":
+        char_class |= _WHITESPACE
+    elif char.isspace():
+        char_class |= _SPLIT_SPACE
 
-def _is_control(char):
-    """Checks whether `chars` is a control character."""
     # These are technically control characters but we count them as whitespace
     # characters.
-    if char == "\t" or char == "\n" or char == "\r":
-        return False
-    cat = unicodedata.category(char)
-    if cat.startswith("C"):
-        return True
-    return False
-
+    if char not in ("\t", "\n", "\r") and cat.startswith("C"):
+        char_class |= _CONTROL
 
-def _is_punctuation(char):
-    """Checks whether `chars` is a punctuation character."""
-    cp = ord(char)
     # We treat all non-letter/number ASCII as punctuation.
     # Characters such as "^", "$", and "`" are not in the Unicode
     # Punctuation class but we treat them as punctuation anyways, for
     # consistency.
     if ((cp >= 33 and cp <= 47) or (cp >= 58 and cp <= 64) or
-            (cp >= 91 and cp <= 96) or (cp >= 123 and cp <= 126)):
-        return True
-    cat = unicodedata.category(char)
-    if cat.startswith("P"):
-        return True
-    return False
+            (cp >= 91 and cp <= 96) or (cp >= 123 and cp <= 126) or
+            cat.startswith("P")):
+        char_class |= _PUNCTUATION
+
+    # This defines a "chinese character" as anything in the CJK Unicode block:
+    #   https://en.wikipedia.org/wiki/CJK_Unified_Ideographs_(Unicode_block)
+    #
+    # Note that the CJK Unicode block is NOT all Japanese and Korean characters,
+    # despite its name. The modern Korean Hangul alphabet is a different block,
+    # as is Japanese Hiragana and Katakana. Those alphabets are used to write
+    # space-separated words, so they are not treated specially and handled
+    # like the all of the other languages.
+    if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
+        (cp >= 0x3400 and cp <= 0x4DBF) or  #
+        (cp >= 0x20000 and cp <= 0x2A6DF) or  #
+        (cp >= 0x2A700 and cp <= 0x2B73F) or  #
+        (cp >= 0x2B740 and cp <= 0x2B81F) or  #
+        (cp >= 0x2B820 and cp <= 0x2CEAF) or
+        (cp >= 0xF900 and cp <= 0xFAFF) or  #
+            (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
+        char_class |= _CHINESE
+
+    if cp == 0 or cp == 0xfffd or char_class & _CONTROL:
+        char_class |= _INVALID
+
+    if cat == "Mn":
+        char_class |= _ACCENT
+
+    # decomposed or invalid after NFD normalization
+    normalized = unicodedata.normalize("NFD", char)
+    if len(normalized) > 1:
+        char_class |= _DIRTY
+    elif normalized != char:
+        if _compute_char_class(normalized) & _INVALID:
+            char_class |= _DIRTY
+    elif char_class & _INVALID:
+        char_class |= _DIRTY
+
+    return char_class
+
+
+# class of every code point of the BMP, other code points are
+# classified on the fly
+_CHAR_CLASSES = bytearray(
+    _compute_char_class(chr(cp)) for cp in range(_CHAR_TABLE_SIZE))
+
+
+def _code_point_class(cp):
+    if cp < _CHAR_TABLE_SIZE:
+        return _CHAR_CLASSES[cp]
+    return _compute_char_class(chr(cp))
+
+
+def _char_class(char):
+    return _code_point_class(ord(char))
+
+
+def _is_whitespace(char):
+    """Checks whether `chars` is a whitespace character."""
+    return bool(_char_class(char) & _WHITESPACE)
+
+
+def _is_control(char):
+    """Checks whether `chars` is a control character."""
+    return bool(_char_class(char) & _CONTROL)
+
+
+def _is_punctuation(char):
+    """Checks whether `chars` is a punctuation character."""
+    return bool(_char_class(char) & _PUNCTUATION)
+
+
+def _is_dirty_char(char):
+    """Checks whether `char` is decomposed by NFD normalization, or is
+    removed by cleaning after it."""
+    return bool(_char_class(char) & _DIRTY)
@@ -353,7 +353,7 @@ class LabelTransferHidden(TopLayer):
                     True,
                     'ave')
                 rnn_output.set_shape(
-                    [None, self.params.max_seq_len, input_hidden_size])
+                    [None, seq_features.shape[1], input_hidden_size])
             hidden_feature['seq'] = rnn_output
 
         return hidden_feature
@@ -69,7 +69,7 @@ class TopLayer():
                     mode)
 
                 new_hidden_feature.set_shape(
-                    [None, self.params.max_seq_len, self.params.bert_config.hidden_size])
+                    [None, hidden_feature.shape[1], self.params.bert_config.hidden_size])
 
                 self.hidden_model_logit = new_hidden_feature
 
@@ -149,7 +149,7 @@ def make_cudnngru(
         hidden_feature, hidden_size, output_hidden_size, merge_mode, params.dropout_keep_prob)
 
     rnn_output.set_shape(
-        [None, params.max_seq_len, output_hidden_size])
+        [None, hidden_feature.shape[1], output_hidden_size])
 
     if res_connection:
         hidden_feature_size = hidden_feature.get_shape().as_list()[-1]
@@ -184,15 +184,17 @@ def create_seq_smooth_label(params, labels, num_classes):
 
         true_labels = tf.stack(
             [labels]*int(num_classes/params.label_smoothing), axis=-1)
-        single_label_set = tf.stack([tf.range(
-            num_classes)]*params.max_seq_len, axis=0)
+        # seq length is not static with dynamic padding
+        seq_length_this_turn = tf.shape(labels)[1]
+        single_label_set = tf.tile(
+            tf.expand_dims(tf.range(num_classes), axis=0),
+            [seq_length_this_turn, 1])
         batch_size_this_turn = tf.shape(true_labels)[0]
         label_set = tf.broadcast_to(
             input=single_label_set, shape=[
                 batch_size_this_turn,
-                single_label_set.shape.as_list()[
-                    0],
-                single_label_set.shape.as_list()[1]])
+                seq_length_this_turn,
+                num_classes])
         sample_set = tf.concat([true_labels, label_set], axis=-1)
 
         dims = tf.shape(sample_set)
@@ -1,6 +1,6 @@
 import pickle
 import os
-import unicodedata
+import copy
 import random
 import collections
 from sklearn.base import BaseEstimator, TransformerMixin
@@ -8,7 +8,7 @@ from sklearn.base import BaseEstimator, TransformerMixin
 import numpy as np
 
 
-from .tokenization import (_is_control, FullTokenizer)
+from .tokenization import (_is_dirty_char, FullTokenizer)
 
 BOS_TOKEN = '[PAD]'
 EOS_TOKEN = '[SEP]'
@@ -110,6 +110,32 @@ class LabelEncoder(BaseEstimator, TransformerMixin):
         self.encode_dict = {v: k for k, v in self.decode_dict.items()}
 
 
+class InputContext():
+    """Input pipeline of this process, same attributes as
+    tf.distribute.InputContext of later tf versions.
+    """
+
+    def __init__(self, num_input_pipelines=1, input_pipeline_id=0):
+        self.num_input_pipelines = num_input_pipelines
+        self.input_pipeline_id = input_pipeline_id
+
+    def apply(self, params):
+        """Params of this input pipeline, the shared params are not
+        changed since generators of other pipelines(e.g. eval) may
+        still read them.
+
+        Arguments:
+            params {Params} -- params
+
+        Returns:
+            Params -- shallow copy of params with input sharding set
+        """
+        pipeline_params = copy.copy(params)
+        pipeline_params.num_input_pipelines = self.num_input_pipelines
+        pipeline_params.input_pipeline_id = self.input_pipeline_id
+        return pipeline_params
+
+
 def create_path(path):
     if not os.path.exists(path):
         os.makedirs(path, exist_ok=True)
@@ -124,7 +150,9 @@ def get_or_make_label_encoder(params, problem, mode, label_list=None, zero_class
         mode {mode} -- mode
 
     Keyword Arguments:
-        label_list {list} -- label list to fit the encoder (default: {None})
+        label_list {list or callable} -- label list to fit the encoder. If
+            callable, it is called to get the label list only when the
+            encoder is fitted (default: {None})
         zero_class {str} -- what to assign as 0 (default: {'O'})
 
     Returns:
@@ -137,6 +165,8 @@ def get_or_make_label_encoder(params, problem, mode, label_list=None, zero_class
     if mode == 'train' and not os.path.exists(le_path):
         label_encoder = LabelEncoder()
 
+        if callable(label_list):
+            label_list = label_list()
         label_encoder.fit(label_list, zero_class=zero_class)
 
         label_encoder.dump(le_path)
@@ -145,25 +175,83 @@ def get_or_make_label_encoder(params, problem, mode, label_list=None, zero_class
         label_encoder = LabelEncoder()
         label_encoder.load(le_path)
 
+    label_encoder.name = problem
     params.num_classes[problem] = len(label_encoder.encode_dict)
     if EOS_TOKEN in label_encoder.encode_dict:
         params.eos_id[problem] = int(
             label_encoder.transform([EOS_TOKEN])[0])
+    # labels are padded with [PAD], which is not always 0
+    params.label_pad_id[problem] = int(
+        label_encoder.transform([BOS_TOKEN])[0])
+
+    return label_encoder
+
+
+def get_label_pad_id(params, problem):
+    """Id of [PAD] label of problem, which labels are padded with.
+    The label encoder of problem is loaded if it is not known yet.
+
+    Arguments:
+        params {Params} -- params
+        problem {str} -- problem name
+
+    Returns:
+        int -- label pad id
+    """
+    if problem not in params.label_pad_id:
+        get_or_make_label_encoder(params, problem, EVAL)
+    return params.label_pad_id[problem]
+
+
+def get_label_encoder_labels(label_encoder):
+    """Get labels of label encoder ordered by label id
+
+    Arguments:
+        label_encoder {LabelEncoder} -- label encoder
+
+    Returns:
+        list -- labels, the i-th label is encoded as i
+    """
+    return [label_encoder.decode_dict[i]
+            for i in range(len(label_encoder.decode_dict))]
 
+
+def restore_label_encoder(params, name, labels):
+    """Restore label encoder from labels ordered by label id.
+    If label encoder does not exist in checkpoint dir, it will be
+    created with labels. If it exists but the labels are different,
+    None is returned.
+
+    Arguments:
+        params {Params} -- params
+        name {str} -- name of label encoder, same as the problem arg
+            of get_or_make_label_encoder
+        labels {list} -- labels ordered by label id
+
+    Returns:
+        LabelEncoder -- label encoder or None
+    """
+    create_path(params.ckpt_dir)
+    le_path = os.path.join(params.ckpt_dir, '%s_label_encoder.pkl' % name)
+    if not os.path.exists(le_path):
+        label_encoder = LabelEncoder()
+        label_encoder.decode_dict = dict(enumerate(labels))
+        label_encoder.encode_dict = {
+            v: k for k, v in label_encoder.decode_dict.items()}
+        label_encoder.dump(le_path)
+
+    label_encoder = get_or_make_label_encoder(params, name, EVAL)
+    if get_label_encoder_labels(label_encoder) != list(labels):
+        return None
     return label_encoder
 
 
 def get_dirty_text_ind(text):
     """Performs invalid character removal and whitespace cleanup on text."""
 
-    text = [unicodedata.normalize("NFD", t) for t in text]
     output = []
     for char_ind, char in enumerate(text):
-        if len(char) > 1:
-            output.append(char_ind)
-            continue
-        cp = ord(char)
-        if cp == 0 or cp == 0xfffd or _is_control(char):
+        if len(char) > 1 or _is_dirty_char(char):
             output.append(char_ind)
 
     return output
@@ -300,9 +388,9 @@ def punc_augument(raw_inputs, params):
 
 
 def create_instances_from_document(
-        all_documents, document_index, max_seq_length, short_seq_prob,
-        masked_lm_prob, max_predictions_per_seq, vocab_words, rng):
-    """Creates `TrainingInstance`s for a single document."""
+        all_documents, document_index, max_seq_length, short_seq_prob, rng):
+    """Creates `TrainingInstance`s for a single document. Tokens are
+    masked afterwards in batch, see MaskedLmMasker."""
     document = all_documents[document_index]
 
     # Account for [CLS], [SEP], [SEP]
@@ -403,15 +491,10 @@ def create_instances_from_document(
                 tokens.append("[SEP]")
                 segment_ids.append(1)
 
-                (tokens, masked_lm_positions,
-                 masked_lm_labels) = create_masked_lm_predictions(
-                     tokens, masked_lm_prob, max_predictions_per_seq, vocab_words, rng)
                 instance = TrainingInstance(
                     tokens=tokens,
                     segment_ids=segment_ids,
-                    is_random_next=is_random_next,
-                    masked_lm_positions=masked_lm_positions,
-                    masked_lm_labels=masked_lm_labels)
+                    is_random_next=is_random_next)
                 instances.append(instance)
             current_chunk = []
             current_length = 0
@@ -420,64 +503,94 @@ def create_instances_from_document(
     return instances
 
 
-MaskedLmInstance = collections.namedtuple("MaskedLmInstance",
-                                          ["index", "label"])
 TrainingInstance = collections.namedtuple("TrainingInstance",
                                           ['tokens', 'segment_ids',
-                                           'masked_lm_positions',
-                                           'masked_lm_labels',
                                            'is_random_next'])
 
 
-def create_masked_lm_predictions(tokens, masked_lm_prob,
-                                 max_predictions_per_seq, vocab_words, rng):
-    """Creates the predictions for the masked LM objective."""
-
-    cand_indexes = []
-    for (i, token) in enumerate(tokens):
-        if token == "[CLS]" or token == "[SEP]":
-            continue
-        cand_indexes.append(i)
-
-    rng.shuffle(cand_indexes)
-
-    output_tokens = list(tokens)
+class MaskedLmMasker():
+    """Create masked lm predictions for batches of input ids.
 
-    num_to_predict = min(max_predictions_per_seq,
-                         max(1, int(round(len(tokens) * masked_lm_prob))))
-
-    masked_lms = []
-    covered_indexes = set()
-    for index in cand_indexes:
-        if len(masked_lms) >= num_to_predict:
-            break
-        if index in covered_indexes:
-            continue
-        covered_indexes.add(index)
-
-        masked_token = None
-        # 80% of the time, replace with [MASK]
-        if rng.random() < 0.8:
-            masked_token = "[MASK]"
-        else:
-            # 10% of the time, keep original
-            if rng.random() < 0.5:
-                masked_token = tokens[index]
-            # 10% of the time, replace with random word
-            else:
-                masked_token = vocab_words[rng.randint(
-                    0, len(vocab_words) - 1)]
-
-        output_tokens[index] = masked_token
-
-        masked_lms.append(MaskedLmInstance(index=index, label=tokens[index]))
-
-    masked_lms = sorted(masked_lms, key=lambda x: x.index)
+    Candidates(all tokens except [CLS] and [SEP]) of every example are
+    ranked by random scores and the top num_to_predict are masked, which
+    is the same as shuffling candidates one example at a time. Masked
+    tokens are replaced by [MASK] 80% of the time, kept 10% of the time
+    and replaced by a random word 10% of the time.
+    """
 
-    masked_lm_positions = []
-    masked_lm_labels = []
-    for p in masked_lms:
-        masked_lm_positions.append(p.index)
-        masked_lm_labels.append(p.label)
+    def __init__(self, vocab, masked_lm_prob, max_predictions_per_seq, rng=None):
+        """
+        Arguments:
+            vocab {dict} -- token to id, e.g. FullTokenizer.vocab
+            masked_lm_prob {float} -- prob of a token being masked
+            max_predictions_per_seq {int} -- max number of masked tokens
 
-    return (output_tokens, masked_lm_positions, masked_lm_labels)
+        Keyword Arguments:
+            rng {np.random.RandomState} -- random state (default: {None})
+        """
+        self.masked_lm_prob = masked_lm_prob
+        self.max_predictions_per_seq = max_predictions_per_seq
+        self.vocab_size = len(vocab)
+        self.mask_id = vocab['[MASK]']
+        self.special_ids = np.array([vocab['[CLS]'], vocab['[SEP]']])
+        self.rng = rng if rng is not None else np.random.RandomState()
+
+    def mask(self, input_ids_list):
+        """Mask a batch of input ids
+
+        Arguments:
+            input_ids_list {list} -- list of list of ids, unpadded
+
+        Returns:
+            list -- list of (masked input ids, masked lm positions,
+                masked lm ids), positions are sorted
+        """
+        if not input_ids_list:
+            return []
+        lengths = np.array([len(ids) for ids in input_ids_list])
+        batch_size = len(input_ids_list)
+        max_len = int(lengths.max())
+
+        input_ids = np.zeros([batch_size, max_len], dtype=np.int64)
+        for ind, ids in enumerate(input_ids_list):
+            input_ids[ind, :len(ids)] = ids
+        is_valid = np.arange(max_len)[None, :] < lengths[:, None]
+        is_cand = is_valid & ~np.isin(input_ids, self.special_ids)
+
+        num_to_predict = np.minimum(
+            self.max_predictions_per_seq,
+            np.maximum(1, np.round(lengths * self.masked_lm_prob).astype(np.int64)))
+        num_to_predict = np.minimum(num_to_predict, is_cand.sum(axis=1))
+
+        # non candidates are ranked last
+        scores = np.where(is_cand, self.rng.random_sample(
+            [batch_size, max_len]), 2.0)
+        num_cols = min(self.max_predictions_per_seq, max_len)
+        top_positions = np.argsort(scores, axis=1)[:, :num_cols]
+        is_selected = np.arange(num_cols)[None, :] < num_to_predict[:, None]
+        # sort selected positions, unselected ones are moved to the end
+        positions = np.sort(
+            np.where(is_selected, top_positions, max_len), axis=1)
+        is_selected = positions < max_len
+        positions = np.where(is_selected, positions, 0)
+
+        label_ids = np.take_along_axis(input_ids, positions, axis=1)
+        dice = self.rng.random_sample(positions.shape)
+        random_ids = self.rng.randint(0, self.vocab_size, size=positions.shape)
+        replace_ids = np.where(
+            dice < 0.8, self.mask_id,
+            np.where(dice < 0.9, label_ids, random_ids))
+
+        rows = np.repeat(np.arange(batch_size)[:, None], num_cols, axis=1)
+        masked_input_ids = input_ids.copy()
+        masked_input_ids[rows[is_selected],
+                         positions[is_selected]] = replace_ids[is_selected]
+
+        outputs = []
+        for ind in range(batch_size):
+            num = int(num_to_predict[ind])
+            outputs.append((
+                masked_input_ids[ind, :lengths[ind]].tolist(),
+                positions[ind, :num].tolist(),
+                label_ids[ind, :num].tolist()))
+        return outputs
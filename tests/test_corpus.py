@@ -0,0 +1,25 @@
+import unittest
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from src.data_preprocessing.corpus import train_test_split_indices
+
+
+class TrainTestSplitIndicesTest(unittest.TestCase):
+
+    def test_same_as_sklearn(self):
+        for num_examples in [2, 7, 10, 333, 1000]:
+            for test_size in [0.1, 0.2, 0.5]:
+                for random_state in [0, 3, 1024]:
+                    train_ind, test_ind = train_test_split_indices(
+                        num_examples, test_size, random_state)
+                    expected_train, expected_test = train_test_split(
+                        np.arange(num_examples), test_size=test_size,
+                        random_state=random_state)
+                    np.testing.assert_array_equal(train_ind, expected_train)
+                    np.testing.assert_array_equal(test_ind, expected_test)
+
+
+if __name__ == '__main__':
+    unittest.main()
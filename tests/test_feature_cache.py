@@ -0,0 +1,122 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from src.params import Params
+from src.utils import get_or_make_label_encoder, TRAIN
+from src.feature_cache import (get_cache_path, labels_md5,
+                               load_feature_cache_manifest,
+                               read_feature_cache, write_feature_cache,
+                               MANIFEST_NAME)
+
+
+def make_params(base_dir):
+    params = Params()
+    params.ckpt_dir = os.path.join(base_dir, 'ckpt')
+    params.cache_dir = os.path.join(base_dir, 'cache')
+    params.vocab_file = os.path.join(base_dir, 'vocab.txt')
+    with open(params.vocab_file, 'w', encoding='utf8') as f:
+        f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']))
+    params.feature_cache = True
+    params.num_classes = {}
+    params.eos_id = {}
+    params.label_pad_id = {}
+    return params
+
+
+def make_features(num_examples):
+    return [{
+        'input_ids': list(range(i % 5 + 2)),
+        'input_mask': [1] * (i % 5 + 2),
+        'p_label_ids': i % 3,
+        'p_loss_multiplier': 1
+    } for i in range(num_examples)]
+
+
+class FeatureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.params = make_params(self.base_dir)
+        self.label_encoder = get_or_make_label_encoder(
+            self.params, 'p', TRAIN, label_list=['a', 'b'])
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def write(self, features):
+        return list(write_feature_cache(
+            self.params, 'p', TRAIN, self.label_encoder, iter(features)))
+
+    def test_round_trip(self):
+        features = make_features(23)
+        self.assertEqual(self.write(features), features)
+
+        feature_gen, label_encoder, num_examples = read_feature_cache(
+            self.params, 'p', TRAIN)
+        self.assertEqual(num_examples, 23)
+        self.assertEqual(label_encoder.encode_dict,
+                         self.label_encoder.encode_dict)
+        self.assertEqual(list(feature_gen), features)
+
+    def test_shuffle_and_start(self):
+        features = make_features(23)
+        self.write(features)
+
+        feature_gen, _, _ = read_feature_cache(
+            self.params, 'p', TRAIN, shuffle_seed=3)
+        shuffled = list(feature_gen)
+        self.assertNotEqual(shuffled, features)
+        self.assertEqual(
+            sorted(shuffled, key=json.dumps), sorted(features, key=json.dumps))
+
+        feature_gen, _, num_examples = read_feature_cache(
+            self.params, 'p', TRAIN, shuffle_seed=3, start=10)
+        self.assertEqual(num_examples, 13)
+        self.assertEqual(list(feature_gen), shuffled[10:])
+
+        feature_gen, _, _ = read_feature_cache(
+            self.params, 'p', TRAIN, start=10)
+        self.assertEqual(list(feature_gen), features[10:])
+
+    def test_partial_write_is_dropped(self):
+        feature_gen = write_feature_cache(
+            self.params, 'p', TRAIN, self.label_encoder,
+            iter(make_features(5)))
+        next(feature_gen)
+        feature_gen.close()
+        self.assertEqual(
+            read_feature_cache(self.params, 'p', TRAIN), (None, None, None))
+
+    def test_miss_without_label_encoder_in_ckpt_dir(self):
+        self.write(make_features(3))
+        os.remove(os.path.join(self.params.ckpt_dir, 'p_label_encoder.pkl'))
+        self.assertEqual(
+            read_feature_cache(self.params, 'p', TRAIN), (None, None, None))
+
+    def test_labels_mismatch(self):
+        self.write(make_features(3))
+        other_label_encoder = get_or_make_label_encoder(
+            self.params, 'q', TRAIN, label_list=['a', 'b', 'c'])
+        self.assertEqual(
+            read_feature_cache(self.params, 'p', TRAIN,
+                               label_encoder=other_label_encoder),
+            (None, None, None))
+
+        labels = ['[PAD]', 'a', 'b']
+        manifest_path = os.path.join(
+            get_cache_path(self.params, 'p', TRAIN),
+            labels_md5(labels)[:12], MANIFEST_NAME)
+        with open(manifest_path, 'r', encoding='utf8') as f:
+            manifest = json.load(f)
+        manifest['labels'] = ['[PAD]', 'b', 'a']
+        with open(manifest_path, 'w', encoding='utf8') as f:
+            json.dump(manifest, f)
+        with self.assertRaises(ValueError):
+            load_feature_cache_manifest(self.params, 'p', TRAIN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import json
+import unittest
+import collections
+from unittest import mock
+
+from src.params import Params
+from src.input_state import InputState
+from src import create_generators
+
+
+def make_delta(problem_positions, chunk_ind=0, run_left=0):
+    return InputState.create_position_delta(
+        problem_positions, {'num_drawn': len(problem_positions)},
+        chunk_ind, run_left)
+
+
+class InputStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.input_state = InputState()
+        self.input_state.start(
+            {'shuffle_base_seed': 7, 'feature_cache': True},
+            InputState.create_position(
+                {'a': 0, 'b': 1}, {'a': 0, 'b': 5}, None, 0, 0))
+
+    def test_not_started(self):
+        self.assertIsNone(InputState().snapshot())
+
+    def test_start(self):
+        self.assertEqual(self.input_state.snapshot(), {
+            'shuffle_base_seed': 7,
+            'feature_cache': True,
+            'problem_epoch': {'a': 0, 'b': 1},
+            'problem_offset': {'a': 0, 'b': 5},
+            'sampler_state': None,
+            'chunk_ind': 0,
+            'run_left': 0
+        })
+
+    def test_consume(self):
+        self.input_state.produce(make_delta([('a', 0, 1)]))
+        self.input_state.produce(make_delta([('a', 0, 2), ('b', 1, 6)], 1, 3))
+        self.input_state.produce(make_delta([('b', 2, 0)], 1, 2))
+
+        # yielded but not read examples do not move the position
+        self.assertEqual(
+            self.input_state.snapshot()['problem_offset'], {'a': 0, 'b': 5})
+
+        self.input_state.consume(2)
+        state = self.input_state.snapshot()
+        self.assertEqual(state['problem_epoch'], {'a': 0, 'b': 1})
+        self.assertEqual(state['problem_offset'], {'a': 2, 'b': 6})
+        self.assertEqual(state['sampler_state'], {'num_drawn': 2})
+        self.assertEqual((state['chunk_ind'], state['run_left']), (1, 3))
+
+        # more than yielded, e.g. padded batches
+        self.input_state.consume(5)
+        state = self.input_state.snapshot()
+        self.assertEqual(state['problem_epoch'], {'a': 0, 'b': 2})
+        self.assertEqual(state['problem_offset'], {'a': 2, 'b': 0})
+        self.assertEqual(state['run_left'], 2)
+
+    def test_snapshot_is_a_copy(self):
+        state = self.input_state.snapshot()
+        self.input_state.produce(make_delta([('a', 0, 1)]))
+        self.input_state.consume(1)
+        self.assertEqual(state['problem_offset'], {'a': 0, 'b': 5})
+        self.assertEqual(json.loads(json.dumps(state)), state)
+
+    def test_restart(self):
+        self.input_state.produce(make_delta([('a', 0, 1)]))
+        self.input_state.start(
+            {'shuffle_base_seed': 7, 'feature_cache': True},
+            InputState.create_position({'a': 3}, {'a': 4}, None, 0, 0))
+        self.input_state.consume(1)
+        self.assertEqual(
+            self.input_state.snapshot()['problem_offset'], {'a': 4})
+
+
+def make_params():
+    params = Params()
+    params.run_problem_list = [
+        {'a': 'cls'}, {'b': 'cls'}, {'c': 'cls', 'd': 'cls'}]
+    params.problem_type = {'a': 'cls', 'b': 'cls', 'c': 'cls', 'd': 'cls'}
+    params.ckpt_dir = '/nonexistent'
+    params.max_seq_len = 8
+    params.resumable_input = True
+    params.data_num_dict = {'a': 7, 'b': 11, 'c': 5, 'd': 5}
+
+    def make_read_fn(problem):
+        def read_fn(params, mode, start=0):
+            raw_examples = list(range(params.data_num_dict[problem]))[start:]
+            raw_positions = collections.deque()
+
+            def feature_gen():
+                for ind, raw_example in enumerate(raw_examples):
+                    # broken examples are skipped by featurization
+                    if (raw_example + 1) % 4 == 0:
+                        continue
+                    raw_positions.append(ind)
+                    yield {'input_ids': [raw_example],
+                           '%s_label_ids' % problem: raw_example}
+            return create_generators.ProblemGenerator(
+                feature_gen(), len(raw_examples), None, start=start,
+                raw_positions=raw_positions)
+        return read_fn
+    params.read_data_fn = {
+        problem: make_read_fn(problem) for problem in params.problem_type}
+    return params
+
+
+def to_key(example):
+    return sorted((k, json.dumps(v)) for k, v in example.items())
+
+
+class ResumeTest(unittest.TestCase):
+
+    def run_generator(self, num_examples, batch_size, saved_state):
+        input_state = InputState()
+        with mock.patch.object(create_generators, 'load_input_state',
+                               return_value=saved_state):
+            example_gen = create_generators.create_generator(
+                make_params(), 'train', 1, batch_size=batch_size,
+                input_state=input_state)
+            examples = [to_key(next(example_gen))
+                        for _ in range(num_examples)]
+        return examples, input_state
+
+    def test_resume(self):
+        for batch_size in [None, 3]:
+            for num_consumed in [0, 1, 5, 17, 40]:
+                examples, input_state = self.run_generator(
+                    num_consumed + 60, batch_size, None)
+                input_state.consume(num_consumed)
+                saved_state = json.loads(json.dumps(input_state.snapshot()))
+
+                resumed, _ = self.run_generator(60, batch_size, saved_state)
+                self.assertEqual(resumed, examples[num_consumed:])
+
+
+if __name__ == '__main__':
+    unittest.main()
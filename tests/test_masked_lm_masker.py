@@ -0,0 +1,83 @@
+import unittest
+
+import numpy as np
+
+from src.utils import MaskedLmMasker
+
+VOCAB = {t: i for i, t in enumerate(
+    ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] +
+    ['w%d' % i for i in range(95)])}
+CLS_ID, SEP_ID, MASK_ID = VOCAB['[CLS]'], VOCAB['[SEP]'], VOCAB['[MASK]']
+
+
+def make_input_ids(rng, lengths):
+    input_ids_list = []
+    for length in lengths:
+        ids = rng.randint(5, len(VOCAB), size=length).tolist()
+        ids[0] = CLS_ID
+        ids[-1] = SEP_ID
+        if length > 6:
+            ids[length // 2] = SEP_ID
+        input_ids_list.append(ids)
+    return input_ids_list
+
+
+class MaskedLmMaskerTest(unittest.TestCase):
+
+    def test_mask(self):
+        rng = np.random.RandomState(0)
+        masked_lm_prob, max_predictions_per_seq = 0.15, 5
+        masker = MaskedLmMasker(
+            VOCAB, masked_lm_prob, max_predictions_per_seq,
+            rng=np.random.RandomState(1))
+        input_ids_list = make_input_ids(rng, [2, 3, 10, 40, 128])
+        outputs = masker.mask(input_ids_list)
+        self.assertEqual(len(outputs), len(input_ids_list))
+
+        for input_ids, (masked_ids, positions, label_ids) in zip(
+                input_ids_list, outputs):
+            num_cand = sum(i not in (CLS_ID, SEP_ID) for i in input_ids)
+            num_to_predict = min(
+                max_predictions_per_seq, num_cand,
+                max(1, int(round(len(input_ids) * masked_lm_prob))))
+            self.assertEqual(len(masked_ids), len(input_ids))
+            self.assertEqual(len(positions), num_to_predict)
+            self.assertEqual(positions, sorted(set(positions)))
+            self.assertEqual(label_ids, [input_ids[p] for p in positions])
+            for pos, (orig_id, masked_id) in enumerate(
+                    zip(input_ids, masked_ids)):
+                if pos in positions:
+                    self.assertNotIn(orig_id, (CLS_ID, SEP_ID))
+                else:
+                    self.assertEqual(masked_id, orig_id)
+
+    def test_replace_rate(self):
+        rng = np.random.RandomState(0)
+        masker = MaskedLmMasker(
+            VOCAB, 0.15, 20, rng=np.random.RandomState(1))
+        num_masked = num_mask_id = num_kept = 0
+        for _ in range(50):
+            input_ids_list = make_input_ids(rng, [128] * 20)
+            for input_ids, (masked_ids, positions, _) in zip(
+                    input_ids_list, masker.mask(input_ids_list)):
+                for pos in positions:
+                    num_masked += 1
+                    num_mask_id += masked_ids[pos] == MASK_ID
+                    num_kept += masked_ids[pos] == input_ids[pos]
+        self.assertAlmostEqual(num_mask_id / num_masked, 0.8, delta=0.02)
+        # random words are sometimes the same word
+        self.assertAlmostEqual(num_kept / num_masked, 0.1, delta=0.02)
+
+    def test_seed(self):
+        input_ids_list = make_input_ids(
+            np.random.RandomState(0), [10, 30, 60])
+        outputs = [
+            MaskedLmMasker(VOCAB, 0.15, 20,
+                           rng=np.random.RandomState(1)).mask(input_ids_list)
+            for _ in range(2)]
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(MaskedLmMasker(VOCAB, 0.15, 20).mask([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
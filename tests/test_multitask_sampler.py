@@ -0,0 +1,64 @@
+import json
+import unittest
+
+import numpy as np
+
+from src.create_generators import MultitaskSampler
+
+
+class MultitaskSamplerTest(unittest.TestCase):
+
+    def test_sample_prob(self):
+        data_num_list = [100, 300, 600]
+        np.testing.assert_allclose(
+            MultitaskSampler(data_num_list).sample_prob, [0.1, 0.3, 0.6])
+        np.testing.assert_allclose(
+            MultitaskSampler(data_num_list, 'problem_balanced').sample_prob,
+            [1 / 3] * 3)
+        weights = np.power(data_num_list, 0.5)
+        np.testing.assert_allclose(
+            MultitaskSampler(data_num_list, 'temperature_scaled',
+                             temperature=2.0).sample_prob,
+            weights / weights.sum())
+        with self.assertRaises(ValueError):
+            MultitaskSampler(data_num_list, 'unknown')
+
+    def test_alias_table(self):
+        # every chunk gets prob of its own column and the rest of
+        # the columns aliased to it
+        for data_num_list in [[1], [1, 1], [5, 1, 1, 3], [1, 2, 3, 4, 1000]]:
+            sampler = MultitaskSampler(data_num_list)
+            num_chunks = len(data_num_list)
+            prob = np.array(sampler.prob)
+            for ind in range(num_chunks):
+                prob[ind] += np.sum(
+                    1.0 - sampler.prob[(sampler.alias == ind) &
+                                       (np.arange(num_chunks) != ind)])
+            np.testing.assert_allclose(
+                prob / num_chunks, sampler.sample_prob, atol=1e-12)
+
+    def test_distribution(self):
+        sampler = MultitaskSampler([1, 2, 7], block_size=1000)
+        sampler.rng.seed(0)
+        samples = [next(sampler) for _ in range(100000)]
+        freq = np.bincount(samples, minlength=3) / len(samples)
+        np.testing.assert_allclose(freq, [0.1, 0.2, 0.7], atol=0.01)
+
+    def test_state_restore(self):
+        sampler = MultitaskSampler([1, 2, 7], block_size=16)
+        sampler.rng.seed(0)
+        # fresh state, mid block and at block boundary
+        for num_skip in [0, 5, 11, 16]:
+            for _ in range(num_skip):
+                next(sampler)
+            # states are saved as json with checkpoints
+            state = json.loads(json.dumps(sampler.get_state()))
+            expected = [next(sampler) for _ in range(40)]
+
+            restored = MultitaskSampler([1, 2, 7], block_size=16)
+            restored.set_state(state)
+            self.assertEqual([next(restored) for _ in range(40)], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from src.params import Params
+from src.create_generators import _pack_examples, create_packed_generator
+
+
+def make_params(max_seq_len=8, max_pack_num=3):
+    params = Params()
+    params.max_seq_len = max_seq_len
+    params.max_pack_num = max_pack_num
+    return params
+
+
+def make_example(ids, label=None, loss_multiplier=1, max_seq_len=8):
+    pad = [0] * (max_seq_len - len(ids))
+    example = {
+        'input_ids': ids + pad,
+        'input_mask': [1] * len(ids) + pad,
+        'segment_ids': [0] * len(ids) + pad,
+        'a_loss_multiplier': loss_multiplier
+    }
+    if label is not None:
+        example['a_label_ids'] = label
+    return example
+
+
+class PackExamplesTest(unittest.TestCase):
+
+    def test_pack(self):
+        params = make_params()
+        examples = [make_example([2, 5, 3], label=1),
+                    make_example([2, 6, 7, 3], label=2)]
+        packed = _pack_examples(examples, params)
+
+        self.assertEqual(packed['input_ids'], [2, 5, 3, 2, 6, 7, 3, 0])
+        self.assertEqual(packed['input_mask'], [1] * 7 + [0])
+        self.assertEqual(packed['segment_ids'], [0] * 8)
+        self.assertEqual(packed['position_ids'], [0, 1, 2, 0, 1, 2, 3, 0])
+        self.assertEqual(packed['pack_ids'], [1, 1, 1, 2, 2, 2, 2, 0])
+        self.assertEqual(packed['pack_token_positions'], [
+            [0, 1, 2, 0, 0, 0, 0, 0],
+            [3, 4, 5, 6, 0, 0, 0, 0],
+            [0] * 8])
+        self.assertEqual(packed['pack_input_mask'], [
+            examples[0]['input_mask'], examples[1]['input_mask'], [0] * 8])
+        # slot features are stacked, empty slots are zeros
+        self.assertEqual(packed['a_label_ids'], [1, 2, 0])
+        self.assertEqual(packed['a_loss_multiplier'], [1, 1, 0])
+
+    def test_missing_slot_features(self):
+        params = make_params()
+        examples = [make_example([2, 3], label=[0, 4]),
+                    make_example([2, 3])]
+        packed = _pack_examples(examples, params)
+        self.assertEqual(packed['a_label_ids'], [[0, 4], [0, 0], [0, 0]])
+
+    def test_packed_generator(self):
+        params = make_params(max_seq_len=8, max_pack_num=2)
+        lengths = [3, 4, 2, 2, 2, 8, 1]
+        examples = [make_example(list(range(1, n + 1))) for n in lengths]
+        packed = list(create_packed_generator(params, iter(examples)))
+
+        # rows are full by tokens or by max_pack_num
+        self.assertEqual([row['pack_ids'] for row in packed], [
+            [1, 1, 1, 2, 2, 2, 2, 0],
+            [1, 1, 2, 2, 0, 0, 0, 0],
+            [1, 1, 0, 0, 0, 0, 0, 0],
+            [1] * 8,
+            [1, 0, 0, 0, 0, 0, 0, 0]])
+        self.assertEqual(
+            sum(sum(row['a_loss_multiplier']) for row in packed),
+            len(examples))
+
+
+if __name__ == '__main__':
+    unittest.main()
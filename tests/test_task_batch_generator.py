@@ -0,0 +1,53 @@
+import unittest
+
+from src.input_fn import task_batch_generator
+
+
+def make_example(chunk, length):
+    return {
+        'input_ids': [1] * length,
+        'a_label_ids': [2] * length,
+        'a_loss_multiplier': int(chunk == 'a'),
+        'b_loss_multiplier': int(chunk == 'b')
+    }
+
+
+def batch_chunks(batch):
+    return {k for k in ['a', 'b']
+            if any(batch['%s_loss_multiplier' % k])}
+
+
+class TaskBatchGeneratorTest(unittest.TestCase):
+
+    def test_batches_of_one_chunk(self):
+        chunks = ['a'] * 5 + ['b'] * 2 + ['a'] * 3
+        examples = [make_example(c, 3) for c in chunks]
+        batches = list(task_batch_generator(iter(examples), 3))
+
+        self.assertEqual([len(b['input_ids']) for b in batches],
+                         [3, 2, 2, 3])
+        self.assertEqual([batch_chunks(b) for b in batches],
+                         [{'a'}, {'a'}, {'b'}, {'a'}])
+
+    def test_padding(self):
+        examples = [make_example('a', 2), make_example('a', 4)]
+        batch, = list(task_batch_generator(
+            iter(examples), 4, padding_values={'a_label_ids': 7}))
+        self.assertEqual(batch['input_ids'], [[1, 1, 0, 0], [1, 1, 1, 1]])
+        self.assertEqual(batch['a_label_ids'], [[2, 2, 7, 7], [2, 2, 2, 2]])
+        self.assertEqual(batch['a_loss_multiplier'], [1, 1])
+
+    def test_token_budget(self):
+        lengths = [2, 2, 2, 5, 5, 1]
+        examples = [make_example('a', n) for n in lengths]
+        batches = list(task_batch_generator(
+            iter(examples), 10, token_budget=10))
+        # padded to the longest example of batch
+        self.assertEqual([len(b['input_ids']) for b in batches], [3, 2, 1])
+        for batch in batches:
+            self.assertLessEqual(
+                len(batch['input_ids']) * len(batch['input_ids'][0]), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.bert import tokenization as bert_tokenization
+from src.tokenization import FullTokenizer, WordpieceTokenizer
+
+VOCAB_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', '[unused1]',
+                'a', 'b', 'c', 'e', 'é', '中', '文', ',', '!', '#', '##',
+                '###', 'ab', 'abc', '##b', '##bc', '##c', '##a', '##ca',
+                'un', '##aff', '##able', '##中', '😀']
+
+
+class ConvertCharsToIdsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        vocab_file = os.path.join(self.base_dir, 'vocab.txt')
+        with open(vocab_file, 'w', encoding='utf8') as f:
+            f.write('\n'.join(VOCAB_TOKENS))
+        self.tokenizer = FullTokenizer(vocab_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def assert_same_as_tokenize(self, chars):
+        ids, dropped = self.tokenizer.convert_chars_to_ids(chars)
+        tokens = self.tokenizer.tokenize('\t'.join(chars))
+        if dropped:
+            self.assertNotEqual(len(tokens), len(chars))
+            self.assertEqual(len(ids), len(chars) - len(dropped))
+        else:
+            self.assertEqual(
+                ids, self.tokenizer.convert_tokens_to_ids(tokens))
+
+    def test_same_as_tokenize(self):
+        self.assert_same_as_tokenize(
+            ['A', 'é', 'É', '中', '文', ' ', ',', '!', '　', 'x',
+             '\x00', '😀', '𝕏'])
+
+    def test_dropped(self):
+        ids, dropped = self.tokenizer.convert_chars_to_ids(
+            ['a', '\u2028', 'ab', '', 'b'])
+        self.assertEqual(dropped, [1, 2, 3])
+        self.assertEqual(ids, self.tokenizer.convert_tokens_to_ids(['a', 'b']))
+        self.assert_same_as_tokenize(['a', '\u2028', 'b'])
+
+    def test_random_chars(self):
+        rng = np.random.RandomState(0)
+        code_points = np.concatenate([
+            rng.randint(1, 0x3000, size=300),
+            rng.randint(0x4e00, 0x9fff, size=100),
+            rng.randint(0x10000, 0x1ffff, size=50)])
+        chars = [chr(cp) for cp in code_points if chr(cp) != '\t']
+        for ind in range(0, len(chars), 10):
+            self.assert_same_as_tokenize(chars[ind:ind + 10])
+
+
+class WordpieceTokenizerTest(unittest.TestCase):
+
+    def test_same_as_bert(self):
+        vocab = {t: i for i, t in enumerate(VOCAB_TOKENS)}
+        tokenizer = WordpieceTokenizer(vocab, max_input_chars_per_word=8)
+        bert_tokenizer = bert_tokenization.WordpieceTokenizer(
+            vocab, max_input_chars_per_word=8)
+
+        texts = ['unaffable', 'abcabc', 'abca ab# a##b', '### ## #',
+                 '中中 文中', 'abd', 'ca', 'abcabcabc', '']
+        rng = np.random.RandomState(0)
+        chars = ['a', 'b', 'c', '#', '中', 'd']
+        for _ in range(200):
+            words = [''.join(rng.choice(chars, size=rng.randint(1, 6)))
+                     for _ in range(rng.randint(1, 4))]
+            texts.append(' '.join(words))
+
+        expected = [bert_tokenizer.tokenize(text) for text in texts]
+        self.assertEqual(
+            [tokenizer.tokenize(text) for text in texts], expected)
+        self.assertEqual(tokenizer.tokenize_many(texts), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()